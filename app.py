@@ -1,60 +1,63 @@
+import glob
+import os
+
 import dash
-import dash_core_components as dcc
-import dash_html_components as html
-import pandas as pd
+import flask
+from dash import dcc
+from dash import html
 import plotly.graph_objs as go
 import numpy as np
 
+from tristats import store
+from tristats.encoding import binary_figure, bundle_version, race_bundle
+from tristats.memo import OutputCache, SqliteCache, code_version
+from tristats.registry import RaceRegistry
+from tristats.stats import DistributionCache, compare_side, shared_bins
+from tristats.times import format_seconds, time_ticks
+
 
-app = dash.Dash()
+# CSS from Dash tutorial (responses are gzip/brotli compressed via Flask-Compress)
+app = dash.Dash(__name__, external_stylesheets=["https://codepen.io/chriddyp/pen/bWLwgP.css"], compress=True)
 server = app.server
 
 app.title = 'tristats: Triathlon Stats Comparison Tool'
 
-# CSS from Dash tutorial
-app.css.append_css({"external_url": "https://codepen.io/chriddyp/pen/bWLwgP.css"})
-
 colors = {
     'background': '#000000',
     'text': '#7FDBFF'
 }
 
-hampton17sprint = pd.read_csv('Data_output/results_hampton17sprint.csv')
-hampton18sprint = pd.read_csv('Data_output/results_hampton18sprint.csv')
-rockwood17sprint = pd.read_csv('Data_output/results_rockwood17sprint.csv')
-rockwood18sprint = pd.read_csv('Data_output/results_rockwood18sprint.csv')
+# Races are memory-mapped from the columnar store (built from Data_output/ on first use)
+race_store = store.open_store('Data_store')
 
-available_sports = np.array(['finish', 'swim', 'bike', 'run', 't1', 't2'])
-available_distributions = np.array(['All', 'Gender', 'Division'])
+# Races are loaded on first use and the least recently used are evicted past the memory budget
+race_registry = RaceRegistry(race_store, max_bytes=int(os.environ.get('TRISTATS_RACE_CACHE_MB', 256)) * 2**20)
 
-# Set up dictionary to access df names based on race and year selections
-race_options = {
-    'Rockwood': {
-        '2017': ["rockwood17sprint"],
-        '2018': ["rockwood18sprint"]
-    },
-    'Hampton': {
-        '2017': ["hampton17sprint"],
-        '2018': ["hampton18sprint"]
-    }
-}
+# Sorted times, quartiles, and bin counts per (race, year, sport, distribution), shared by all athletes
+distributions = DistributionCache(race_registry)
 
-# eval(race_dataframes['Rockwood']['2018'][0])
-# gives the dataframe `rockwood18sprint`
+# Comparison outputs by normalized selection, so popular comparisons are served from memory,
+#   backed by a store shared by all workers (TRISTATS_SHARED_CACHE is its path; empty turns it off)
+shared_cache_path = os.environ.get('TRISTATS_SHARED_CACHE', os.path.join('Data_cache', 'outputs.sqlite'))
+# Version of the code building the outputs (app.py and tristats/), part of every cache key
+app_dir = os.path.dirname(os.path.abspath(__file__))
+output_version = code_version([os.path.join(app_dir, 'app.py')] + glob.glob(os.path.join(app_dir, 'tristats', '*.py')))
+comparison_cache = OutputCache(max_bytes=int(os.environ.get('TRISTATS_OUTPUT_CACHE_MB', 64)) * 2**20,
+                               ttl=int(os.environ.get('TRISTATS_OUTPUT_CACHE_TTL', 3600)),
+                               shared=SqliteCache(shared_cache_path) if shared_cache_path else None)
 
-def convert_min_to_time(time):
-    """
-    Convert a numeric representing decimal minutes to a character string
-    in mm:ss or hh:mm:ss format as appropriate.
-    """
-    hours = int(time/60)
-    minutes = time - (hours*60)
-    seconds = round((time - int(time))*60)
-    #seconds_decimal = (seconds - int(seconds))*100
-    if (hours > 0):
-        return("%d:%02d:%02d" % (hours, minutes, seconds))
-    else:
-        return("%02d:%02d" % (minutes, seconds))
+# Past this many times, boxplots are drawn from the cached quartiles instead of every point
+max_box_points = 2000
+
+# Number of athletes sent to an athlete dropdown at once (more turn up as you type)
+athlete_page_size = 50
+
+# In clientside mode, each selected race is sent to the browser once as a compact bundle
+#   and the comparison text and plots are computed there (assets/tristats.js)
+clientside_mode = os.environ.get('TRISTATS_CLIENTSIDE') == '1'
+
+available_sports = np.array(['finish', 'swim', 'bike', 'run', 't1', 't2'])
+available_distributions = np.array(['All', 'Gender', 'Division'])
 
 def convert_numeric_to_ordinal(value):
     """
@@ -129,7 +132,7 @@ app.layout = html.Div([
                 html.H6('Select first race, year, and athlete:', style={'color': 'rgb(22, 96, 167)'}),
                 dcc.Dropdown(
                     id='race-dropdown-left',
-                    options=[{'label': i, 'value': i} for i in race_options.keys()],
+                    options=[{'label': i, 'value': i} for i in race_registry.races()],
                     value='Rockwood'
                 ),
 
@@ -147,7 +150,7 @@ app.layout = html.Div([
                 html.H6('Select second race, year, and athlete:', style={'color': 'rgb(205, 12, 24)'}),
                 dcc.Dropdown(
                     id='race-dropdown-right',
-                    options=[{'label': i, 'value': i} for i in race_options.keys()],
+                    options=[{'label': i, 'value': i} for i in race_registry.races()],
                     value='Rockwood'
                 ),
 
@@ -231,6 +234,23 @@ app.layout = html.Div([
         # Text comparing speeds
         html.Div(id='comparison-text'),
 
+        # Resolved selections for each side, and the distributions currently drawn in the plots
+        #   (so athlete changes can patch just the athlete traces)
+        dcc.Store(id='selection-left'),
+        dcc.Store(id='selection-right'),
+        dcc.Store(id='figure-state'),
+
+        # Race bundles held in the browser (with their versions, so the server
+        #   can tell which it holds without the bundle being sent back), and
+        #   each side's year and athlete
+        #   (clientside mode only: the browser resolves the distribution)
+        dcc.Store(id='race-bundle-left'),
+        dcc.Store(id='race-bundle-right'),
+        dcc.Store(id='race-bundle-version-left'),
+        dcc.Store(id='race-bundle-version-right'),
+        dcc.Store(id='athlete-selection-left'),
+        dcc.Store(id='athlete-selection-right'),
+
         # Boxplot container
         html.Div([
             dcc.Graph(id='boxplot-1')
@@ -364,298 +384,447 @@ app.layout = html.Div([
 # Callbacks
 #------------#
 
-# Set race year options based on selected race
-#   (left)
-@app.callback(
-    dash.dependencies.Output('year-dropdown-left', 'options'),
-    [dash.dependencies.Input('race-dropdown-left', 'value')])
-def set_year_options(selected_race):
-    return [{'label': i, 'value': i} for i in sorted(list(race_options[selected_race].keys()), reverse=True)]
-
-#   (right)
-@app.callback(
-    dash.dependencies.Output('year-dropdown-right', 'options'),
-    [dash.dependencies.Input('race-dropdown-right', 'value')])
-def set_year_options(selected_race):
-    # return [{'label': i, 'value': i} for i in race_options[selected_race]]
-    return [{'label': i, 'value': i} for i in sorted(list(race_options[selected_race].keys()), reverse=True)]
-
-# Set race year initial value based on selected race and above options
-#   (left)
-@app.callback(
-    dash.dependencies.Output('year-dropdown-left', 'value'),
-    [dash.dependencies.Input('year-dropdown-left', 'options')])
-def set_year_value(year_options):
-    return year_options[0]['value']
-
-#   (right)
-@app.callback(
-    dash.dependencies.Output('year-dropdown-right', 'value'),
-    [dash.dependencies.Input('year-dropdown-right', 'options')])
-def set_year_value(year_options):
-    return year_options[0]['value']
-
-# Set athlete options based on selected race and year
-#   (left)
-@app.callback(
-    dash.dependencies.Output('athlete-dropdown-left', 'options'),
-    [dash.dependencies.Input('race-dropdown-left', 'value'),
-    dash.dependencies.Input('year-dropdown-left', 'value')])
-def set_athlete_options(selected_race, selected_year):
-    return [{'label': i, 'value': i} for i in sorted(list(eval(race_options[selected_race][selected_year][0])["name"]))]
-
-#   (right)
-@app.callback(
-    dash.dependencies.Output('athlete-dropdown-right', 'options'),
-    [dash.dependencies.Input('race-dropdown-right', 'value'),
-    dash.dependencies.Input('year-dropdown-right', 'value')])
-def set_athlete_options(selected_race, selected_year):
-    return [{'label': i, 'value': i} for i in sorted(list(eval(race_options[selected_race][selected_year][0])["name"]))]
-
-# Set athlete initial value based on selected race and year and above options
-#   (left)
-@app.callback(
-    dash.dependencies.Output('athlete-dropdown-left', 'value'),
-    [dash.dependencies.Input('athlete-dropdown-left', 'options')])
-def set_year_value(athlete_options):
-    return athlete_options[0]['value']
-
-#   (right)
-@app.callback(
-    dash.dependencies.Output('athlete-dropdown-right', 'value'),
-    [dash.dependencies.Input('athlete-dropdown-right', 'options')])
-def set_year_value(athlete_options):
-    return athlete_options[0]['value']
-
-# Set distribution dropdown options based on selection of All, Gender, or Division
-#   (left)
-@app.callback(
-    dash.dependencies.Output('dist-details-dropdown-left', 'options'),
-    [dash.dependencies.Input('dist-radio-left', 'value'),
-    dash.dependencies.Input('race-dropdown-left', 'value'),
-    dash.dependencies.Input('year-dropdown-left', 'value')])
-def set_dist_options_left(selected_dist_type, selected_race, selected_year):
-    if selected_dist_type == 'All':
-        return [{'label': 'All', 'value': 'All'}]
-    elif selected_dist_type == 'Gender':
-        return [{'label': i, 'value': i} for i in list(np.unique(eval(race_options[selected_race][selected_year][0])["gender"]))]
-    elif selected_dist_type == 'Division':
-        return [{'label': i, 'value': i} for i in list(np.unique(eval(race_options[selected_race][selected_year][0])["division"]))]
-    else:
-        return [{'label': 'CONFUZZLED', 'value': 'CONFUZZLED'}]
-
-#   (right)
-@app.callback(
-    dash.dependencies.Output('dist-details-dropdown-right', 'options'),
-    [dash.dependencies.Input('dist-radio-right', 'value'),
-    dash.dependencies.Input('race-dropdown-right', 'value'),
-    dash.dependencies.Input('year-dropdown-right', 'value')])
-def set_dist_options_right(selected_dist_type, selected_race, selected_year):
-    if selected_dist_type == 'All':
-        return [{'label': 'All', 'value': 'All'}]
-    elif selected_dist_type == 'Gender':
-        return [{'label': i, 'value': i} for i in list(np.unique(eval(race_options[selected_race][selected_year][0])["gender"]))]
-    elif selected_dist_type == 'Division':
-        return [{'label': i, 'value': i} for i in list(np.unique(eval(race_options[selected_race][selected_year][0])["division"]))]
-    else:
-        return [{'label': 'CONFUZZLED', 'value': 'CONFUZZLED'}]
-
-
-# Set distribution dropdown initial value based on dropdown options and corresponding to selected athlete and dist type
-#   (left)
-@app.callback(
-    dash.dependencies.Output('dist-details-dropdown-left', 'value'),
-    [dash.dependencies.Input('race-dropdown-left', 'value'),
-     dash.dependencies.Input('year-dropdown-left', 'value'),
-     dash.dependencies.Input('athlete-dropdown-left', 'value'),
-     dash.dependencies.Input('dist-radio-left', 'value')])
-def set_dist_value(selected_race, selected_year, selected_athlete,
-                   selected_dist_type):
-    df = eval(race_options[selected_race][selected_year][0])
-    athlete_row = df[df['name'] == selected_athlete]
+# Resolve each side's selection (year, athlete, and distribution) in one
+# step, from whichever dropdown changed, so the plots only see consistent
+# selections and render once per change.  In clientside mode the server
+# resolves just the year and athlete, and the distribution is resolved in
+# the browser from the race bundle, so subset changes don't round-trip
+if clientside_mode:
+    #   (left)
+    @app.callback(
+        [dash.dependencies.Output('year-dropdown-left', 'options'),
+         dash.dependencies.Output('year-dropdown-left', 'value'),
+         dash.dependencies.Output('athlete-dropdown-left', 'options'),
+         dash.dependencies.Output('athlete-dropdown-left', 'value'),
+         dash.dependencies.Output('athlete-selection-left', 'data')],
+        [dash.dependencies.Input('race-dropdown-left', 'value'),
+         dash.dependencies.Input('year-dropdown-left', 'value'),
+         dash.dependencies.Input('athlete-dropdown-left', 'value'),
+         dash.dependencies.Input('athlete-dropdown-left', 'search_value')])
+    def set_athlete_selection_left(selected_race, selected_year, selected_athlete, athlete_search_value):
+        return resolve_athlete_selection(triggered_control(), selected_race, selected_year, selected_athlete,
+                                         athlete_search_value)
+
+    #   (right)
+    @app.callback(
+        [dash.dependencies.Output('year-dropdown-right', 'options'),
+         dash.dependencies.Output('year-dropdown-right', 'value'),
+         dash.dependencies.Output('athlete-dropdown-right', 'options'),
+         dash.dependencies.Output('athlete-dropdown-right', 'value'),
+         dash.dependencies.Output('athlete-selection-right', 'data')],
+        [dash.dependencies.Input('race-dropdown-right', 'value'),
+         dash.dependencies.Input('year-dropdown-right', 'value'),
+         dash.dependencies.Input('athlete-dropdown-right', 'value'),
+         dash.dependencies.Input('athlete-dropdown-right', 'search_value')])
+    def set_athlete_selection_right(selected_race, selected_year, selected_athlete, athlete_search_value):
+        return resolve_athlete_selection(triggered_control(), selected_race, selected_year, selected_athlete,
+                                         athlete_search_value)
+
+    #   (left)
+    app.clientside_callback(
+        dash.dependencies.ClientsideFunction(namespace='tristats', function_name='resolveDistribution'),
+        [dash.dependencies.Output('dist-details-dropdown-left', 'options'),
+         dash.dependencies.Output('dist-details-dropdown-left', 'value'),
+         dash.dependencies.Output('selection-left', 'data')],
+        [dash.dependencies.Input('athlete-selection-left', 'data'),
+         dash.dependencies.Input('dist-radio-left', 'value'),
+         dash.dependencies.Input('dist-details-dropdown-left', 'value'),
+         dash.dependencies.Input('race-bundle-left', 'data')])
+
+    #   (right)
+    app.clientside_callback(
+        dash.dependencies.ClientsideFunction(namespace='tristats', function_name='resolveDistribution'),
+        [dash.dependencies.Output('dist-details-dropdown-right', 'options'),
+         dash.dependencies.Output('dist-details-dropdown-right', 'value'),
+         dash.dependencies.Output('selection-right', 'data')],
+        [dash.dependencies.Input('athlete-selection-right', 'data'),
+         dash.dependencies.Input('dist-radio-right', 'value'),
+         dash.dependencies.Input('dist-details-dropdown-right', 'value'),
+         dash.dependencies.Input('race-bundle-right', 'data')])
+else:
+    #   (left)
+    @app.callback(
+        [dash.dependencies.Output('year-dropdown-left', 'options'),
+         dash.dependencies.Output('year-dropdown-left', 'value'),
+         dash.dependencies.Output('athlete-dropdown-left', 'options'),
+         dash.dependencies.Output('athlete-dropdown-left', 'value'),
+         dash.dependencies.Output('dist-details-dropdown-left', 'options'),
+         dash.dependencies.Output('dist-details-dropdown-left', 'value'),
+         dash.dependencies.Output('selection-left', 'data')],
+        [dash.dependencies.Input('race-dropdown-left', 'value'),
+         dash.dependencies.Input('year-dropdown-left', 'value'),
+         dash.dependencies.Input('athlete-dropdown-left', 'value'),
+         dash.dependencies.Input('athlete-dropdown-left', 'search_value'),
+         dash.dependencies.Input('dist-radio-left', 'value'),
+         dash.dependencies.Input('dist-details-dropdown-left', 'value')])
+    def set_selection_left(selected_race, selected_year, selected_athlete, athlete_search_value,
+                           selected_dist_type, selected_dist_value):
+        return resolve_selection(triggered_control(), selected_race, selected_year, selected_athlete,
+                                 selected_dist_type, selected_dist_value, athlete_search_value)
+
+    #   (right)
+    @app.callback(
+        [dash.dependencies.Output('year-dropdown-right', 'options'),
+         dash.dependencies.Output('year-dropdown-right', 'value'),
+         dash.dependencies.Output('athlete-dropdown-right', 'options'),
+         dash.dependencies.Output('athlete-dropdown-right', 'value'),
+         dash.dependencies.Output('dist-details-dropdown-right', 'options'),
+         dash.dependencies.Output('dist-details-dropdown-right', 'value'),
+         dash.dependencies.Output('selection-right', 'data')],
+        [dash.dependencies.Input('race-dropdown-right', 'value'),
+         dash.dependencies.Input('year-dropdown-right', 'value'),
+         dash.dependencies.Input('athlete-dropdown-right', 'value'),
+         dash.dependencies.Input('athlete-dropdown-right', 'search_value'),
+         dash.dependencies.Input('dist-radio-right', 'value'),
+         dash.dependencies.Input('dist-details-dropdown-right', 'value')])
+    def set_selection_right(selected_race, selected_year, selected_athlete, athlete_search_value,
+                            selected_dist_type, selected_dist_value):
+        return resolve_selection(triggered_control(), selected_race, selected_year, selected_athlete,
+                                 selected_dist_type, selected_dist_value, athlete_search_value)
+
+
+def triggered_control():
+    """
+    Which control fired the current callback, without its -left/-right
+    suffix (e.g. 'race-dropdown'), or None on page load.  Typing in the
+    athlete dropdown is 'athlete-search'.
+    """
+    if dash.ctx.triggered_id is None:
+        return None
+    controls = []
+    for prop_id in dash.ctx.triggered_prop_ids:
+        component_id, prop = prop_id.rsplit('.', 1)
+        controls.append('athlete-search' if prop == 'search_value' else component_id.rsplit('-', 1)[0])
+    # A picked athlete clears the search text too; the pick is what matters
+    controls.sort(key=lambda control: control == 'athlete-search')
+    return controls[0]
+
+
+def athlete_options(race, search_value, selected_athlete):
+    """
+    Athlete dropdown options: the first page of athletes matching the search
+    text (or of all athletes), plus the selected athlete so it stays shown.
+    """
+    total, matches = race.athlete_search.search(search_value, limit=athlete_page_size)
+    keys = [key for key, payload in matches]
+    if selected_athlete is not None and selected_athlete not in keys:
+        keys.append(selected_athlete)
+    return [{'label': i, 'value': i} for i in keys]
+
+
+def resolve_selection(trigger, selected_race, selected_year, selected_athlete,
+                      selected_dist_type, selected_dist_value, athlete_search_value=None):
+    """
+    Work out a consistent year, athlete, and distribution for one side,
+    given the control that changed.  Changing the race resets the year to
+    the most recent one; changing the race or year resets the athlete to
+    the first one; changing the athlete or distribution type resets the
+    distribution to the athlete's own group.  Options that can't have
+    changed are left alone (dash.no_update) rather than resent.  Typing in
+    the athlete dropdown only updates its options.
+    """
+    if trigger == 'athlete-search':
+        race = race_registry.get(selected_race, selected_year)
+        return ((dash.no_update,)*2 +
+                (athlete_options(race, athlete_search_value, selected_athlete),) +
+                (dash.no_update,)*4)
+
+    race_changed = trigger in (None, 'race-dropdown')
+    year_options = race_registry.years(selected_race)
+    if race_changed or selected_year not in year_options:
+        selected_year = year_options[0]
+    race = race_registry.get(selected_race, selected_year)
+
+    roster_changed = race_changed or trigger == 'year-dropdown'
+    if roster_changed or selected_athlete not in race.athlete_index:
+        selected_athlete = race.athlete_keys[0]
+
     if selected_dist_type == 'All':
-        return 'All'
+        dist_options = ['All']
     else:
-        return list(athlete_row[selected_dist_type.lower()])[0]
-
-#   (right)
-@app.callback(
-    dash.dependencies.Output('dist-details-dropdown-right', 'value'),
-    [dash.dependencies.Input('race-dropdown-right', 'value'),
-     dash.dependencies.Input('year-dropdown-right', 'value'),
-     dash.dependencies.Input('athlete-dropdown-right', 'value'),
-     dash.dependencies.Input('dist-radio-right', 'value')])
-def set_dist_value(selected_race, selected_year, selected_athlete,
-                   selected_dist_type):
-    df = eval(race_options[selected_race][selected_year][0])
-    athlete_row = df[df['name'] == selected_athlete]
+        dist_options = race.categories(selected_dist_type.lower())
     if selected_dist_type == 'All':
-        return 'All'
-    else:
-        return list(athlete_row[selected_dist_type.lower()])[0]
-
-
-# Comparison text
-@app.callback(
-    dash.dependencies.Output(component_id='comparison-text', component_property='children'),
-    [dash.dependencies.Input('race-dropdown-left', 'value'),
-     dash.dependencies.Input('year-dropdown-left', 'value'),
-     dash.dependencies.Input('athlete-dropdown-left', 'value'),
-     dash.dependencies.Input('race-dropdown-right', 'value'),
-     dash.dependencies.Input('year-dropdown-right', 'value'),
-     dash.dependencies.Input('athlete-dropdown-right', 'value'),
-     dash.dependencies.Input('subset-sport', 'value')]
-)
-def update_output_div(selected_race_left, selected_year_left, selected_athlete_left,
-                      selected_race_right, selected_year_right, selected_athlete_right,
-                      selected_sport):
-    # Get dataframes
-    df_left = eval(race_options[selected_race_left][selected_year_left][0])
-    df_right = eval(race_options[selected_race_right][selected_year_right][0])
-    # Get specific athlete times for selected sport
-    athlete_time_left = df_left[df_left['name']==selected_athlete_left][selected_sport].values[0]
-    athlete_time_right = df_right[df_right['name']==selected_athlete_right][selected_sport].values[0]
-    time_difference = abs(athlete_time_left - athlete_time_right)
-    if (athlete_time_left < athlete_time_right):
+        selected_dist_value = 'All'
+    elif trigger != 'dist-details-dropdown' or selected_dist_value not in dist_options:
+        selected_dist_value = race.athlete_value(selected_athlete, selected_dist_type.lower())
+
+    selection = {
+        'race': selected_race,
+        'year': selected_year,
+        'athlete': selected_athlete,
+        'dist_type': selected_dist_type,
+        'dist_value': selected_dist_value,
+        'athlete_row': race.athlete_index[selected_athlete]
+    }
+    return (
+        [{'label': i, 'value': i} for i in year_options] if race_changed else dash.no_update,
+        selected_year,
+        athlete_options(race, None, selected_athlete) if roster_changed else dash.no_update,
+        selected_athlete,
+        [{'label': i, 'value': i} for i in dist_options] if roster_changed or trigger == 'dist-radio' else dash.no_update,
+        selected_dist_value,
+        selection
+    )
+
+
+def resolve_athlete_selection(trigger, selected_race, selected_year, selected_athlete, athlete_search_value=None):
+    """
+    The year and athlete part of resolve_selection, for clientside mode
+    (where the browser resolves the distribution): year and athlete options
+    and values, and the selection without its distribution.
+    """
+    resolved = resolve_selection(trigger, selected_race, selected_year, selected_athlete, 'All', 'All',
+                                 athlete_search_value)
+    selection = resolved[-1]
+    if isinstance(selection, dict):
+        selection = {key: value for key, value in selection.items() if key not in ('dist_type', 'dist_value')}
+    return resolved[:4] + (selection,)
+
+
+# Comparison text, boxplot, and histogram
+#   (computed together so each interaction looks up the athletes and
+#   distributions once; registered below, on the server or in the browser)
+def update_comparison(selection_left, selection_right, selected_sport, figure_state=None):
+    if selection_left is None or selection_right is None:
+        raise dash.exceptions.PreventUpdate
+    # If the plots already show these distributions, only the athlete traces need to change
+    new_figure_state = {
+        'sport': selected_sport,
+        'left': [selection_left[i] for i in ['race', 'year', 'dist_type', 'dist_value']],
+        'right': [selection_right[i] for i in ['race', 'year', 'dist_type', 'dist_value']]
+    }
+    patch = figure_state == new_figure_state
+    key = ('comparison', race_store.version, output_version, selected_sport,
+           comparison_key(selection_left), comparison_key(selection_right), patch)
+    return comparison_cache.get_or_compute(
+        key, lambda: compute_comparison(selection_left, selection_right, selected_sport, new_figure_state, patch))
+
+
+def comparison_key(selection):
+    """
+    The parts of a side's selection its comparison depends on.
+    """
+    return (selection['race'], selection['year'], selection['athlete'],
+            selection['dist_type'], selection['dist_value'])
+
+
+def compute_comparison(selection_left, selection_right, selected_sport, new_figure_state, patch):
+    # Look up athlete times, distributions, ranks, and percentiles for each side
+    left = side_stats(selection_left, selected_sport)
+    right = side_stats(selection_right, selected_sport)
+    if patch:
+        return (comparison_text(left, right),
+                boxplot_athlete_patch(left, right, selected_sport),
+                histogram_athlete_patch(left, right, selected_sport),
+                dash.no_update)
+    return (comparison_text(left, right),
+            binary_figure(boxplot_figure(left, right, selected_sport)),
+            binary_figure(histogram_figure(left, right, selected_sport)),
+            new_figure_state)
+
+
+if clientside_mode:
+    app.clientside_callback(
+        dash.dependencies.ClientsideFunction(namespace='tristats', function_name='updateComparison'),
+        [dash.dependencies.Output('comparison-text', 'children'),
+         dash.dependencies.Output('boxplot-1', 'figure'),
+         dash.dependencies.Output('histogram-main', 'figure')],
+        [dash.dependencies.Input('selection-left', 'data'),
+         dash.dependencies.Input('selection-right', 'data'),
+         dash.dependencies.Input('subset-sport', 'value'),
+         dash.dependencies.Input('race-bundle-left', 'data'),
+         dash.dependencies.Input('race-bundle-right', 'data')])
+
+    # Send a race bundle when a side switches to a race year the browser doesn't hold yet
+    #   (left)
+    @app.callback(
+        [dash.dependencies.Output('race-bundle-left', 'data'),
+         dash.dependencies.Output('race-bundle-version-left', 'data')],
+        [dash.dependencies.Input('athlete-selection-left', 'data')],
+        [dash.dependencies.State('race-bundle-version-left', 'data')])
+    def set_race_bundle_left(selection, held_version):
+        return selected_race_bundle(selection, held_version)
+
+    #   (right)
+    @app.callback(
+        [dash.dependencies.Output('race-bundle-right', 'data'),
+         dash.dependencies.Output('race-bundle-version-right', 'data')],
+        [dash.dependencies.Input('athlete-selection-right', 'data')],
+        [dash.dependencies.State('race-bundle-version-right', 'data')])
+    def set_race_bundle_right(selection, held_version):
+        return selected_race_bundle(selection, held_version)
+else:
+    app.callback(
+        [dash.dependencies.Output('comparison-text', 'children'),
+         dash.dependencies.Output('boxplot-1', 'figure'),
+         dash.dependencies.Output('histogram-main', 'figure'),
+         dash.dependencies.Output('figure-state', 'data')],
+        [dash.dependencies.Input('selection-left', 'data'),
+         dash.dependencies.Input('selection-right', 'data'),
+         dash.dependencies.Input('subset-sport', 'value')],
+        [dash.dependencies.State('figure-state', 'data')])(update_comparison)
+
+
+def selected_race_bundle(selection, held_version):
+    """
+    Bundle for the selected race year and its version, or no_update for
+    both if the browser already holds that version.
+    """
+    if selection is None:
+        raise dash.exceptions.PreventUpdate
+    version = bundle_version(race_store.version, selection['race'], selection['year'])
+    if held_version == version:
+        return dash.no_update, dash.no_update
+    loaded = race_registry.get(selection['race'], selection['year'])
+    return race_bundle(loaded, selection['race'], selection['year'], race_store.version), version
+
+
+def side_stats(selection, selected_sport):
+    """
+    Comparison stats for one side's resolved selection.
+    """
+    return compare_side(distributions, selection['race'], selection['year'], selection['athlete'],
+                        selection['dist_type'], selection['dist_value'], selected_sport)
+
+
+def athlete_label(side):
+    """
+    Legend entry for an athlete: name, percentile, and rank.
+    """
+    if side.rank is None:
+        # No time for the athlete, or none at all for the distribution
+        return side.athlete + '<br>' + ("no time" if side.distribution.count else "no times")
+    return side.athlete + '<br>' + "{0} percentile ({1} out of {2})".format(
+        convert_numeric_to_ordinal(side.percentile),
+        side.rank,
+        side.distribution.count)
+
+
+def comparison_text(left, right):
+    """
+    Sentence saying which athlete was faster, and by how much.
+    """
+    if left.athlete_time is None or right.athlete_time is None:
+        # No time recorded for one of the athletes
+        return html.Div([
+            html.P("I'm sorry, this is confusing.")
+            ])
+    time_difference = abs(left.athlete_time - right.athlete_time)
+    if (left.athlete_time < right.athlete_time):
         mylayout = html.Div([
             html.P("{0} ({1} {2}) was faster than {3} ({4} {5}) by: {6}".format(
-                selected_athlete_left,
-                selected_race_left,
-                selected_year_left,
-                selected_athlete_right,
-                selected_race_right,
-                selected_year_right,
-                convert_min_to_time(time_difference)))
+                left.athlete,
+                left.race,
+                left.year,
+                right.athlete,
+                right.race,
+                right.year,
+                format_seconds(time_difference)))
             ])
-    elif (athlete_time_left > athlete_time_right):
+    elif (left.athlete_time > right.athlete_time):
         mylayout = html.Div([
             html.P("{3} ({4} {5}) was faster than {0} ({1} {2}) by: {6}".format(
-                selected_athlete_left,
-                selected_race_left,
-                selected_year_left,
-                selected_athlete_right,
-                selected_race_right,
-                selected_year_right,
-                convert_min_to_time(time_difference)))
-            ])
-    elif (athlete_time_left == athlete_time_right):
-        mylayout = html.Div([
-            html.P("{0} ({1} {2}) was the same speed as {3} ({4} {5})!".format(
-                selected_athlete_left,
-                selected_race_left,
-                selected_year_left,
-                selected_athlete_right,
-                selected_race_right,
-                selected_year_right,
-                convert_min_to_time(time_difference)))
+                left.athlete,
+                left.race,
+                left.year,
+                right.athlete,
+                right.race,
+                right.year,
+                format_seconds(time_difference)))
             ])
     else:
         mylayout = html.Div([
-            html.P("I'm sorry, this is confusing.")
+            html.P("{0} ({1} {2}) was the same speed as {3} ({4} {5})!".format(
+                left.athlete,
+                left.race,
+                left.year,
+                right.athlete,
+                right.race,
+                right.year,
+                format_seconds(time_difference)))
             ])
 
     return mylayout
-    # return html.Div([html.P("There be words here!")])
-
-
-# Boxplot
-@app.callback(
-    dash.dependencies.Output('boxplot-1', 'figure'),
-    [dash.dependencies.Input('race-dropdown-left', 'value'),
-     dash.dependencies.Input('year-dropdown-left', 'value'),
-     dash.dependencies.Input('athlete-dropdown-left', 'value'),
-     dash.dependencies.Input('dist-radio-left', 'value'),
-     dash.dependencies.Input('dist-details-dropdown-left', 'value'),
-     dash.dependencies.Input('race-dropdown-right', 'value'),
-     dash.dependencies.Input('year-dropdown-right', 'value'),
-     dash.dependencies.Input('athlete-dropdown-right', 'value'),
-     dash.dependencies.Input('dist-radio-right', 'value'),
-     dash.dependencies.Input('dist-details-dropdown-right', 'value'),
-     dash.dependencies.Input('subset-sport', 'value')])
-def update_boxplot_1(selected_race_left, selected_year_left, selected_athlete_left,
-                     selected_dist_type_left, selected_dist_value_left,
-                     selected_race_right, selected_year_right, selected_athlete_right,
-                          selected_dist_type_right, selected_dist_value_right,
-                          selected_sport):
-    # Pull selected race/year dataframe
-    df_left = eval(race_options[selected_race_left][selected_year_left][0])
-    df_right = eval(race_options[selected_race_right][selected_year_right][0])
-    # Get specific athlete times for selected sport
-    athlete_time_left = df_left[df_left['name']==selected_athlete_left][selected_sport].values[0]
-    athlete_time_right = df_right[df_right['name']==selected_athlete_right][selected_sport].values[0]
-    # Get all times for selected sport and subset, using selected_dist_type to filter (for each histogram)
-    if (selected_dist_type_left == 'All'):
-        all_times_left = df_left[selected_sport].dropna()
-    else:
-        all_times_left = df_left[df_left[selected_dist_type_left.lower()]==selected_dist_value_left.lower()][selected_sport].dropna()
-    if (selected_dist_type_right == 'All'):
-        all_times_right = df_right[selected_sport].dropna()
-    else:
-        all_times_right = df_right[df_right[selected_dist_type_right.lower()]==selected_dist_value_right.lower()][selected_sport].dropna()
-    # Set bins and find maximum value for y axis
-    nbins = 12
-    ymax = max(
-        np.histogram(all_times_left, bins = nbins)[0].max(),
-        np.histogram(all_times_right, bins = nbins)[0].max()
-    )
-    # Calculate athletes' rank and percentile
-    athlete_rank_left = (all_times_left < athlete_time_left).values.sum() + 1
-    athlete_percentile_left = int(round((athlete_rank_left/len(all_times_left))*100))
-    athlete_rank_right = (all_times_right < athlete_time_right).values.sum() + 1
-    athlete_percentile_right = int(round((athlete_rank_right/len(all_times_right))*100))
-    # Create plot
+
+
+def time_axis(left, right, selected_sport):
+    """
+    Time x axis for both plots: times are plotted in seconds, with ticks
+    labelled h:mm:ss over the distributions and athlete times.
+    """
+    times = [side.distribution.min for side in [left, right] if side.distribution.count]
+    times += [side.distribution.max for side in [left, right] if side.distribution.count]
+    times += [side.athlete_time for side in [left, right] if side.athlete_time is not None]
+    tickvals, ticktext = time_ticks(min(times), max(times)) if times else ([], [])
+    return {
+        'title': selected_sport + " time",
+        'tickvals': tickvals,
+        'ticktext': ticktext
+    }
+
+
+def box_values(distribution, name):
+    """
+    Box trace data for a distribution: every time as a jittered point, or
+    for large fields, just the cached quartiles and whiskers.
+    """
+    if distribution.count <= max_box_points:
+        return dict(x = distribution.times, jitter = 0.4, pointpos = 0, boxpoints = 'all')
+    return dict(
+        y = [name],
+        q1 = [distribution.q1],
+        median = [distribution.median],
+        q3 = [distribution.q3],
+        lowerfence = [distribution.lower_whisker],
+        upperfence = [distribution.upper_whisker],
+        orientation = 'h',
+        boxpoints = False)
+
+
+def boxplot_figure(left, right, selected_sport):
+    """
+    Boxplots of both distributions, with each athlete's time marked.
+    """
+    name_left = left.race + ' ' + left.year + ': ' + left.dist_value + ' '
+    name_right = right.race + ' ' + right.year + ': ' + right.dist_value
     trace0 = go.Box(
-        x = all_times_left,
-        jitter = 0.4,
-        pointpos = 0,
-        boxpoints = 'all',
-        name = selected_race_left + ' ' + selected_year_left + ': ' + selected_dist_value_left + ' ',
+        name = name_left,
         marker = dict(color = 'rgb(22, 96, 167)'),
         line = dict(color = 'rgb(22, 96, 167)'),
-        legendgroup = "athlete_left"
+        legendgroup = "athlete_left",
+        **box_values(left.distribution, name_left)
                  )
     trace1 = go.Box(
-        x = all_times_right,
-        jitter = 0.4,
-        pointpos = 0,
-        boxpoints = 'all',
-        name = selected_race_right + ' ' + selected_year_right + ': ' + selected_dist_value_right,
+        name = name_right,
         marker = dict(color = 'rgb(205, 12, 24)'),
         line = dict(color = 'rgb(205, 12, 24)'),
-        legendgroup = 'athlete_right'
+        legendgroup = 'athlete_right',
+        **box_values(right.distribution, name_right)
     )
     trace2 = go.Scatter(
-         x = [athlete_time_left],
-         y = [selected_athlete_left],
+         x = [left.athlete_time],
+         y = [left.athlete],
          mode = 'markers',
          marker = dict(size = 12,
                        color = 'rgb(115, 157, 198)',
                        line = dict(color = 'rgb(22, 96, 167)',
                                    width = 2)),
-         name = selected_athlete_left + '<br>' +
-         "{0} percentile ({1} out of {2})".format(
-             convert_numeric_to_ordinal(athlete_percentile_left),
-             athlete_rank_left,
-             len(all_times_left)),
+         name = athlete_label(left),
          legendgroup = 'athlete_left'
          )
     trace3 = go.Scatter(
-         x = [athlete_time_right],
-         y = [selected_athlete_right + ' '],
+         x = [right.athlete_time],
+         y = [right.athlete + ' '],
          mode = 'markers',
          marker = dict(size = 12,
                        color = 'rgb(246, 141, 141)',
                        line = dict(color = 'rgb(205, 12, 24)',
                                    width = 2)),
-         name = selected_athlete_right + '<br>' +
-         "{0} percentile ({1} out of {2})".format(
-             convert_numeric_to_ordinal(athlete_percentile_right),
-             athlete_rank_right,
-             len(all_times_right)),
+         name = athlete_label(right),
          legendgroup = 'athlete_right'
          )
     trace_blank = go.Scatter(
-         x = [athlete_time_right],
+         x = [right.athlete_time],
          y = [' '],
          mode = 'markers',
          marker = dict(size = 0, color = 'rgb(255, 255, 255)'),
@@ -665,9 +834,7 @@ def update_boxplot_1(selected_race_left, selected_year_left, selected_athlete_le
     return {
         'data': [trace2, trace0, trace_blank, trace3, trace1],
         'layout': go.Layout(
-            xaxis = {
-                'title': selected_sport + " (min)"
-            },
+            xaxis = time_axis(left, right, selected_sport),
             yaxis = {
                 'autorange': 'reversed'
             },
@@ -678,106 +845,76 @@ def update_boxplot_1(selected_race_left, selected_year_left, selected_athlete_le
                 'l': 160
             },
             title = selected_sport
-            #,
-            # yaxis = {
-            #     'overlaying': 'y'
-            # }
         )
     }
 
 
-# Histogram plot
-@app.callback(
-    dash.dependencies.Output('histogram-main', 'figure'),
-    [dash.dependencies.Input('race-dropdown-left', 'value'),
-     dash.dependencies.Input('year-dropdown-left', 'value'),
-     dash.dependencies.Input('athlete-dropdown-left', 'value'),
-     dash.dependencies.Input('dist-radio-left', 'value'),
-     dash.dependencies.Input('dist-details-dropdown-left', 'value'),
-     dash.dependencies.Input('race-dropdown-right', 'value'),
-     dash.dependencies.Input('year-dropdown-right', 'value'),
-     dash.dependencies.Input('athlete-dropdown-right', 'value'),
-     dash.dependencies.Input('dist-radio-right', 'value'),
-     dash.dependencies.Input('dist-details-dropdown-right', 'value'),
-     dash.dependencies.Input('subset-sport', 'value')])
-def update_histogram_main(selected_race_left, selected_year_left, selected_athlete_left,
-                          selected_dist_type_left, selected_dist_value_left,
-                          selected_race_right, selected_year_right, selected_athlete_right,
-                          selected_dist_type_right, selected_dist_value_right,
-                          selected_sport):
-    # Pull selected race/year dataframe
-    df_left = eval(race_options[selected_race_left][selected_year_left][0])
-    df_right = eval(race_options[selected_race_right][selected_year_right][0])
-    # Get specific athlete times for selected sport
-    athlete_time_left = df_left[df_left['name']==selected_athlete_left][selected_sport].values[0]
-    athlete_time_right = df_right[df_right['name']==selected_athlete_right][selected_sport].values[0]
-    # Get all times for selected sport and subset (for each histogram)
-    if (selected_dist_type_left == 'All'):
-        all_times_left = df_left[selected_sport].dropna()
-    else:
-        all_times_left = df_left[df_left[selected_dist_type_left.lower()]==selected_dist_value_left.lower()][selected_sport].dropna()
-    if (selected_dist_type_right == 'All'):
-        all_times_right = df_right[selected_sport].dropna()
-    else:
-        all_times_right = df_right[df_right[selected_dist_type_right.lower()]==selected_dist_value_right.lower()][selected_sport].dropna()
-    # Set bins and find maximum value for y axis
-    nbins = 12
-    ymax = max(
-        np.histogram(all_times_left, bins = nbins)[0].max(),
-        np.histogram(all_times_right, bins = nbins)[0].max()
-    )
-    # Calculate athletes' rank and percentile
-    athlete_rank_left = (all_times_left < athlete_time_left).values.sum() + 1
-    athlete_percentile_left = int(round((athlete_rank_left/len(all_times_left))*100))
-    athlete_rank_right = (all_times_right < athlete_time_right).values.sum() + 1
-    athlete_percentile_right = int(round((athlete_rank_right/len(all_times_right))*100))
+def boxplot_athlete_patch(left, right, selected_sport):
+    """
+    Partial boxplot update that moves just the athlete markers
+    (traces 0, 2, and 3 of boxplot_figure) and the axis ticks.
+    """
+    patch = dash.Patch()
+    patch['layout']['xaxis'] = time_axis(left, right, selected_sport)
+    patch['data'][0]['x'] = [left.athlete_time]
+    patch['data'][0]['y'] = [left.athlete]
+    patch['data'][0]['name'] = athlete_label(left)
+    patch['data'][2]['x'] = [right.athlete_time]
+    patch['data'][3]['x'] = [right.athlete_time]
+    patch['data'][3]['y'] = [right.athlete + ' ']
+    patch['data'][3]['name'] = athlete_label(right)
+    return patch
+
+
+def histogram_figure(left, right, selected_sport):
+    """
+    Overlaid histograms of both distributions, with a vertical line at each
+    athlete's time.  Times are binned here on one shared grid, so only the
+    bin counts are sent to the browser.
+    """
+    # Bin both distributions and find maximum value for y axis
+    edges, (counts_left, counts_right) = shared_bins([left.distribution, right.distribution])
+    centers = (edges[:-1] + edges[1:])/2
+    width = edges[1] - edges[0] if len(edges) > 1 else 0
+    # No times on either side (a sport neither race timed): no bars, and lines of height 0
+    ymax = max(counts_left.max(), counts_right.max()) if len(centers) else 0
     # Create plot
     return {
-        'data': [go.Histogram(
-                    x=all_times_left,
-                    xbins=dict(
-                        start=np.min(all_times_left),
-                        size=(np.max(all_times_left)-np.min(all_times_left))/nbins,
-                        end=np.max(all_times_left)),
-                    name = selected_race_left + ' ' + selected_year_left + ': ' + selected_dist_value_left,
+        'data': [go.Bar(
+                    x=centers,
+                    y=counts_left,
+                    width=width,
+                    name = left.race + ' ' + left.year + ': ' + left.dist_value,
                     marker=dict(color='rgb(22, 96, 167)'),
                     opacity = 0.5,
-                    legendgroup = 'Person1'
+                    legendgroup = 'Person1',
+                    showlegend = bool(left.distribution.count)
                 ),
-                 go.Histogram(
-                    x=all_times_right,
-                    xbins=dict(
-                        start=np.min(all_times_right),
-                        size=(np.max(all_times_right)-np.min(all_times_right))/nbins,
-                        end=np.max(all_times_right)),
-                    name = selected_race_right + ' ' + selected_year_right + ': ' + selected_dist_value_right,
+                 go.Bar(
+                    x=centers,
+                    y=counts_right,
+                    width=width,
+                    name = right.race + ' ' + right.year + ': ' + right.dist_value,
                     marker=dict(color='rgb(205, 12, 24)'),
                     opacity = 0.5,
-                    legendgroup = 'Person2'
+                    legendgroup = 'Person2',
+                    showlegend = bool(right.distribution.count)
                 ),
                  go.Scatter(
-                     x = [athlete_time_left, athlete_time_left],
+                     x = [left.athlete_time, left.athlete_time],
                      y = [0, ymax],  # Draw to max y value of histogram
                      mode = 'lines',
-                     name = selected_athlete_left + '<br>' +
-                     "{0} percentile ({1} out of {2})".format(
-                         convert_numeric_to_ordinal(athlete_percentile_left),
-                         athlete_rank_left,
-                         len(all_times_left)),
+                     name = athlete_label(left),
                      legendgroup = 'Person1',
                      line = dict(
                          color = ('rgb(22, 96, 167)'),
                          width = 2)
                  ),
                  go.Scatter(
-                     x = [athlete_time_right, athlete_time_right],
+                     x = [right.athlete_time, right.athlete_time],
                      y = [0, ymax],  # Draw to max y value of histogram
                      mode = 'lines',
-                     name = selected_athlete_right + '<br>' +
-                     "{0} percentile ({1} out of {2})".format(
-                         convert_numeric_to_ordinal(athlete_percentile_right),
-                         athlete_rank_right,
-                         len(all_times_right)),
+                     name = athlete_label(right),
                      legendgroup = 'Person2',
                      line = dict(
                          color = ('rgb(205, 12, 24)'),
@@ -785,9 +922,7 @@ def update_histogram_main(selected_race_left, selected_year_left, selected_athle
                  )
                 ],
         'layout': go.Layout(
-            xaxis={
-                'title': selected_sport + " (min)"
-            },
+            xaxis=time_axis(left, right, selected_sport),
             yaxis={
                 'title': 'Frequency'
             },
@@ -797,5 +932,73 @@ def update_histogram_main(selected_race_left, selected_year_left, selected_athle
     }
 
 
+def histogram_athlete_patch(left, right, selected_sport):
+    """
+    Partial histogram update that moves just the athletes' vertical lines
+    (traces 2 and 3 of histogram_figure) and the axis ticks.
+    """
+    patch = dash.Patch()
+    patch['layout']['xaxis'] = time_axis(left, right, selected_sport)
+    patch['data'][2]['x'] = [left.athlete_time, left.athlete_time]
+    patch['data'][2]['name'] = athlete_label(left)
+    patch['data'][3]['x'] = [right.athlete_time, right.athlete_time]
+    patch['data'][3]['name'] = athlete_label(right)
+    return patch
+
+
+#------#
+# API
+#------#
+
+# Paginated athlete search, within one race year (race and year given) or across all races
+#   e.g. /api/athletes?q=lind&race=Rockwood&year=2018&offset=0&limit=20
+@server.route('/api/athletes')
+def search_athletes():
+    args = flask.request.args
+    try:
+        offset = max(int(args.get('offset', 0)), 0)
+        limit = min(max(int(args.get('limit', 20)), 1), 100)
+    except ValueError:
+        flask.abort(400)
+    race, year = args.get('race'), args.get('year')
+    if race is not None or year is not None:
+        try:
+            race_registry.info(race, year)
+        except KeyError:
+            flask.abort(404)
+        total, matches = race_registry.get(race, year).athlete_search.search(args.get('q', ''), offset, limit)
+        results = [{'athlete': key, 'race': race, 'year': year} for key, payload in matches]
+    else:
+        total, matches = race_registry.athlete_search.search(args.get('q', ''), offset, limit)
+        results = [{'athlete': key, 'race': race, 'year': year} for key, (race, year) in matches]
+    return flask.jsonify(total=total, offset=offset, limit=limit, results=results)
+
+
+# Output cache size and hit/miss counts (per worker)
+@server.route('/api/cache')
+def cache_stats():
+    return flask.jsonify(comparison=comparison_cache.stats())
+
+
+#----------#
+# Serving
+#----------#
+
+def warm_up():
+    """
+    Load and index every race, fill the distribution cache, and serve the
+    page and its default comparison once, so nothing is left to build on a
+    worker's first request.  gunicorn runs this in the master before
+    forking (gunicorn.conf.py), so workers share all of it copy-on-write.
+    """
+    race_registry.load_all()
+    distributions.precompute(available_sports)
+    selection = resolve_selection(None, 'Rockwood', None, None, 'All', None)[-1]
+    update_comparison(selection, selection, 'finish')
+    with server.test_client() as client:
+        for path in ['/', '/_dash-layout', '/_dash-dependencies']:
+            client.get(path)
+
+
 if __name__ == '__main__':
     app.run_server(debug=True)
@@ -0,0 +1,404 @@
+/*
+ * Clientside comparison for tristats (used when the app runs with
+ * TRISTATS_CLIENTSIDE=1).
+ *
+ * The server sends each selected race year once as a bundle of base64
+ * typed arrays (see tristats/encoding.py).  Everything else - ranks,
+ * percentiles, binned histograms, the figures, and which subset each side
+ * shows - is computed here, so switching sports or subsets never goes back
+ * to the server.  This mirrors update_comparison, the figure builders, and
+ * the distribution part of resolve_selection in app.py.
+ */
+
+(function () {
+    'use strict';
+
+    var LEFT_COLOR = 'rgb(22, 96, 167)';
+    var RIGHT_COLOR = 'rgb(205, 12, 24)';
+    var MAX_BOX_POINTS = 2000;
+    var MISSING = -1;
+    // Same steps as tristats.times.nice_steps (seconds), for bin widths and axis ticks
+    var NICE_STEPS = [5, 10, 15, 20, 30, 60, 120, 180, 300, 600, 900, 1200, 1800, 3600];
+
+    //---------------//
+    // Race bundles
+    //---------------//
+
+    // Decoded bundles and sorted distributions, keyed by bundle version
+    var decoded = {};
+
+    function decodeArray(b64, ArrayType) {
+        var binary = atob(b64);
+        var bytes = new Uint8Array(binary.length);
+        for (var i = 0; i < binary.length; i++) {
+            bytes[i] = binary.charCodeAt(i);
+        }
+        return new ArrayType(bytes.buffer);
+    }
+
+    function decodeBundle(bundle) {
+        if (!decoded[bundle.version]) {
+            var race = {times: {}, subsets: {}, distributions: {}};
+            Object.keys(bundle.times).forEach(function (sport) {
+                race.times[sport] = decodeArray(bundle.times[sport], Int32Array);
+            });
+            Object.keys(bundle.subsets).forEach(function (distType) {
+                race.subsets[distType] = {
+                    labels: bundle.subsets[distType].labels,
+                    codes: decodeArray(bundle.subsets[distType].codes, Int16Array)
+                };
+            });
+            decoded[bundle.version] = race;
+        }
+        return decoded[bundle.version];
+    }
+
+    // Sorted, NaN-free times for a sport within a distribution (cached)
+    function distribution(race, sport, distType, distValue) {
+        var key = [sport, distType, distValue].join('|');
+        if (!race.distributions[key]) {
+            var times = race.times[sport];
+            var subset = distType === 'All' ? null : race.subsets[distType.toLowerCase()];
+            var code = subset ? subset.labels.indexOf(String(distValue).toLowerCase()) : -1;
+            var kept = [];
+            for (var i = 0; i < times.length; i++) {
+                if (times[i] !== MISSING && (!subset || subset.codes[i] === code)) {
+                    kept.push(times[i]);
+                }
+            }
+            var sorted = Int32Array.from(kept).sort();
+            race.distributions[key] = summarize(sorted);
+        }
+        return race.distributions[key];
+    }
+
+    //--------------//
+    // Statistics
+    //--------------//
+
+    // First index whose value is >= (or > when right is true) value
+    function searchSorted(sorted, value, right) {
+        var lo = 0, hi = sorted.length;
+        while (lo < hi) {
+            var mid = (lo + hi) >>> 1;
+            if (sorted[mid] < value || (right && sorted[mid] === value)) {
+                lo = mid + 1;
+            } else {
+                hi = mid;
+            }
+        }
+        return lo;
+    }
+
+    // Linear-interpolated percentile, as numpy.percentile
+    function percentile(sorted, p) {
+        var position = (sorted.length - 1) * p / 100;
+        var lo = Math.floor(position);
+        var hi = Math.min(lo + 1, sorted.length - 1);
+        return sorted[lo] + (sorted[hi] - sorted[lo]) * (position - lo);
+    }
+
+    function binWidth(sorted) {
+        var n = sorted.length;
+        if (n < 2) {
+            return NICE_STEPS[0];
+        }
+        var width = 2 * (percentile(sorted, 75) - percentile(sorted, 25)) / Math.cbrt(n);
+        if (width <= 0) {
+            width = (sorted[n - 1] - sorted[0]) / (Math.log2(n) + 1);
+        }
+        if (width <= 0) {
+            return NICE_STEPS[0];
+        }
+        var best = 0;
+        for (var i = 1; i < NICE_STEPS.length; i++) {
+            if (Math.abs(Math.log(NICE_STEPS[i] / width)) < Math.abs(Math.log(NICE_STEPS[best] / width))) {
+                best = i;
+            }
+        }
+        return NICE_STEPS[best];
+    }
+
+    function summarize(sorted) {
+        var summary = {times: sorted, count: sorted.length, binWidth: binWidth(sorted)};
+        if (sorted.length) {
+            summary.min = sorted[0];
+            summary.max = sorted[sorted.length - 1];
+            summary.q1 = percentile(sorted, 25);
+            summary.median = percentile(sorted, 50);
+            summary.q3 = percentile(sorted, 75);
+            var iqr = summary.q3 - summary.q1;
+            summary.lowerWhisker = sorted[searchSorted(sorted, summary.q1 - 1.5 * iqr, false)];
+            summary.upperWhisker = sorted[searchSorted(sorted, summary.q3 + 1.5 * iqr, true) - 1];
+        }
+        return summary;
+    }
+
+    function rankAndPercentile(sorted, athleteTime) {
+        if (athleteTime === null || sorted.length === 0) {
+            return [null, null];
+        }
+        var rank = searchSorted(sorted, athleteTime, false) + 1;
+        return [rank, Math.round((rank / sorted.length) * 100)];
+    }
+
+    // Counts on one shared grid, as tristats.stats.shared_bins
+    function sharedBins(distributions) {
+        var width = Math.max.apply(null, distributions.map(function (d) { return d.binWidth; }));
+        var binned = distributions.map(function (d) {
+            var first = d.count ? Math.floor(d.min / width) : 0;
+            var last = d.count ? Math.floor(d.max / width) + 1 : 0;
+            var counts = [];
+            for (var k = first; k < last; k++) {
+                counts.push(searchSorted(d.times, (k + 1) * width, false) - searchSorted(d.times, k * width, false));
+            }
+            return {first: first, counts: counts};
+        });
+        // Empty distributions don't widen the grid; with no times at all there are no bins
+        var spans = binned.filter(function (b) { return b.counts.length; });
+        if (!spans.length) {
+            return {edges: [], width: width, counts: binned.map(function () { return []; })};
+        }
+        var first = Math.min.apply(null, spans.map(function (b) { return b.first; }));
+        var last = Math.max.apply(null, spans.map(function (b) { return b.first + b.counts.length; }));
+        var edges = [];
+        for (var k = first; k <= last; k++) {
+            edges.push(k * width);
+        }
+        var allCounts = binned.map(function (b) {
+            var aligned = new Array(last - first).fill(0);
+            b.counts.forEach(function (count, i) { aligned[b.first - first + i] = count; });
+            return aligned;
+        });
+        return {edges: edges, width: width, counts: allCounts};
+    }
+
+    //--------------//
+    // Formatting
+    //--------------//
+
+    function pad(value) {
+        return (value < 10 ? '0' : '') + value;
+    }
+
+    // As tristats.times.format_seconds
+    function formatSeconds(time) {
+        time = Math.round(time);
+        var hours = Math.floor(time / 3600);
+        var minutes = Math.floor((time % 3600) / 60);
+        var seconds = time % 60;
+        if (hours > 0) {
+            return hours + ':' + pad(minutes) + ':' + pad(seconds);
+        }
+        return pad(minutes) + ':' + pad(seconds);
+    }
+
+    // As time_axis in app.py (and tristats.times.time_ticks)
+    function timeAxis(left, right, sport) {
+        var times = [];
+        [left, right].forEach(function (side) {
+            if (side.distribution.count) {
+                times.push(side.distribution.min, side.distribution.max);
+            }
+            if (side.athleteTime !== null) {
+                times.push(side.athleteTime);
+            }
+        });
+        var tickvals = [];
+        if (times.length) {
+            var low = Math.min.apply(null, times), high = Math.max.apply(null, times);
+            var span = Math.max(high - low, 1);
+            var step = NICE_STEPS[NICE_STEPS.length - 1];
+            for (var i = 0; i < NICE_STEPS.length; i++) {
+                if (span / NICE_STEPS[i] <= 8) {
+                    step = NICE_STEPS[i];
+                    break;
+                }
+            }
+            for (var tick = Math.floor(low / step) * step; tick <= Math.ceil(high / step) * step; tick += step) {
+                tickvals.push(tick);
+            }
+        }
+        return {title: {text: sport + ' time'}, tickvals: tickvals, ticktext: tickvals.map(formatSeconds)};
+    }
+
+    // As convert_numeric_to_ordinal in app.py
+    function ordinal(value) {
+        var lastchar = String(value).slice(-1);
+        var suffix = {'1': 'st', '2': 'nd', '3': 'rd'}[lastchar] || 'th';
+        return value + suffix;
+    }
+
+    function athleteLabel(side) {
+        if (side.rank === null) {
+            // No time for the athlete, or none at all for the distribution
+            return side.athlete + (side.distribution.count ? '<br>no time' : '<br>no times');
+        }
+        return side.athlete + '<br>' + ordinal(side.percentile) + ' percentile (' +
+            side.rank + ' out of ' + side.distribution.count + ')';
+    }
+
+    function paragraph(text) {
+        return {
+            namespace: 'dash_html_components', type: 'Div',
+            props: {children: [{namespace: 'dash_html_components', type: 'P', props: {children: text}}]}
+        };
+    }
+
+    //-----------//
+    // Figures
+    //-----------//
+
+    function sideStats(selection, bundle, sport) {
+        var race = decodeBundle(bundle);
+        var d = distribution(race, sport, selection.dist_type, selection.dist_value);
+        var athleteTime = race.times[sport][selection.athlete_row];
+        if (athleteTime === MISSING) {
+            athleteTime = null;
+        }
+        var rp = rankAndPercentile(d.times, athleteTime);
+        return {
+            race: selection.race, year: selection.year, athlete: selection.athlete,
+            distValue: selection.dist_value, athleteTime: athleteTime,
+            distribution: d, rank: rp[0], percentile: rp[1]
+        };
+    }
+
+    function comparisonText(left, right) {
+        if (left.athleteTime === null || right.athleteTime === null) {
+            return paragraph("I'm sorry, this is confusing.");
+        }
+        var difference = formatSeconds(Math.abs(left.athleteTime - right.athleteTime));
+        var leftName = left.athlete + ' (' + left.race + ' ' + left.year + ')';
+        var rightName = right.athlete + ' (' + right.race + ' ' + right.year + ')';
+        if (left.athleteTime < right.athleteTime) {
+            return paragraph(leftName + ' was faster than ' + rightName + ' by: ' + difference);
+        } else if (left.athleteTime > right.athleteTime) {
+            return paragraph(rightName + ' was faster than ' + leftName + ' by: ' + difference);
+        }
+        return paragraph(leftName + ' was the same speed as ' + rightName + '!');
+    }
+
+    function boxTrace(side, name, color, legendgroup) {
+        var d = side.distribution;
+        var trace = {type: 'box', name: name, marker: {color: color}, line: {color: color}, legendgroup: legendgroup};
+        if (d.count <= MAX_BOX_POINTS) {
+            trace.x = Array.from(d.times);
+            trace.jitter = 0.4;
+            trace.pointpos = 0;
+            trace.boxpoints = 'all';
+        } else {
+            trace.y = [name];
+            trace.q1 = [d.q1];
+            trace.median = [d.median];
+            trace.q3 = [d.q3];
+            trace.lowerfence = [d.lowerWhisker];
+            trace.upperfence = [d.upperWhisker];
+            trace.orientation = 'h';
+            trace.boxpoints = false;
+        }
+        return trace;
+    }
+
+    function boxplotFigure(left, right, sport) {
+        return {
+            data: [
+                {type: 'scatter', x: [left.athleteTime], y: [left.athlete], mode: 'markers',
+                 marker: {size: 12, color: 'rgb(115, 157, 198)', line: {color: LEFT_COLOR, width: 2}},
+                 name: athleteLabel(left), legendgroup: 'athlete_left'},
+                boxTrace(left, left.race + ' ' + left.year + ': ' + left.distValue + ' ', LEFT_COLOR, 'athlete_left'),
+                {type: 'scatter', x: [right.athleteTime], y: [' '], mode: 'markers',
+                 marker: {size: 0, color: 'rgb(255, 255, 255)'}, name: ' ', legendgroup: 'blank'},
+                {type: 'scatter', x: [right.athleteTime], y: [right.athlete + ' '], mode: 'markers',
+                 marker: {size: 12, color: 'rgb(246, 141, 141)', line: {color: RIGHT_COLOR, width: 2}},
+                 name: athleteLabel(right), legendgroup: 'athlete_right'},
+                boxTrace(right, right.race + ' ' + right.year + ': ' + right.distValue, RIGHT_COLOR, 'athlete_right')
+            ],
+            layout: {
+                xaxis: timeAxis(left, right, sport),
+                yaxis: {autorange: 'reversed'},
+                legend: {traceorder: 'grouped+reversed'},
+                margin: {l: 160},
+                title: {text: sport}
+            }
+        };
+    }
+
+    function histogramFigure(left, right, sport) {
+        var bins = sharedBins([left.distribution, right.distribution]);
+        var centers = bins.edges.slice(0, -1).map(function (edge, i) { return (edge + bins.edges[i + 1]) / 2; });
+        var ymax = centers.length ? Math.max(Math.max.apply(null, bins.counts[0]), Math.max.apply(null, bins.counts[1])) : 0;
+        return {
+            data: [
+                {type: 'bar', x: centers, y: bins.counts[0], width: bins.width,
+                 name: left.race + ' ' + left.year + ': ' + left.distValue,
+                 marker: {color: LEFT_COLOR}, opacity: 0.5, legendgroup: 'Person1',
+                 showlegend: left.distribution.count > 0},
+                {type: 'bar', x: centers, y: bins.counts[1], width: bins.width,
+                 name: right.race + ' ' + right.year + ': ' + right.distValue,
+                 marker: {color: RIGHT_COLOR}, opacity: 0.5, legendgroup: 'Person2',
+                 showlegend: right.distribution.count > 0},
+                {type: 'scatter', x: [left.athleteTime, left.athleteTime], y: [0, ymax], mode: 'lines',
+                 name: athleteLabel(left), legendgroup: 'Person1', line: {color: LEFT_COLOR, width: 2}},
+                {type: 'scatter', x: [right.athleteTime, right.athleteTime], y: [0, ymax], mode: 'lines',
+                 name: athleteLabel(right), legendgroup: 'Person2', line: {color: RIGHT_COLOR, width: 2}}
+            ],
+            layout: {
+                xaxis: timeAxis(left, right, sport),
+                yaxis: {title: {text: 'Frequency'}},
+                title: {text: sport},
+                barmode: 'overlay'
+            }
+        };
+    }
+
+    window.dash_clientside = Object.assign({}, window.dash_clientside, {
+        tristats: {
+            updateComparison: function (selectionLeft, selectionRight, sport, bundleLeft, bundleRight) {
+                var noUpdate = window.dash_clientside.no_update;
+                // Wait until both bundles match the selected race years
+                if (!selectionLeft || !selectionRight || !bundleLeft || !bundleRight ||
+                    bundleLeft.race !== selectionLeft.race || bundleLeft.year !== selectionLeft.year ||
+                    bundleRight.race !== selectionRight.race || bundleRight.year !== selectionRight.year) {
+                    return [noUpdate, noUpdate, noUpdate];
+                }
+                var left = sideStats(selectionLeft, bundleLeft, sport);
+                var right = sideStats(selectionRight, bundleRight, sport);
+                return [comparisonText(left, right), boxplotFigure(left, right, sport), histogramFigure(left, right, sport)];
+            },
+
+            // As the distribution part of resolve_selection in app.py: the
+            // subset options, and the picked subset if it's one of them,
+            // otherwise the athlete's own group
+            resolveDistribution: function (athleteSelection, distType, distValue, bundle) {
+                var noUpdate = window.dash_clientside.no_update;
+                // Wait until the bundle matches the selected race year
+                if (!athleteSelection || !bundle ||
+                    bundle.race !== athleteSelection.race || bundle.year !== athleteSelection.year) {
+                    return [noUpdate, noUpdate, noUpdate];
+                }
+                var triggered = (window.dash_clientside.callback_context.triggered || []).map(function (t) {
+                    return t.prop_id;
+                });
+                var picked = triggered.some(function (id) { return id.indexOf('dist-details-dropdown') === 0; });
+                var labels, value;
+                if (distType === 'All') {
+                    labels = ['All'];
+                    value = 'All';
+                } else {
+                    var subset = decodeBundle(bundle).subsets[distType.toLowerCase()];
+                    labels = subset.labels;
+                    if (picked && labels.indexOf(distValue) >= 0) {
+                        value = distValue;
+                    } else {
+                        var code = subset.codes[athleteSelection.athlete_row];
+                        value = code === MISSING ? null : labels[code];
+                    }
+                }
+                var selection = Object.assign({}, athleteSelection, {dist_type: distType, dist_value: value});
+                var options = labels.map(function (label) { return {label: label, value: label}; });
+                return [options, value, selection];
+            }
+        }
+    });
+})();
@@ -0,0 +1,6 @@
+"""
+Benchmarks of the app's callbacks on synthetic races of increasing size.
+
+Run them from the repository root with `python -m benchmarks`; see
+benchmarks/__main__.py for the options and the results format.
+"""
@@ -0,0 +1,114 @@
+"""
+Run the callback benchmarks and write their results as json.
+
+    python -m benchmarks [--scales 100,10000,100000] [--repeat 20]
+                         [--output FILE] [--compare BASELINE.json]
+
+Results go to benchmarks/results/<commit>.json by default: the commit, the
+environment, and for each scale and case the latency percentiles (ms),
+peak traced memory, and response payload bytes.  --compare prints each
+case's median latency against an earlier results file and exits 1 if any
+case got slower by more than --threshold.
+"""
+
+import argparse
+import datetime
+import json
+import os
+import platform
+import subprocess
+import sys
+import tempfile
+import warnings
+
+import numpy as np
+
+from benchmarks import callbacks
+from benchmarks import synthetic
+
+
+def git_commit():
+    """
+    The current commit (with '-dirty' if the tree has changes), or None
+    outside a git checkout.
+    """
+    try:
+        commit = subprocess.run(['git', 'rev-parse', '--short', 'HEAD'], capture_output=True, text=True,
+                                check=True).stdout.strip()
+        dirty = subprocess.run(['git', 'status', '--porcelain', '--untracked-files=no'], capture_output=True,
+                               text=True, check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+    return commit + '-dirty' if dirty else commit
+
+
+def compare(results, baseline, threshold):
+    """
+    Print each case's median latency against the baseline's, and return the
+    cases that got slower by more than threshold (a fraction).
+    """
+    baseline_p50 = {(entry['rows'], entry['callback'], entry['case']): entry['latency_ms']['p50']
+                    for entry in baseline['results']}
+    regressions = []
+    print('{0:>7}  {1:<22} {2:<18} {3:>10} {4:>10} {5:>7}'.format('rows', 'callback', 'case', 'base ms', 'p50 ms', 'ratio'))
+    for entry in results['results']:
+        key = (entry['rows'], entry['callback'], entry['case'])
+        p50 = entry['latency_ms']['p50']
+        if key not in baseline_p50:
+            continue
+        ratio = p50/baseline_p50[key] if baseline_p50[key] else float('inf')
+        flag = ' !' if ratio > 1 + threshold else ''
+        print('{0:>7}  {1:<22} {2:<18} {3:>10.3f} {4:>10.3f} {5:>7.2f}{6}'.format(*key, baseline_p50[key], p50, ratio, flag))
+        if flag:
+            regressions.append(key)
+    return regressions
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Benchmark the app callbacks on synthetic races.')
+    parser.add_argument('--scales', default='100,10000,100000',
+                        help='athletes per synthetic race, comma separated (default: 100,10000,100000)')
+    parser.add_argument('--repeat', type=int, default=20, help='timed calls per case (default: 20)')
+    parser.add_argument('--seed', type=int, default=0, help='seed for the synthetic races')
+    parser.add_argument('--output', help='results file (default: benchmarks/results/<commit>.json)')
+    parser.add_argument('--compare', metavar='BASELINE', help='results file to compare median latencies against')
+    parser.add_argument('--threshold', type=float, default=0.25,
+                        help='slowdown counted as a regression by --compare (default: 0.25, i.e. 25%%)')
+    args = parser.parse_args()
+    scales = [int(scale) for scale in args.scales.split(',')]
+
+    warnings.simplefilter('ignore')
+    import app
+
+    results = {
+        'commit': git_commit(),
+        'date': datetime.datetime.now(datetime.timezone.utc).isoformat(timespec='seconds'),
+        'python': platform.python_version(),
+        'numpy': np.__version__,
+        'platform': platform.platform(),
+        'repeat': args.repeat,
+        'seed': args.seed,
+        'results': []
+    }
+    with tempfile.TemporaryDirectory(prefix='tristats-bench-') as work_dir:
+        callbacks.use_store(app, synthetic.build_synthetic_store(scales, work_dir, args.seed))
+        for rows in scales:
+            for case in callbacks.callback_cases(app, rows):
+                entry = dict(rows=rows, **callbacks.run_case(case, args.repeat))
+                results['results'].append(entry)
+                payload = '' if entry['payload_bytes'] is None else '{0:>9} B'.format(entry['payload_bytes'])
+                print('{0:>7}  {1:<22} {2:<18} p50 {3:9.3f} ms  p99 {4:9.3f} ms  peak {5:>11} B  {6}'.format(
+                    rows, entry['callback'], entry['case'], entry['latency_ms']['p50'], entry['latency_ms']['p99'],
+                    entry['peak_memory_bytes'], payload))
+
+    output = args.output or os.path.join('benchmarks', 'results', '{0}.json'.format(results['commit'] or 'results'))
+    os.makedirs(os.path.dirname(output) or '.', exist_ok=True)
+    with open(output, 'w') as f:
+        json.dump(results, f, indent=1)
+    print('wrote', output)
+    if args.compare:
+        with open(args.compare) as f:
+            regressions = compare(results, json.load(f), args.threshold)
+        if regressions:
+            print('{0} case(s) slower than {1} by more than {2:.0%}'.format(len(regressions), args.compare, args.threshold))
+            sys.exit(1)
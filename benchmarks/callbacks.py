@@ -0,0 +1,142 @@
+"""
+The callback benchmarks.
+
+The app is imported in-process and pointed at a store of synthetic races,
+and each case calls a callback (or the function a callback delegates to)
+directly, the way Dash would on a request: timed over repeated calls,
+then once more under tracemalloc for its peak memory, with the size of
+its response payload as Dash would serialize it (and gzipped, as it's
+sent).
+"""
+
+import collections
+import gzip
+import json
+import time
+import tracemalloc
+
+import numpy as np
+import plotly.utils
+
+from benchmarks.synthetic import race_name
+from tristats import store
+from tristats.memo import OutputCache
+from tristats.registry import RaceRegistry
+from tristats.stats import DistributionCache
+
+
+# One benchmark: the callback it exercises, which interaction, and how to
+# run it (setup runs before every call and isn't timed)
+Case = collections.namedtuple('Case', ['callback', 'case', 'run', 'setup'])
+
+
+def use_store(app, store_dir):
+    """
+    Point the app's registry and caches at the store in store_dir (with no
+    shared output store, so every worker-level cache starts empty).
+    """
+    app.race_store = store.RaceStore(store_dir)
+    app.race_registry = RaceRegistry(app.race_store, max_bytes=4 * 2**30)
+    app.distributions = DistributionCache(app.race_registry)
+    app.comparison_cache = OutputCache(shared=None)
+
+
+def callback_cases(app, rows):
+    """
+    Benchmark cases for the synthetic race with rows athletes.  The left
+    side is a division of the 2018 race and the right side the whole 2017
+    field, as after a visitor picks two athletes.
+    """
+    race = race_name(rows)
+    loaded = app.race_registry.get(race, '2018')
+    athlete_left = loaded.athlete_keys[len(loaded.athlete_keys)//2]
+    athlete_right = app.race_registry.get(race, '2017').athlete_keys[0]
+    left = app.resolve_selection('dist-radio', race, '2018', athlete_left, 'Division', None)[-1]
+    right = app.resolve_selection('athlete-dropdown', race, '2017', athlete_right, 'All', None)[-1]
+    figure_state = app.update_comparison(left, right, 'finish')[-1]
+    client = app.server.test_client()
+
+    def clear_outputs():
+        app.comparison_cache.clear()
+
+    def clear_all():
+        app.distributions.clear()
+        app.comparison_cache.clear()
+
+    def load():
+        app.race_registry.load(race, '2018')
+
+    def search():
+        response = client.get('/api/athletes', query_string={'q': 'an', 'race': race, 'year': '2018'})
+        return response.get_json()
+
+    return [
+        Case('race_registry.load', 'load race', load, None),
+        Case('set_selection_left', 'race change',
+             lambda: app.resolve_selection('race-dropdown', race, None, None, 'All', None), None),
+        Case('set_selection_left', 'athlete search',
+             lambda: app.resolve_selection('athlete-search', race, '2018', athlete_left, 'All', None, 'an'), None),
+        Case('set_selection_left', 'distribution type',
+             lambda: app.resolve_selection('dist-radio', race, '2018', athlete_left, 'Division', None), None),
+        Case('update_comparison', 'cold', lambda: app.update_comparison(left, right, 'finish'), clear_all),
+        Case('update_comparison', 'new athletes', lambda: app.update_comparison(left, right, 'finish'), clear_outputs),
+        Case('update_comparison', 'athlete patch',
+             lambda: app.update_comparison(left, right, 'finish', figure_state), clear_outputs),
+        Case('update_comparison', 'cached', lambda: app.update_comparison(left, right, 'finish'), None),
+        Case('set_race_bundle_left', 'new race', lambda: app.selected_race_bundle(left, None), None),
+        Case('search_athletes', 'api search', search, None),
+    ]
+
+
+def payload_bytes(output):
+    """
+    Size of a callback's response payload as serialized, and gzipped.
+    """
+    payload = json.dumps(output, cls=plotly.utils.PlotlyJSONEncoder).encode('utf-8')
+    return len(payload), len(gzip.compress(payload))
+
+
+def run_case(case, repeat):
+    """
+    Time a case over repeat calls (after an untimed one), then measure its
+    peak memory over one more.  Returns the case's results as a dict (payload sizes are None for
+    cases that don't respond, like loading a race).
+    """
+    # One untimed call first, so one-off work (e.g. building a race's
+    # athlete search on first use) doesn't land in the percentiles
+    if case.setup is not None:
+        case.setup()
+    case.run()
+    latencies = []
+    for i in range(repeat):
+        if case.setup is not None:
+            case.setup()
+        start = time.perf_counter()
+        output = case.run()
+        latencies.append(time.perf_counter() - start)
+    if case.setup is not None:
+        case.setup()
+    tracemalloc.start()
+    try:
+        case.run()
+        current, peak = tracemalloc.get_traced_memory()
+    finally:
+        tracemalloc.stop()
+    latencies_ms = np.array(latencies)*1000
+    size, gzip_size = payload_bytes(output) if output is not None else (None, None)
+    return {
+        'callback': case.callback,
+        'case': case.case,
+        'repeat': repeat,
+        'latency_ms': {
+            'p50': float(np.percentile(latencies_ms, 50)),
+            'p90': float(np.percentile(latencies_ms, 90)),
+            'p99': float(np.percentile(latencies_ms, 99)),
+            'mean': float(latencies_ms.mean()),
+            'min': float(latencies_ms.min()),
+            'max': float(latencies_ms.max())
+        },
+        'peak_memory_bytes': peak,
+        'payload_bytes': size,
+        'payload_gzip_bytes': gzip_size
+    }
@@ -0,0 +1,104 @@
+"""
+Synthetic races for the benchmarks.
+
+Races are written as results csvs in the layout of the scraped ones (time
+columns as h:mm:ss text plus decimal minutes) and built into a store with
+tristats.store.build_store, so they go through the same ingest as real
+races.  Names are drawn from small pools, so larger fields have repeated
+names (and keyed duplicates) like real results do.
+"""
+
+import os
+
+import numpy as np
+import pandas as pd
+
+from tristats import store
+
+
+first_names = ['Anne', 'Ben', 'Carlie', 'Dan', 'Eryn', 'Frank', 'Gail', 'Hugo', 'Iris', 'Josee',
+               'Kyle', 'Lena', 'Marc', 'Nora', 'Owen', 'Paula', 'Quinn', 'Rosa', 'Sam', 'Tara',
+               'Ugo', 'Vera', 'Will', 'Xena', 'Yves', 'Zoe']
+last_syllables = ['ber', 'cor', 'dan', 'el', 'gau', 'len', 'lin', 'mar', 'mel', 'mier',
+                  'mon', 'ne', 'ri', 'son', 'ter', 'ton', 'vin', 'wel']
+cities = ['Moncton', 'Hampton', 'Rothesay', 'Saint John', 'Fredericton', 'Shediac', 'Quispamsis', 'Sussex']
+age_groups = ['u20', '20-29', '30-39', '40-49', '50-59', '60-69', '70+']
+
+# Mean minutes and spread of each leg of a sprint triathlon
+legs = [('swim', 10.0, 2.5), ('t1', 2.0, 0.6), ('bike', 42.0, 7.0), ('t2', 1.5, 0.5), ('run', 27.0, 5.0)]
+
+
+def last_names(rng, count):
+    syllables = rng.choice(last_syllables, size=(count, 3))
+    lengths = rng.integers(2, 4, size=count)
+    return [''.join(parts[:length]).capitalize() for parts, length in zip(syllables, lengths)]
+
+
+def format_hhmmss(minutes):
+    seconds = int(round(minutes*60))
+    return '%02d:%02d:%02d' % (seconds//3600, seconds//60 % 60, seconds % 60)
+
+
+def results_frame(rows, seed=0):
+    """
+    A synthetic results table with rows athletes, in place order, about
+    2% of whom didn't finish.
+    """
+    rng = np.random.default_rng(seed)
+    genders = rng.choice(['F', 'M'], size=rows)
+    divisions = [gender + group for gender, group in zip(genders, rng.choice(age_groups, size=rows))]
+    names = [first + ' ' + last for first, last in zip(rng.choice(first_names, size=rows), last_names(rng, rows))]
+    # Each athlete is uniformly faster or slower across every leg
+    ability = rng.normal(1.0, 0.12, size=rows).clip(0.6, 1.8)
+    splits = {leg: (ability*rng.normal(mean, spread, size=rows).clip(mean/3)) for leg, mean, spread in legs}
+    finish = sum(splits.values())
+    dnf = rng.random(rows) < 0.02
+    finish[dnf] = np.nan
+    splits['run'][dnf] = np.nan
+    order = np.argsort(finish, kind='stable')
+    data = {
+        'place': np.where(dnf, np.nan, np.argsort(order) + 1),
+        'no.': rng.permutation(rows) + 1,
+        'name': names,
+        'city': rng.choice(cities, size=rows),
+        'division': divisions,
+        'finish_hhmmss': ['' if np.isnan(value) else format_hhmmss(value) for value in finish]
+    }
+    for leg, mean, spread in legs:
+        data[leg + '_hhmmss'] = ['' if np.isnan(value) else format_hhmmss(value) for value in splits[leg]]
+    data['finish'] = finish
+    for leg, mean, spread in legs:
+        data[leg] = splits[leg]
+    df = pd.DataFrame(data).iloc[order].reset_index(drop=True)
+    df['place'] = df['place'].astype('Int64')
+    return df
+
+
+def race_name(rows):
+    """
+    Name of the synthetic race with rows athletes, e.g. 'Synthetic 10k'.
+    """
+    if rows >= 1000 and rows % 1000 == 0:
+        return 'Synthetic {0}k'.format(rows//1000)
+    return 'Synthetic {0}'.format(rows)
+
+
+def build_synthetic_store(scales, work_dir, seed=0):
+    """
+    Build a store under work_dir with one synthetic race per scale (a
+    number of athletes), with two years each so races can be compared
+    across years.  Returns the store directory.
+    """
+    csv_dir = os.path.join(work_dir, 'csv')
+    store_dir = os.path.join(work_dir, 'store')
+    os.makedirs(csv_dir, exist_ok=True)
+    race_info = {}
+    for rows in scales:
+        race_info[race_name(rows)] = {}
+        for year in ['2017', '2018']:
+            dfname = 'synthetic{0}_{1}'.format(rows, year)
+            results_frame(rows, seed=seed + rows + int(year)).to_csv(
+                os.path.join(csv_dir, 'results_{0}.csv'.format(dfname)), index=False)
+            race_info[race_name(rows)][year] = {'dfname': dfname, 'url': None}
+    store.build_store(race_info, csv_dir, store_dir)
+    return store_dir
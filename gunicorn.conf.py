@@ -0,0 +1,30 @@
+"""
+gunicorn settings for serving the app (see Procfile).
+
+The app is imported once in the master (preload_app) and warmed up there:
+every race is loaded and indexed and the distribution cache filled before
+the workers fork.  Workers then share those pages copy-on-write (the race
+columns themselves are memory-mapped, so they're shared by the OS page
+cache), so adding workers costs little memory and a worker's first request
+is as fast as any other.
+"""
+
+import gc
+import os
+
+
+preload_app = True
+workers = int(os.environ.get('WEB_CONCURRENCY', 2))
+# Threaded workers, so identical requests arriving together in one worker
+# wait for a single computation (see tristats.memo) instead of queueing
+threads = int(os.environ.get('WEB_THREADS', 4))
+timeout = 30
+
+
+def when_ready(server):
+    import app
+    app.warm_up()
+    # Move everything built so far out of the collector's generations, so
+    # garbage collection in the workers doesn't touch (and copy) its pages
+    gc.collect()
+    gc.freeze()
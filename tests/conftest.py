@@ -0,0 +1,159 @@
+"""
+Shared fixtures: a small store of made-up races, built the way the app
+builds its store from the scraped results csvs, and a local stand-in for a
+results site (an http.server on localhost) for the ingest.
+"""
+
+import collections
+import hashlib
+import http.server
+import os
+import threading
+import time
+import urllib.parse
+
+import pandas as pd
+import pytest
+
+from tristats import store
+
+
+def results_frame(shift=0.0):
+    """
+    Results of a made-up sprint triathlon, in the layout of the scraped
+    csvs (times in decimal minutes).  Ann Lee raced twice, and the last
+    athlete didn't finish.
+    """
+    return pd.DataFrame({
+        'place': [1, 2, 3, 4, 5, 6, 7, None],
+        'no.': [101, 102, 103, 104, 105, 106, 107, 108],
+        'name': ['Ann Lee', 'Bea Cole', 'Cal Dunn', 'Dee Fox', 'Ann Lee', 'Eve Gray', 'Fay Hill', 'Gus Ives'],
+        'city': ['Moncton', 'Hampton', 'Sussex', 'Moncton', 'Shediac', 'Hampton', 'Sussex', 'Moncton'],
+        'division': ['F30-39', 'F30-39', 'M30-39', 'F20-29', 'F20-29', 'M40-49', 'F30-39', 'M30-39'],
+        'finish': [60.0 + shift, 62.5, 65.0, 70.0, 71.5, 75.0, 80.0, None],
+        'swim': [10.0, 11.0, 9.5, 12.0, 12.5, 13.0, 15.0, 14.0],
+        'bike': [30.0, 31.0, 33.0, 35.0, 35.5, 37.0, 40.0, 41.0],
+        'run': [20.0 + shift, 20.5, 22.5, 23.0, 23.5, 25.0, 25.0, None],
+    })
+
+
+# The made-up races: (race, year, dfname, results)
+test_races = [
+    ('Test', '2018', 'test18', results_frame()),
+    ('Test', '2017', 'test17', results_frame(shift=1.0)),
+    ('Other', '2018', 'other18', results_frame()),
+]
+
+
+@pytest.fixture
+def store_dir(tmp_path):
+    """
+    Directory of a store built from the made-up races.
+    """
+    csv_dir = str(tmp_path / 'csv')
+    os.makedirs(csv_dir)
+    race_info = {}
+    for race, year, dfname, df in test_races:
+        df.to_csv(os.path.join(csv_dir, 'results_{0}.csv'.format(dfname)), index=False)
+        race_info.setdefault(race, {})[year] = {'dfname': dfname, 'url': None}
+    store.build_store(race_info, csv_dir, str(tmp_path / 'store'))
+    return str(tmp_path / 'store')
+
+
+@pytest.fixture
+def race_store(store_dir):
+    return store.RaceStore(store_dir)
+
+
+# Athletes in the stand-in's multi-page event, and athletes per page
+event_rows = 11
+per_page = 4
+
+results_header = ('<tr><th>Place</th><th>Gun Time</th><th>Name</th><th>City</th><th>Div</th><th>Div Place</th>'
+                  '<th>Bib</th><th>Swim</th><th>T1</th><th>Bike</th><th>T2</th><th>Run</th></tr>')
+
+
+def results_page(page):
+    """
+    One page of the multi-page event, as raceroster lays it out.
+    """
+    rows = ''.join(
+        '<tr><td>{0}</td><td>1:{1:02d}:00</td><td><a>Athlete {0}</a></td><td>Moncton</td><td>M30-39</td>'
+        '<td>{0}/{2}</td><td>{3}</td><td>10:00</td><td>01:00</td><td>35:00</td><td>00:50</td><td>{4}:10</td>'
+        '</tr>'.format(i + 1, i, event_rows, 100 + i, 13 + i)
+        for i in range((page - 1)*per_page, min(event_rows, page*per_page)))
+    pages = -(-event_rows//per_page)
+    pagination = ''.join('<li><a href="?per_page={0}&page={1}">{1}</a></li>'.format(per_page, i)
+                         for i in range(1, pages + 1))
+    return ('<html><body><table class="results-listing__table table table-hover table-striped">'
+            '<thead>{0}</thead><tbody>{1}</tbody></table><ul class="pagination">{2}</ul>'
+            '</body></html>'.format(results_header, rows, pagination)).encode('utf-8')
+
+
+class StandIn(http.server.BaseHTTPRequestHandler):
+    """
+    The stand-in site:
+
+    - /flaky/<name>: 503 for the first two requests, then the page
+    - /down: always 503
+    - /missing: 404
+    - /results?page=N: the multi-page event
+    - anything else: a page with an ETag, answering 304 when it matches
+    """
+
+    protocol_version = 'HTTP/1.1'
+
+    def log_message(self, *args):
+        pass
+
+    def respond(self, status, body=b'', headers=()):
+        self.send_response(status)
+        for name, value in headers:
+            self.send_header(name, value)
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def do_GET(self):
+        server = self.server
+        with server.lock:
+            server.hits[self.path] += 1
+            hits = server.hits[self.path]
+            server.times[self.path].append(time.monotonic())
+        parts = urllib.parse.urlsplit(self.path)
+        if parts.path.startswith('/flaky/') and hits <= 2 or parts.path == '/down':
+            self.respond(503)
+        elif parts.path == '/missing':
+            self.respond(404)
+        elif parts.path == '/results':
+            page = int(urllib.parse.parse_qs(parts.query).get('page', ['1'])[0])
+            self.respond(200, results_page(page))
+        else:
+            body = 'page {0}'.format(self.path).encode('utf-8')
+            etag = '"{0}"'.format(hashlib.md5(body).hexdigest())
+            if self.headers.get('If-None-Match') == etag:
+                server.statuses[304] += 1
+                self.respond(304, headers=[('ETag', etag)])
+            else:
+                server.statuses[200] += 1
+                self.respond(200, body, headers=[('ETag', etag)])
+
+
+@pytest.fixture
+def site():
+    """
+    The stand-in site, running on a free port, with a count of the
+    requests for each path (hits), when they came in (times), and the
+    statuses of its ETag pages (statuses).
+    """
+    server = http.server.ThreadingHTTPServer(('127.0.0.1', 0), StandIn)
+    server.lock = threading.Lock()
+    server.hits = collections.Counter()
+    server.times = collections.defaultdict(list)
+    server.statuses = collections.Counter()
+    server.base = 'http://127.0.0.1:{0}'.format(server.server_port)
+    thread = threading.Thread(target=server.serve_forever, daemon=True)
+    thread.start()
+    yield server
+    server.shutdown()
+    server.server_close()
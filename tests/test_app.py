@@ -0,0 +1,197 @@
+"""
+Tests of the app's callbacks, called directly on the races in Data_output/.
+"""
+
+import base64
+import os
+
+import numpy as np
+
+# Comparisons are only cached in memory here, not in the shared store in Data_cache/
+os.environ['TRISTATS_SHARED_CACHE'] = ''
+
+import app
+
+
+def values(array):
+    """
+    Values of a figure array, whether sent as a list or as a typed array.
+    """
+    if isinstance(array, dict):
+        return np.frombuffer(base64.b64decode(array['bdata']), dtype=np.dtype(array['dtype']).newbyteorder('<'))
+    return np.asarray(array)
+
+
+def selection(race, year, athlete, dist_type='All', dist_value='All'):
+    return {'race': race, 'year': year, 'athlete': athlete, 'dist_type': dist_type, 'dist_value': dist_value,
+            'athlete_row': app.race_registry.get(race, year).athlete_index[athlete]}
+
+
+def test_resolve_race():
+    # A new race resets the year to the latest and the athlete to the first
+    (year_options, year, athlete_options, athlete, dist_options, dist_value,
+     resolved) = app.resolve_selection('race-dropdown', 'Hampton', '2016', 'Zachary Boulanger', 'All', 'All')
+    assert year_options[0] == {'label': '2018', 'value': '2018'} and year == '2018'
+    # Only the first page of athletes is sent
+    assert len(athlete_options) == app.athlete_page_size
+    assert athlete_options[0] == {'label': 'Adelaine (Addie) Carten', 'value': 'Adelaine (Addie) Carten'}
+    assert [option['value'] for option in athlete_options] == sorted(option['value'] for option in athlete_options)
+    assert athlete == 'Adelaine (Addie) Carten'
+    assert resolved == selection('Hampton', '2018', 'Adelaine (Addie) Carten')
+
+
+def test_resolve_athlete():
+    # A new athlete keeps the year and the rosters, and moves to the athlete's own group
+    outputs = app.resolve_selection('athlete-dropdown', 'Rockwood', '2018', 'Zachary Boulanger', 'Gender', 'female')
+    assert outputs[0] is app.dash.no_update and outputs[2] is app.dash.no_update
+    assert outputs[5] == 'male'
+    outputs = app.resolve_selection('dist-radio', 'Rockwood', '2018', 'Zachary Boulanger', 'Division', 'male')
+    assert {'label': 'm1-19', 'value': 'm1-19'} in outputs[4]
+    assert outputs[6] == selection('Rockwood', '2018', 'Zachary Boulanger', 'Division', 'm1-19')
+
+
+def test_resolve_dist_value():
+    # Picking another group keeps it, as long as the race has it
+    outputs = app.resolve_selection('dist-details-dropdown', 'Rockwood', '2018', 'Zachary Boulanger', 'Division', 'm20-29')
+    assert outputs[4] is app.dash.no_update
+    assert outputs[5] == 'm20-29'
+    outputs = app.resolve_selection('dist-details-dropdown', 'Rockwood', '2018', 'Zachary Boulanger', 'All', 'm20-29')
+    assert outputs[5] == 'All'
+
+
+def test_resolve_athlete_search():
+    # Typing only updates the athlete options, and keeps the selected athlete in them
+    outputs = app.resolve_selection('athlete-search', 'Rockwood', '2018', 'Zachary Boulanger',
+                                    'All', 'All', 'chand sc')
+    assert [output is app.dash.no_update for output in outputs] == [True, True, False, True, True, True, True]
+    assert [option['value'] for option in outputs[2]] == ['Chandler Scott', 'Zachary Boulanger']
+
+
+def test_resolve_athlete_selection():
+    # In clientside mode the server leaves the distribution to the browser
+    outputs = app.resolve_athlete_selection('race-dropdown', 'Hampton', '2016', 'Zachary Boulanger')
+    full = app.resolve_selection('race-dropdown', 'Hampton', '2016', 'Zachary Boulanger', 'All', 'All')
+    assert len(outputs) == 5
+    assert outputs[:4] == full[:4]
+    assert outputs[4] == {key: value for key, value in full[6].items() if key not in ('dist_type', 'dist_value')}
+    outputs = app.resolve_athlete_selection('athlete-search', 'Rockwood', '2018', 'Zachary Boulanger', 'chand sc')
+    assert outputs[4] is app.dash.no_update
+
+
+def test_search_api():
+    client = app.server.test_client()
+    response = client.get('/api/athletes?q=chandler&race=Rockwood&year=2018')
+    assert response.json['total'] == 1
+    assert response.json['results'] == [{'athlete': 'Chandler Scott', 'race': 'Rockwood', 'year': '2018'}]
+    # Across all races, a page at a time
+    everyone = client.get('/api/athletes?limit=1000').json
+    assert everyone['limit'] == 100 and len(everyone['results']) == 100
+    page = client.get('/api/athletes?offset=1&limit=2').json
+    assert page['total'] == everyone['total']
+    assert page['results'] == everyone['results'][1:3]
+    assert client.get('/api/athletes?limit=x').status_code == 400
+    assert client.get('/api/athletes?race=Nowhere&year=2018').status_code == 404
+
+
+def test_update_comparison():
+    text, boxplot, histogram, figure_state = app.update_comparison(
+        selection('Rockwood', '2018', 'Zachary Boulanger'),
+        selection('Rockwood', '2018', 'Chandler Scott', 'Division', 'm20-29'), 'finish')
+    assert text.children[0].children == \
+        'Zachary Boulanger (Rockwood 2018) was faster than Chandler Scott (Rockwood 2018) by: 03:24'
+    # The text and both plots are built from the same lookups
+    labels = ['Zachary Boulanger<br>1st percentile (1 out of 76)', 'Chandler Scott<br>8th percentile (1 out of 12)']
+    assert [boxplot['data'][i]['name'] for i in [0, 3]] == labels
+    assert [histogram['data'][i]['name'] for i in [2, 3]] == labels
+    assert len(values(boxplot['data'][1]['x'])) == 76
+    assert len(values(boxplot['data'][4]['x'])) == 12
+
+
+def test_athlete_without_time():
+    # An athlete who didn't finish isn't ranked, and the text can't compare
+    text, boxplot, histogram, figure_state = app.update_comparison(
+        selection('Hampton', '2018', 'Heather White'), selection('Rockwood', '2018', 'Zachary Boulanger'), 'finish')
+    assert text.children[0].children == "I'm sorry, this is confusing."
+    assert boxplot['data'][0]['name'] == 'Heather White<br>no time'
+    assert histogram['data'][2]['name'] == 'Heather White<br>no time'
+
+
+def test_histogram_without_times():
+    # Hampton 2017 didn't time the transitions
+    athlete = app.race_registry.get('Hampton', '2017').athlete_keys[0]
+    text, boxplot, histogram, figure_state = app.update_comparison(
+        selection('Hampton', '2017', athlete), selection('Rockwood', '2018', 'Zachary Boulanger'), 't1')
+    bars_left, bars_right, line_left, line_right = histogram['data']
+    assert not bars_left['showlegend'] and bars_right['showlegend']
+    assert values(bars_left['y']).sum() == 0
+    assert values(bars_right['y']).sum() == 75
+    assert line_left['name'] == athlete + '<br>no times'
+    # Neither side timed: no bars at all
+    text, boxplot, histogram, figure_state = app.update_comparison(
+        selection('Hampton', '2017', athlete), selection('Hampton', '2017', athlete), 't2')
+    assert len(values(histogram['data'][0]['x'])) == 0
+    assert list(histogram['data'][2]['y']) == [0, 0]
+
+
+def patched(patch):
+    """
+    The (location, value) of each assignment a dash.Patch will make.
+    """
+    return {tuple(operation['location']): operation['params']['value']
+            for operation in patch.to_plotly_json()['operations']}
+
+
+def test_patch_athletes():
+    left = selection('Rockwood', '2018', 'Zachary Boulanger')
+    right = selection('Rockwood', '2018', 'Chandler Scott', 'Division', 'm20-29')
+    text, boxplot, histogram, figure_state = app.update_comparison(left, right, 'finish')
+    # Same distributions with another athlete: only the athlete traces change
+    left = selection('Rockwood', '2018', 'Chandler Scott')
+    text, boxplot, histogram, new_figure_state = app.update_comparison(left, right, 'finish', figure_state)
+    assert new_figure_state is app.dash.no_update
+    assert text.children[0].children.startswith('Chandler Scott (Rockwood 2018) was')
+    boxplot = patched(boxplot)
+    assert boxplot[('data', 0, 'y')] == ['Chandler Scott']
+    assert boxplot[('data', 0, 'name')].startswith('Chandler Scott<br>')
+    histogram = patched(histogram)
+    assert set(histogram) == {('layout', 'xaxis'), ('data', 2, 'x'), ('data', 2, 'name'),
+                              ('data', 3, 'x'), ('data', 3, 'name')}
+    # A different subset redraws the figures
+    left = selection('Rockwood', '2018', 'Chandler Scott', 'Gender', 'male')
+    text, boxplot, histogram, new_figure_state = app.update_comparison(left, right, 'finish', figure_state)
+    assert new_figure_state['left'] == ['Rockwood', '2018', 'Gender', 'male']
+    assert isinstance(boxplot, dict) and isinstance(histogram, dict)
+
+
+def test_race_bundle():
+    bundle, version = app.selected_race_bundle(selection('Rockwood', '2018', 'Zachary Boulanger'), None)
+    assert (bundle['race'], bundle['year']) == ('Rockwood', '2018')
+    assert version == bundle['version']
+    # A browser holding this bundle's version isn't sent it again, but is for another race year
+    assert app.selected_race_bundle(selection('Rockwood', '2018', 'Chandler Scott'), version) == \
+        (app.dash.no_update, app.dash.no_update)
+    bundle, version = app.selected_race_bundle(selection('Hampton', '2018', 'Adelaine (Addie) Carten'), version)
+    assert bundle['race'] == 'Hampton'
+
+
+def test_warm_up():
+    app.warm_up()
+    # Every race is resident, and the default comparison's distributions are cached
+    assert len(app.race_registry.resident()) == sum(len(app.race_registry.years(race)) for race in app.race_registry.races())
+    cached = len(app.distributions)
+    selection = app.resolve_selection(None, 'Rockwood', None, None, 'All', None)[-1]
+    app.update_comparison(selection, selection, 'finish')
+    assert len(app.distributions) == cached
+
+
+def test_comparison_cache():
+    app.comparison_cache.clear()
+    hits = app.comparison_cache.hits
+    left = selection('Rockwood', '2018', 'Zachary Boulanger')
+    right = selection('Rockwood', '2018', 'Chandler Scott', 'Division', 'm20-29')
+    first = app.update_comparison(left, right, 'finish')
+    # The same comparison again is served from the cache
+    assert app.update_comparison(dict(left), dict(right), 'finish') is first
+    assert app.update_comparison(left, right, 'swim') is not first
+    stats = app.server.test_client().get('/api/cache').json['comparison']
+    assert (stats['entries'], stats['hits']) == (2, hits + 1)
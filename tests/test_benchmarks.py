@@ -0,0 +1,54 @@
+"""
+Tests of the benchmarks: the synthetic races, a run of every case on a
+small one, and the comparison against an earlier run.
+"""
+
+import os
+
+import numpy as np
+
+# Comparisons are only cached in memory here, not in the shared store in Data_cache/
+os.environ['TRISTATS_SHARED_CACHE'] = ''
+
+import app
+from benchmarks import callbacks
+from benchmarks import synthetic
+from benchmarks.__main__ import compare
+
+
+def test_results_frame():
+    df = synthetic.results_frame(500, seed=1)
+    assert len(df) == 500
+    finished = df['finish'].notna()
+    # In place order, with the athletes who didn't finish last and unplaced
+    assert list(df['place'][finished]) == list(range(1, finished.sum() + 1))
+    assert finished.is_monotonic_decreasing and df['place'][~finished].isna().all()
+    assert np.allclose(df[['swim', 't1', 'bike', 't2', 'run']][finished].sum(axis=1), df['finish'][finished])
+    assert synthetic.format_hhmmss(61.5) == '01:01:30'
+    assert (synthetic.race_name(100), synthetic.race_name(10000)) == ('Synthetic 100', 'Synthetic 10k')
+
+
+def test_callback_cases(tmp_path, monkeypatch):
+    # use_store repoints the app's globals: put them back afterwards
+    for name in ['race_store', 'race_registry', 'distributions', 'comparison_cache']:
+        monkeypatch.setattr(app, name, getattr(app, name))
+    callbacks.use_store(app, synthetic.build_synthetic_store([100], str(tmp_path)))
+    entries = [callbacks.run_case(case, repeat=2) for case in callbacks.callback_cases(app, 100)]
+    assert len({(entry['callback'], entry['case']) for entry in entries}) == len(entries)
+    for entry in entries:
+        assert entry['latency_ms']['min'] <= entry['latency_ms']['p50'] <= entry['latency_ms']['max']
+        assert entry['peak_memory_bytes'] > 0
+    # Every case responds but loading a race
+    assert [entry['case'] for entry in entries if entry['payload_bytes'] is None] == ['load race']
+
+
+def test_compare(capsys):
+    def run(*p50s):
+        return {'results': [{'rows': 100, 'callback': 'update_comparison', 'case': case, 'latency_ms': {'p50': p50}}
+                            for case, p50 in zip(['cold', 'cached', 'new'], p50s)]}
+
+    # Only cases in both runs are compared
+    baseline = run(10.0, 1.0)
+    assert compare(run(12.0, 1.0, 5.0), baseline, 0.25) == []
+    assert compare(run(13.0, 0.5), baseline, 0.25) == [(100, 'update_comparison', 'cold')]
+    assert ' !' in capsys.readouterr().out
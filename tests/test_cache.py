@@ -0,0 +1,45 @@
+"""
+Tests of the on-disk response cache: storing pages, conditional
+revalidation against the stand-in site, and offline replay.
+"""
+
+import os
+
+import pytest
+
+from tristats.ingest.cache import ResponseCache
+from tristats.ingest.fetch import Fetcher, FetchError, Page
+
+
+def test_put_and_get(tmp_path):
+    cache = ResponseCache(str(tmp_path / 'cache'))
+    assert cache.get('https://example.com/a') is None
+    assert cache.conditional_headers('https://example.com/a') == {}
+    page = Page('https://example.com/a?page=1', 200, {'ETag': '"abc"', 'Last-Modified': 'Mon, 01 Jan 2018'}, b'results')
+    cache.put('https://example.com/a', page)
+    cache.put('https://example.com/b', page._replace(headers={}))
+    assert cache.get('https://example.com/a') == page
+    assert cache.conditional_headers('https://example.com/a') == \
+        {'If-None-Match': '"abc"', 'If-Modified-Since': 'Mon, 01 Jan 2018'}
+    # The same body under two urls is stored once
+    bodies = [name for root, dirs, names in os.walk(str(tmp_path / 'cache' / 'bodies')) for name in names]
+    assert len(bodies) == 1
+
+
+def test_revalidation_and_offline_replay(site, tmp_path):
+    cache = ResponseCache(str(tmp_path / 'cache'))
+    urls = [site.base + '/race/{0}'.format(i) for i in range(3)]
+    with Fetcher(min_interval=0, cache=cache) as fetcher:
+        first = fetcher.fetch_all(urls)
+        again = fetcher.fetch_all(urls)
+    assert site.statuses == {200: 3, 304: 3}
+    assert [page.status for page in again] == [200]*3
+    assert [page.content for page in again] == [page.content for page in first]
+    # Offline, pages come from the cache without touching the site
+    site.hits.clear()
+    with Fetcher(cache=cache, offline=True) as fetcher:
+        replayed = fetcher.fetch_all(urls)
+        with pytest.raises(FetchError):
+            fetcher.fetch(site.base + '/race/never-fetched')
+    assert [page.content for page in replayed] == [page.content for page in first]
+    assert not site.hits
@@ -0,0 +1,96 @@
+"""
+Tests of decoding results rows straight into the store's typed columns.
+"""
+
+import pandas as pd
+
+from tristats import store
+from tristats.ingest.decode import ColumnDecoder, column_sources
+from tristats.times import MISSING
+
+
+# A results table as parsed from a page: the header, then rows of cell strings
+header = ['Place', 'Bib', 'Athlete', 'City', 'Div', 'Swim-Swim', 'T1-Exit1', 'Gun Time']
+rows = [
+    ['1', '212', ' Jane Smith ', 'Moncton', 'F30-39', '12:03', '01:10', '1:05:51'],
+    ['2', '', 'Ann Lee', '', 'f20-29', '10:30', '', '1:10:30'],
+    ['3', '31', 'Bob Ray', 'Sussex', 'M30-39', 'DNS', '00:55', '1:15:15'],
+    ['', '40', 'Sam Poe', 'Hampton', 'M30-39', '11:00', '1:5', 'DNF'],
+]
+
+
+def test_column_sources():
+    sources = column_sources(header)
+    assert sources['no.'] == 1 and sources['name'] == 2 and sources['division'] == 4
+    assert sources['swim'] == 5 and sources['t1'] == 6 and sources['finish'] == 7
+    assert 'gender' not in sources and 'bike' not in sources
+    # Time strings are used over the decimal-minute columns of the csvs
+    assert column_sources(['swim', 'swim_hhmmss'])['swim'] == 1
+
+
+def test_decode():
+    decoder = ColumnDecoder(header)
+    decoder.extend(rows)
+    columns = decoder.finish()
+    assert decoder.rows == 4
+    assert set(columns) == {name for name, kind in store.canonical_columns}
+    assert columns['place'].tolist() == [1, 2, 3, MISSING]
+    assert columns['no.'].tolist() == [212, MISSING, 31, 40]
+    assert columns['name'].tolist() == ['Jane Smith', 'Ann Lee', 'Bob Ray', 'Sam Poe']
+    assert columns['city'].tolist() == ['Moncton', '', 'Sussex', 'Hampton']
+    # Category labels are lowercased and sorted, as normalize_results gives them
+    codes, labels = columns['division']
+    assert labels == ['f20-29', 'f30-39', 'm30-39']
+    assert codes.tolist() == [1, 0, 2, 2]
+    codes, labels = columns['gender']
+    assert [labels[code] for code in codes] == ['female', 'female', 'male', 'male']
+    # Times in whole seconds; markers and malformed times are MISSING
+    assert columns['swim'].tolist() == [723, 630, MISSING, 660]
+    assert columns['t1'].tolist() == [70, MISSING, 55, MISSING]
+    assert columns['finish'].tolist() == [3951, 4230, 4515, MISSING]
+    assert (columns['bike'] == MISSING).all()
+
+
+def test_blank_division():
+    # Without a division there's no gender to derive either
+    decoder = ColumnDecoder(header)
+    decoder.extend(rows + [['5', '41', 'Lu Orr', '', ' ', '', '', '']])
+    columns = decoder.finish()
+    assert columns['division'][0].tolist()[-1] == MISSING
+    codes, labels = columns['gender']
+    assert labels == ['female', 'male']
+    assert codes.tolist() == [0, 0, 1, 1, MISSING]
+
+
+def test_batches():
+    # Times are parsed a batch at a time; the batch size doesn't change the result
+    decoder = ColumnDecoder(header, batch_size=3)
+    decoder.extend(rows*5)
+    small = decoder.finish()
+    decoder = ColumnDecoder(header)
+    decoder.extend(rows*5)
+    whole = decoder.finish()
+    assert small['finish'].tolist() == whole['finish'].tolist() == [3951, 4230, 4515, MISSING]*5
+
+
+def test_no_rows():
+    columns = ColumnDecoder(header).finish()
+    assert len(columns['place']) == len(columns['name']) == len(columns['finish']) == 0
+    assert columns['division'][1] == []
+
+
+def test_matches_normalize_results():
+    # Decoding the rows of a results csv gives the columns the store's own ingest does
+    csv_header = ['Place', 'Bib', 'Athlete', 'City', 'Div', 'swim_mmss', 't1_mmss', 'Time_Total_hhmmss']
+    csv_rows = rows + [['5', '41', 'Lu Orr', '', ' ', '', '', '']]
+    decoder = ColumnDecoder(csv_header)
+    decoder.extend(csv_rows)
+    decoded = decoder.finish()
+    normalized = store.normalize_results(pd.DataFrame(csv_rows, columns=csv_header))
+    for name, kind in store.canonical_columns:
+        if kind == 'category':
+            assert decoded[name][0].tolist() == normalized[name][0].tolist()
+            assert decoded[name][1] == normalized[name][1]
+        else:
+            assert decoded[name].dtype == normalized[name].dtype
+            assert decoded[name].tolist() == normalized[name].tolist()
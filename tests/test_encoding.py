@@ -0,0 +1,61 @@
+"""
+Tests of the race bundles sent to the browser for the clientside comparison.
+"""
+
+import base64
+
+import numpy as np
+
+from tristats.encoding import b64_array, binary_figure, bundle_version, race_bundle, typed_array
+from tristats.registry import RaceRegistry
+
+
+def decode(text, dtype):
+    return np.frombuffer(base64.b64decode(text), dtype=np.dtype(dtype).newbyteorder('<'))
+
+
+def test_b64_array():
+    values = np.array([1.5, np.nan, 80.25])
+    assert np.array_equal(decode(b64_array(values, 'f4'), 'f4'), values, equal_nan=True)
+    assert decode(b64_array([3, -1, 0], 'i2'), 'i2').tolist() == [3, -1, 0]
+
+
+def test_typed_array():
+    array = typed_array(np.array([60.25, 75.5]))
+    assert array['dtype'] == 'f4'
+    assert decode(array['bdata'], 'f4').tolist() == [60.25, 75.5]
+    # Integers in the narrowest type that holds them
+    assert typed_array(np.array([0, 255]))['dtype'] == 'u1'
+    assert typed_array(np.array([0, 256]))['dtype'] == 'u2'
+    assert typed_array(np.array([-1, 200]))['dtype'] == 'i2'
+    assert typed_array(np.array([0, 70000]))['dtype'] == 'u4'
+    assert typed_array(np.zeros(0, dtype=int))['dtype'] == 'u1'
+
+
+def test_binary_figure():
+    figure = {'data': [{'type': 'bar', 'x': np.array([60.5, 61.5]), 'y': np.array([3, 4]), 'name': 'bars'},
+                       {'type': 'scatter', 'x': [70.0, 70.0], 'y': [0, 4]}],
+              'layout': {'title': 'finish'}}
+    binary = binary_figure(figure)
+    assert binary['layout'] == figure['layout']
+    bars, line = binary['data']
+    assert bars['x']['dtype'] == 'f4' and bars['y']['dtype'] == 'u1'
+    assert decode(bars['y']['bdata'], 'u1').tolist() == [3, 4]
+    assert bars['name'] == 'bars'
+    # Short lists (the athlete markers) stay plain JSON
+    assert line == figure['data'][1]
+
+
+def test_race_bundle(race_store):
+    loaded = RaceRegistry(race_store).get('Test', '2018')
+    bundle = race_bundle(loaded, 'Test', '2018', race_store.version)
+    assert bundle['version'] == bundle_version(race_store.version, 'Test', '2018')
+    assert bundle['rows'] == len(loaded) == 8
+    # Times by row in seconds, -1 where the athlete has none
+    finish = decode(bundle['times']['finish'], 'i4')
+    assert finish.tolist() == [3600, 3750, 3900, 4200, 4290, 4500, 4800, -1]
+    assert (decode(bundle['times']['t1'], 'i4') == -1).all()
+    # Subset codes index the subset labels
+    division = bundle['subsets']['division']
+    codes = decode(division['codes'], 'i2')
+    assert [division['labels'][code] for code in codes[:4]] == ['f30-39', 'f30-39', 'm30-39', 'f20-29']
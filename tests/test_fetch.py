@@ -0,0 +1,43 @@
+"""
+Tests of the pooled fetcher against the stand-in results site: retries with
+backoff, and the per-host request interval.
+"""
+
+import pytest
+
+from tristats.ingest.fetch import Fetcher, FetchError
+
+
+def test_retry_with_backoff(site):
+    with Fetcher(min_interval=0, retries=3, backoff=0.05) as fetcher:
+        page = fetcher.fetch(site.base + '/flaky/a')
+    assert page.status == 200
+    assert page.content == b'page /flaky/a'
+    times = site.times['/flaky/a']
+    assert len(times) == 3
+    # Waits of backoff, then 2*backoff
+    assert times[1] - times[0] >= 0.05
+    assert times[2] - times[1] >= 0.1
+
+
+def test_retries_run_out(site):
+    with Fetcher(min_interval=0, retries=2, backoff=0.01) as fetcher:
+        with pytest.raises(FetchError):
+            fetcher.fetch(site.base + '/down')
+        results = fetcher.fetch_all([site.base + '/down', site.base + '/missing', site.base + '/ok'],
+                                    return_exceptions=True)
+    assert site.hits['/down'] == 6
+    assert isinstance(results[0], FetchError)
+    assert results[1].status == 404
+    assert results[2].content == b'page /ok'
+
+
+def test_fetch_all_in_order(site):
+    urls = [site.base + '/page/{0}'.format(i) for i in range(8)]
+    with Fetcher(max_workers=4, min_interval=0.02) as fetcher:
+        pages = fetcher.fetch_all(urls)
+    assert [page.content for page in pages] == ['page /page/{0}'.format(i).encode('utf-8') for i in range(8)]
+    # Requests to the host are spaced min_interval apart (checked over the
+    # whole run, since each one's arrival at the server jitters)
+    starts = sorted(time for path, times in site.times.items() for time in times)
+    assert starts[-1] - starts[0] >= 0.1
@@ -0,0 +1,278 @@
+"""
+Tests of the output cache: expiry, eviction, hit/miss counts, the shared
+store, and coalescing of concurrent misses, within a worker and across
+workers sharing a SqliteCache.
+"""
+
+import json
+import os
+import threading
+import time
+import zlib
+
+import pytest
+
+from tristats import memo
+from tristats.memo import OutputCache, SqliteCache, code_version, payload_size
+
+
+class Clock:
+    """
+    A clock the tests move by hand.
+    """
+
+    def __init__(self):
+        self.now = 0.0
+
+    def __call__(self):
+        return self.now
+
+
+def concurrently(count, target):
+    """
+    Call target from count threads started together, returning their results.
+    """
+    results = [None]*count
+    errors = [None]*count
+    barrier = threading.Barrier(count)
+
+    def run(i):
+        barrier.wait()
+        try:
+            results[i] = target()
+        except Exception as e:
+            errors[i] = e
+
+    threads = [threading.Thread(target=run, args=(i,)) for i in range(count)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    return results, errors
+
+
+def slow_compute(calls, value, delay=0.2):
+    """
+    A compute function that counts its calls in calls and takes delay seconds.
+    """
+    lock = threading.Lock()
+
+    def compute():
+        with lock:
+            calls.append(1)
+        time.sleep(delay)
+        return value
+
+    return compute
+
+
+def test_payload_size():
+    assert payload_size('x'*6) == 8
+    assert payload_size({'a': [1, 2]}) == len('{"a": [1, 2]}')
+
+
+def test_ttl():
+    clock = Clock()
+    cache = OutputCache(ttl=10, clock=clock)
+    cache.put('a', [1])
+    clock.now = 9
+    assert cache.get('a') == [1]
+    clock.now = 10
+    assert cache.get('a') is None
+    assert len(cache) == 0
+
+
+def test_lru_eviction():
+    cache = OutputCache(max_bytes=20)
+    cache.put('a', 'x'*6)
+    cache.put('b', 'y'*6)
+    cache.get('a')
+    cache.put('c', 'z'*6)
+    assert cache.get('b') is None
+    assert cache.get('a') == 'x'*6
+    assert cache.get('c') == 'z'*6
+    assert cache.stats()['evictions'] == 1
+    # An output bigger than the whole budget isn't kept
+    cache.put('d', 'w'*30)
+    assert cache.get('d') is None
+    assert cache.stats()['bytes'] == 16
+
+
+def test_get_or_compute():
+    cache = OutputCache()
+    calls = []
+
+    def compute():
+        calls.append(1)
+        return {'a': 1}
+
+    assert cache.get_or_compute('key', compute) == {'a': 1}
+    assert cache.get_or_compute('key', compute) == {'a': 1}
+    assert len(calls) == 1
+    stats = cache.stats()
+    assert (stats['entries'], stats['hits'], stats['misses'], stats['hit_rate']) == (1, 1, 1, 0.5)
+    cache.clear()
+    assert cache.stats()['bytes'] == 0
+
+
+def test_coalesced_in_worker():
+    cache = OutputCache()
+    calls = []
+    results, errors = concurrently(8, lambda: cache.get_or_compute('key', slow_compute(calls, {'a': 1})))
+    assert len(calls) == 1
+    assert errors == [None]*8
+    assert results == [{'a': 1}]*8
+    assert cache.stats()['coalesced'] == 7
+    assert cache.get_or_compute('key', slow_compute(calls, {'a': 2})) == {'a': 1}
+    assert len(calls) == 1
+
+
+def test_coalesced_error():
+    cache = OutputCache()
+    calls = []
+
+    def fail():
+        calls.append(1)
+        time.sleep(0.2)
+        raise ValueError('no such race')
+
+    results, errors = concurrently(4, lambda: cache.get_or_compute('key', fail))
+    assert len(calls) == 1
+    assert all(isinstance(error, ValueError) for error in errors)
+    # A failed output isn't cached
+    assert cache.get_or_compute('key', lambda: 'ok') == 'ok'
+
+
+def test_shared_store(tmp_path):
+    path = str(tmp_path / 'cache' / 'outputs.sqlite')
+    calls = []
+
+    def compute():
+        calls.append(1)
+        return {'figure': [1, 2, 3]}
+
+    assert OutputCache(shared=SqliteCache(path)).get_or_compute('key', compute) == {'figure': [1, 2, 3]}
+    # Another worker finds it in the shared store instead of computing it
+    other = OutputCache(shared=SqliteCache(path))
+    assert other.get_or_compute('key', compute) == {'figure': [1, 2, 3]}
+    assert len(calls) == 1
+    assert other.stats()['shared_hits'] == 1
+    # The store's directory is only open to the app's user
+    assert os.stat(str(tmp_path / 'cache')).st_mode & 0o777 == 0o700
+
+
+def test_shared_store_expiry(tmp_path):
+    shared = SqliteCache(str(tmp_path / 'outputs.sqlite'))
+    shared.set('a', b'payload', ttl=60)
+    shared.set('b', b'payload', ttl=-1)
+    assert shared.get('a') == b'payload'
+    assert shared.get('b') is None
+    shared.clear()
+    assert shared.get('a') is None
+
+
+def test_leases(tmp_path):
+    shared = SqliteCache(str(tmp_path / 'outputs.sqlite'))
+    assert not shared.leased('key')
+    assert shared.lease('key', 60)
+    # Held until released, and checking doesn't take it
+    assert shared.leased('key') and not shared.lease('key', 60)
+    shared.release('key')
+    assert not shared.leased('key')
+    # A lapsed lease can be taken over
+    assert shared.lease('key', -1)
+    assert not shared.leased('key') and shared.lease('key', 60)
+
+
+def test_coalesced_across_workers(tmp_path):
+    path = str(tmp_path / 'outputs.sqlite')
+    # One OutputCache per worker, each with its own connection to the shared store
+    workers = [OutputCache(shared=SqliteCache(path), poll_interval=0.01) for i in range(4)]
+    calls = []
+    compute = slow_compute(calls, {'figure': [1, 2, 3]})
+    turn = iter(workers)
+    lock = threading.Lock()
+
+    def request():
+        with lock:
+            worker = next(turn)
+        return worker.get_or_compute(('comparison', 'v1'), compute)
+
+    results, errors = concurrently(4, request)
+    assert len(calls) == 1
+    assert errors == [None]*4
+    assert results == [{'figure': [1, 2, 3]}]*4
+    assert sum(worker.stats()['coalesced'] for worker in workers) == 3
+    # Later misses in a new worker are served from the shared store
+    fresh = OutputCache(shared=SqliteCache(path))
+    assert fresh.get_or_compute(('comparison', 'v1'), compute) == {'figure': [1, 2, 3]}
+    assert len(calls) == 1
+    assert fresh.stats()['shared_hits'] == 1
+
+
+def test_takeover_after_failed_leader(tmp_path):
+    path = str(tmp_path / 'outputs.sqlite')
+    leader = OutputCache(shared=SqliteCache(path))
+    follower = OutputCache(shared=SqliteCache(path), poll_interval=0.01)
+    started = threading.Event()
+
+    def fail():
+        started.set()
+        time.sleep(0.2)
+        raise ValueError('worker failed')
+
+    def lead():
+        with pytest.raises(ValueError):
+            leader.get_or_compute('key', fail)
+
+    thread = threading.Thread(target=lead)
+    thread.start()
+    started.wait()
+    # The follower waits on the leader's lease, then computes once it's released
+    calls = []
+    assert follower.get_or_compute('key', slow_compute(calls, 'ok', delay=0)) == 'ok'
+    thread.join()
+    assert len(calls) == 1
+
+
+def test_shared_store_payloads(tmp_path):
+    shared = SqliteCache(str(tmp_path / 'outputs.sqlite'))
+    cache = OutputCache(shared=shared)
+    value = cache.get_or_compute('key', lambda: ({'data': [1.5, None]}, 'text'))
+    stored = shared.get(OutputCache.shared_key('key'))
+    # Stored as compressed JSON, not a pickle
+    assert json.loads(zlib.decompress(stored)) == [{'data': [1.5, None]}, 'text']
+    # Outputs come back from the shared store as their JSON form
+    other = OutputCache(shared=shared)
+    assert other.get_or_compute('key', lambda: None) == [{'data': [1.5, None]}, 'text']
+    assert value == ({'data': [1.5, None]}, 'text')
+
+
+def test_shared_store_serializes_once(tmp_path, monkeypatch):
+    # A computed output is serialized once, for the shared store and to size its entry
+    calls = []
+    to_json = memo.to_json
+    monkeypatch.setattr(memo, 'to_json', lambda value: calls.append(1) or to_json(value))
+    path = str(tmp_path / 'outputs.sqlite')
+    value = {'figure': [1, 2, 3], 'name': 'Josée'}
+    cache = OutputCache(shared=SqliteCache(path))
+    cache.get_or_compute('key', lambda: value)
+    assert len(calls) == 1
+    assert cache.stats()['bytes'] == len(to_json(value))
+    # Loaded from the shared store, it's sized by the payload it came in, without serializing it again
+    other = OutputCache(shared=SqliteCache(path))
+    other.get_or_compute('key', lambda: None)
+    assert len(calls) == 1
+    assert other.stats()['bytes'] == len(to_json(value))
+
+
+def test_code_version(tmp_path):
+    paths = [str(tmp_path / name) for name in ['a.py', 'b.py']]
+    for path in paths:
+        with open(path, 'w') as f:
+            f.write('x = 1\n')
+    version = code_version(paths)
+    assert code_version(reversed(paths)) == version
+    with open(paths[1], 'w') as f:
+        f.write('x = 2\n')
+    assert code_version(paths) != version
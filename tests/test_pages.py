@@ -0,0 +1,33 @@
+"""
+Tests of paginated results listings: reading the page count and fetching
+every page of the stand-in site's multi-page event.
+"""
+
+import urllib.parse
+
+from conftest import per_page
+from tristats.ingest.fetch import Fetcher
+from tristats.ingest.pages import fetch_pages, page_count, page_url
+
+
+def test_page_count():
+    assert page_count(b'<html><body><table></table></body></html>') == 1
+    # A 'Last' link past the visible window counts
+    content = (b'<ul class="pagination"><li><a href="?page=1">1</a></li><li><a href="?page=2">2</a></li>'
+               b'<li><a href="?page=9">Last</a></li></ul>')
+    assert page_count(content) == 9
+    assert page_count(b'<ul class="pagination big"><li>1</li><li>4</li></ul>') == 4
+
+
+def test_page_url():
+    url = 'https://results.raceroster.com/results/abc?per_page=500&page=1&sub=7'
+    assert page_url(url, 3) == 'https://results.raceroster.com/results/abc?per_page=500&sub=7&page=3'
+    assert page_url('https://example.com/results', 2) == 'https://example.com/results?page=2'
+
+
+def test_fetch_pages(site):
+    with Fetcher(min_interval=0) as fetcher:
+        pages = fetch_pages(site.base + '/results?per_page={0}&page=1'.format(per_page), fetcher)
+    assert len(pages) == 3
+    assert [urllib.parse.parse_qs(urllib.parse.urlsplit(page.url).query)['page'] for page in pages] == \
+        [['1'], ['2'], ['3']]
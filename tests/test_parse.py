@@ -0,0 +1,96 @@
+"""
+Tests of the results table parser, streaming and tree, on small pages in
+the raceroster and sportstats layouts.
+"""
+
+import io
+
+import pytest
+
+from tristats.ingest.parse import combine_headers, raceroster, sportstats, table_rows
+
+
+def raceroster_page(body):
+    """
+    A raceroster page: a two-row header with swim and run spanning rank and
+    time columns, and other tables around the results that mustn't leak in.
+    """
+    return (b'''<html><body>
+<table class="other"><thead><tr><th>Sponsor</th></tr></thead><tbody><tr><td>Bikes Ltd</td></tr></tbody></table>
+<table class="results-listing__table table table-hover table-striped">
+<thead>
+<tr><th rowspan="2">Place</th><th rowspan="2">Name</th><th colspan="2">Swim</th><th colspan="2">Run</th></tr>
+<tr><th>Rank</th><th>Time</th><th>Rank</th><th>Time</th></tr>
+</thead>
+<tbody>''' + body + b'''</tbody>
+</table>
+<table class="other"><tbody><tr><td>1</td><td>x</td><td>1</td><td>y</td><td>1</td><td>z</td></tr></tbody></table>
+</body></html>''')
+
+
+# Two athletes either side of an ad row
+small_page = raceroster_page(b'''
+<tr><td>1</td><td><a> Jane Smith </a></td><td>2</td><td>12:03</td><td>1</td><td>20:10</td></tr>
+<tr><td colspan="6">Advertisement</td></tr>
+<tr><td>2</td><td>Ann Lee</td><td>1</td><td>11:40</td><td>2</td><td>21:05</td></tr>
+''')
+
+# A sportstats page: one header row, with only the columnheader cells naming columns
+sportstats_page = b'''<html><body>
+<table class="results overview-result">
+<thead><tr><th role="columnheader">Pos</th><th>(sort)</th><th role="columnheader">Name</th>
+<th role="columnheader">Time</th></tr></thead>
+<tr><td>1</td><td>Sam Poe</td><td>1:05:51</td></tr>
+<tr><td>2</td><td>Bob Ray</td><td>1:10:30</td></tr>
+</table>
+</body></html>'''
+
+raceroster_rows = [
+    ['place', 'name', 'swim-rank', 'swim-time', 'run-rank', 'run-time'],
+    ['1', 'Jane Smith', '2', '12:03', '1', '20:10'],
+    ['2', 'Ann Lee', '1', '11:40', '2', '21:05'],
+]
+
+
+def test_combine_headers():
+    assert combine_headers([['Place', 'Swim'], ['Rank', 'Time']], [1, 2]) == ['place', 'swim-rank', 'swim-time']
+    assert combine_headers([[' Pos ', 'Name']], [1, 1]) == ['pos', 'name']
+
+
+@pytest.mark.parametrize('stream', [True, False])
+def test_raceroster(stream):
+    assert list(table_rows(small_page, raceroster, stream)) == raceroster_rows
+
+
+@pytest.mark.parametrize('stream', [True, False])
+def test_sportstats(stream):
+    assert list(table_rows(sportstats_page, sportstats, stream)) == [
+        ['pos', 'name', 'time'],
+        ['1', 'Sam Poe', '1:05:51'],
+        ['2', 'Bob Ray', '1:10:30'],
+    ]
+
+
+@pytest.mark.parametrize('stream', [True, False])
+def test_no_results_table(stream):
+    assert list(table_rows(b'<html><body><p>No results yet</p></body></html>', raceroster, stream)) == []
+
+
+@pytest.mark.parametrize('stream', [True, False])
+def test_sources(stream, tmp_path):
+    # A file object or a path works as well as bytes
+    assert list(table_rows(io.BytesIO(small_page), raceroster, stream)) == raceroster_rows
+    path = tmp_path / 'page.html'
+    path.write_bytes(small_page)
+    assert list(table_rows(str(path), raceroster, stream)) == raceroster_rows
+
+
+def test_many_rows():
+    # Streaming and tree agree on a bigger page
+    page = raceroster_page(b''.join(
+        '<tr><td>{0}</td><td>Athlete {0}</td><td>1</td><td>10:00</td><td>1</td><td>20:00</td></tr>'.format(i).encode('utf-8')
+        for i in range(2000)))
+    streamed = list(table_rows(page, raceroster, stream=True))
+    assert len(streamed) == 2001
+    assert streamed[-1] == ['1999', 'Athlete 1999', '1', '10:00', '1', '20:00']
+    assert streamed == list(table_rows(page, raceroster, stream=False))
@@ -0,0 +1,107 @@
+"""
+Tests of the ingest pipeline, run against the stand-in site's multi-page
+event.
+"""
+
+import os
+
+import pandas as pd
+import pytest
+
+from conftest import event_rows, per_page
+from tristats import store
+from tristats.ingest import parse
+from tristats.ingest import pipeline
+from tristats.ingest.decode import ColumnDecoder
+from tristats.ingest.fetch import Fetcher
+
+
+class KillWorker:
+    """
+    A stand-in layout that kills the parse worker it's sent to (unpickling
+    it exits the process), to break the process pool.
+    """
+
+    def __reduce__(self):
+        return (os._exit, (1,))
+
+
+def test_layout_for():
+    assert pipeline.layout_for('https://results.raceroster.com/results/abc') is parse.raceroster
+    assert pipeline.layout_for('https://www.sportstats.ca/display-results.xhtml?raceid=1') is parse.sportstats
+    assert pipeline.layout_for('http://127.0.0.1:8000/results') is parse.raceroster
+
+
+def test_catalog_events():
+    race_info = {'Rockwood': {'2018': {'dfname': 'rockwood18', 'url': 'https://www.sportstats.ca/a'},
+                              '2017': {'dfname': 'rockwood17', 'url': 'https://results.raceroster.com/b'}},
+                 'Hampton': {'2018': {'dfname': 'hampton18', 'url': 'https://results.raceroster.com/c'}}}
+    assert [event.dfname for event in pipeline.catalog_events(race_info)] == ['rockwood18', 'rockwood17', 'hampton18']
+    assert [event.dfname for event in pipeline.catalog_events(race_info, ['Rockwood/2017', 'Hampton'])] == \
+        ['rockwood17', 'hampton18']
+
+
+def test_write_results_csv(tmp_path):
+    # The csv written for an event reads back into the same columns
+    decoder = ColumnDecoder(['Place', 'Name', 'Div', 'Swim', 'Gun Time'])
+    decoder.extend([['1', 'Jane Smith', 'F30-39', '12:03', '1:05:51'], ['', 'Sam Poe', '', '11:00', 'DNF']])
+    columns = decoder.finish()
+    path = pipeline.write_results_csv(str(tmp_path), 'test18', columns)
+    assert os.listdir(str(tmp_path)) == ['results_test18.csv']
+    df = pd.read_csv(path)
+    assert df['finish_hhmmss'].fillna('').tolist() == ['1:05:51', '']
+    assert df['swim'].tolist()[0] == pytest.approx(12.05)
+    normalized = store.normalize_results(df)
+    assert normalized['finish'].tolist() == columns['finish'].tolist()
+    assert normalized['place'].tolist() == columns['place'].tolist()
+    assert normalized['division'][1] == columns['division'][1]
+
+
+def test_multi_page_event(site, tmp_path):
+    url = site.base + '/results?per_page={0}&page=1'.format(per_page)
+    events = [pipeline.Event('Stand-in Tri', '2019', 'standin19', url, pipeline.layout_for(url)),
+              pipeline.Event('Stand-in Tri', '2018', 'standin18', site.base + '/missing',
+                             pipeline.layout_for(url))]
+    csv_dir = str(tmp_path / 'csv')
+    with Fetcher(min_interval=0, retries=0) as fetcher:
+        results = pipeline.run(events, fetcher, csv_dir=csv_dir, fetch_workers=2, parse_workers=2)
+    results = {result.event.dfname: result for result in results}
+    assert results['standin19'].error is None
+    assert results['standin19'].pages == 3
+    assert results['standin19'].rows == event_rows
+    # The missing event fails on its own
+    assert results['standin18'].error is not None
+    assert not os.path.exists(os.path.join(csv_dir, 'results_standin18.csv'))
+    df = pd.read_csv(os.path.join(csv_dir, 'results_standin19.csv'))
+    assert df['name'].tolist() == ['Athlete {0}'.format(i + 1) for i in range(event_rows)]
+    assert df['run'].tolist() == pytest.approx([13 + i + 10/60 for i in range(event_rows)])
+
+
+def test_broken_parse_pool(site, tmp_path):
+    # A worker dies mid-ingest: every event still gets a result, and the run finishes
+    url = site.base + '/results?per_page={0}&page=1'.format(per_page)
+    events = [pipeline.Event('Stand-in Tri', str(2010 + i), 'standin{0}'.format(i), url, KillWorker())
+              for i in range(4)]
+    with Fetcher(min_interval=0, retries=0) as fetcher:
+        results = pipeline.run(events, fetcher, csv_dir=str(tmp_path / 'csv'), fetch_workers=2, parse_workers=1,
+                               queue_size=1)
+    assert sorted(result.event.dfname for result in results) == ['standin{0}'.format(i) for i in range(4)]
+    assert all(result.error is not None and result.rows == 0 for result in results)
+    assert not os.path.exists(str(tmp_path / 'csv'))
+
+
+def test_store_from_columns(site, tmp_path):
+    # The store built straight from the decoded columns is the one built from the csvs
+    url = site.base + '/results?per_page={0}&page=1'.format(per_page)
+    events = [pipeline.Event('Stand-in Tri', '2019', 'standin19', url, pipeline.layout_for(url))]
+    race_info = {'Stand-in Tri': {'2019': {'dfname': 'standin19', 'url': url}}}
+    with Fetcher(min_interval=0, retries=0) as fetcher:
+        result, = pipeline.run(events, fetcher, csv_dir=None, parse_workers=1)
+        from_columns = store.build_store(race_info, str(tmp_path / 'none'), str(tmp_path / 'store1'),
+                                         {'standin19': result.columns})
+        csv_dir = str(tmp_path / 'csv')
+        pipeline.run(events, fetcher, csv_dir=csv_dir, parse_workers=1)
+        from_csvs = store.build_store(race_info, csv_dir, str(tmp_path / 'store2'))
+    assert not os.path.exists(str(tmp_path / 'none'))
+    assert result.rows == from_columns['races']['Stand-in Tri']['2019']['rows'] == event_rows
+    assert from_columns['version'] == from_csvs['version']
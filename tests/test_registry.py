@@ -0,0 +1,90 @@
+"""
+Tests of the race registry: catalog metadata, lazy loading, and LRU
+eviction past the memory budget.
+"""
+
+import pytest
+
+from tristats.registry import RaceRegistry
+
+
+def race_size(race_store):
+    """
+    Bytes the registry counts for one of the (equally sized) test races.
+    """
+    registry = RaceRegistry(race_store)
+    registry.get('Test', '2018')
+    return registry.resident_bytes
+
+
+def test_metadata(race_store):
+    registry = RaceRegistry(race_store)
+    assert registry.races() == ['Test', 'Other']
+    assert registry.years('Test') == ['2018', '2017']
+    assert registry.info('Test', '2017')['dfname'] == 'test17'
+    assert registry.info('Test', '2017')['rows'] == 8
+    # Listing races doesn't load any
+    assert registry.resident_bytes == 0
+
+
+def test_lazy_load(race_store):
+    registry = RaceRegistry(race_store)
+    assert ('Test', '2018') not in registry
+    race = registry.get('Test', '2018')
+    assert ('Test', '2018') in registry
+    assert registry.get('Test', '2018') is race
+    assert race.dfname == 'test18'
+    assert registry.resident_bytes > 0
+    with pytest.raises(KeyError):
+        registry.get('Test', '1999')
+
+
+def test_lru_eviction(race_store):
+    size = race_size(race_store)
+    registry = RaceRegistry(race_store, max_bytes=2*size)
+    registry.get('Test', '2018')
+    registry.get('Test', '2017')
+    # Using 2018 again makes 2017 the least recently used
+    registry.get('Test', '2018')
+    registry.get('Other', '2018')
+    assert ('Test', '2017') not in registry
+    assert ('Test', '2018') in registry
+    assert ('Other', '2018') in registry
+    assert registry.resident_bytes == 2*size
+
+
+def test_newest_kept_past_budget(race_store):
+    registry = RaceRegistry(race_store, max_bytes=0)
+    race = registry.get('Test', '2018')
+    assert ('Test', '2018') in registry
+    assert registry.get('Other', '2018') is not race
+    assert ('Test', '2018') not in registry
+    assert ('Other', '2018') in registry
+
+
+def test_eviction_listeners(race_store):
+    registry = RaceRegistry(race_store, max_bytes=0)
+    evicted = []
+    registry.on_evict(lambda race, year: evicted.append((race, year)))
+    registry.get('Test', '2018')
+    registry.get('Test', '2017')
+    assert evicted == [('Test', '2018')]
+    registry.clear()
+    assert evicted == [('Test', '2018'), ('Test', '2017')]
+
+
+def test_clear(race_store):
+    registry = RaceRegistry(race_store)
+    registry.get('Test', '2018')
+    registry.clear()
+    assert ('Test', '2018') not in registry
+    assert registry.resident_bytes == 0
+
+
+def test_load_all(race_store):
+    registry = RaceRegistry(race_store)
+    assert registry.load_all() == 3
+    assert sorted(registry.resident()) == [('Other', '2018'), ('Test', '2017'), ('Test', '2018')]
+    # The athlete searches are built too
+    assert 'athlete_search' in registry.__dict__
+    assert 'athlete_search' in registry.get('Test', '2018').__dict__
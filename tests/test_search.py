@@ -0,0 +1,69 @@
+"""
+Tests of the prefix search over athlete names.
+"""
+
+from tristats.registry import RaceRegistry
+from tristats.search import SearchIndex, normalize, tokenize
+
+
+names = ['Lindsay Brin', 'Josée Lindqvist', 'Adelaine (Addie) Carten', 'Brian Lind', 'Ann Lee']
+
+
+def labels(index, query, **kwargs):
+    total, matches = index.search(query, **kwargs)
+    return [label for label, payload in matches]
+
+
+def test_tokenize():
+    assert normalize('Josée') == 'josee'
+    assert tokenize('Adelaine (Addie) Carten') == ['adelaine', 'addie', 'carten']
+    assert tokenize("O'Neil-Smith") == ['o', 'neil', 'smith']
+
+
+def test_prefix_search():
+    index = SearchIndex((name, i) for i, name in enumerate(names))
+    # Names starting with the query come first, then the rest alphabetically
+    assert labels(index, 'lind') == ['Lindsay Brin', 'Brian Lind', 'Josée Lindqvist']
+    # Every word has to prefix some word of the name, in any order
+    assert labels(index, 'br li') == ['Brian Lind', 'Lindsay Brin']
+    assert labels(index, 'lind zz') == []
+    # Accents, case, and brackets are ignored
+    assert labels(index, 'JOSEE') == ['Josée Lindqvist']
+    assert labels(index, 'addie') == ['Adelaine (Addie) Carten']
+    assert index.search('brin')[1] == [('Lindsay Brin', 0)]
+
+
+def test_search_pages():
+    index = SearchIndex((name, name) for name in names)
+    assert len(index) == 5
+    # No query lists every entry
+    total, matches = index.search('', limit=2)
+    assert total == 5
+    assert [label for label, payload in matches] == ['Adelaine (Addie) Carten', 'Ann Lee']
+    total, matches = index.search(None, offset=4, limit=2)
+    assert (total, matches) == (5, [('Lindsay Brin', 'Lindsay Brin')])
+    total, matches = index.search('lind', offset=1, limit=1)
+    assert (total, [label for label, payload in matches]) == (3, ['Brian Lind'])
+
+
+def test_pages_in_order():
+    # Pages taken one at a time line up with the whole ordered result, duplicate names in entry order
+    index = SearchIndex((name, i) for i, name in enumerate(names*3))
+    for query in ['', 'l', 'lind', 'an']:
+        total, everything = index.search(query, limit=len(names)*3)
+        assert total == len(everything)
+        pages = [index.search(query, offset=offset, limit=2)[1] for offset in range(0, total, 2)]
+        assert sum(pages, []) == everything
+    assert [payload for label, payload in index.search('ann')[1]] == [4, 9, 14]
+
+
+def test_race_search(race_store):
+    registry = RaceRegistry(race_store)
+    # The two Ann Lees are told apart by bib
+    assert labels(registry.get('Test', '2018').athlete_search, 'ann') == ['Ann Lee (#101)', 'Ann Lee (#105)']
+    # Across races, each match carries its race and year
+    total, matches = registry.athlete_search.search('ann lee', limit=10)
+    assert total == 6
+    assert ('Ann Lee (#101)', ('Other', '2018')) in matches
+    # Without loading any of the other races
+    assert ('Test', '2018') in registry and ('Other', '2018') not in registry
@@ -0,0 +1,160 @@
+"""
+Tests of the statistics comparing an athlete against a distribution of times.
+"""
+
+import numpy as np
+
+from tristats.registry import RaceRegistry
+from tristats.stats import (Distribution, DistributionCache, bin_counts, bin_width, compare_side,
+                            nice_bin_widths, rank_and_percentile, shared_bins)
+
+
+def test_rank_and_percentile():
+    times = np.array([3600, 3750, 3900, 4200, 4500, 4800, 5400, 5700])
+    # Halves round up, as in the browser
+    assert rank_and_percentile(times, 3600) == (1, 13)
+    assert rank_and_percentile(times, 4200) == (4, 50)
+    assert rank_and_percentile(times, 5700) == (8, 100)
+    # Times between the others rank behind the faster ones
+    assert rank_and_percentile(times, 4260) == (5, 63)
+
+
+def test_rank_ties():
+    # Athletes tied on time share the better rank
+    times = np.array([3600, 3900, 3900, 3900, 4200])
+    assert rank_and_percentile(times, 3900) == (2, 40)
+
+
+def test_no_athlete_time():
+    # An athlete who didn't finish isn't ranked
+    times = np.array([3600, 3900, 4200, 4500])
+    assert rank_and_percentile(times, None) == (None, None)
+
+
+def test_no_times():
+    # A sport the race didn't time
+    assert rank_and_percentile(np.empty(0, dtype=np.int32), 3600) == (None, None)
+    assert rank_and_percentile(np.empty(0, dtype=np.int32), None) == (None, None)
+
+
+def test_compare_side(race_store):
+    distributions = DistributionCache(RaceRegistry(race_store))
+    side = compare_side(distributions, 'Test', '2018', 'Dee Fox', 'Division', 'f20-29', 'finish')
+    assert side.athlete_time == 4200
+    assert side.distribution.times.tolist() == [4200, 4290]
+    assert (side.rank, side.percentile) == (1, 50)
+    side = compare_side(distributions, 'Test', '2018', 'Dee Fox', 'All', 'All', 'finish')
+    assert (side.rank, side.percentile) == (4, 57)
+    side = compare_side(distributions, 'Test', '2018', 'Gus Ives', 'All', 'All', 'finish')
+    assert side.athlete_time is None
+    assert (side.rank, side.percentile) == (None, None)
+
+
+def test_distribution():
+    distribution = Distribution(np.array([3600, 3720, 3840, 3960, 4080, 6000]))
+    assert distribution.count == 6
+    assert (distribution.min, distribution.max) == (3600, 6000)
+    assert (distribution.q1, distribution.median, distribution.q3) == (3750, 3900, 4050)
+    # 6000 is past 1.5 IQR above the box, so the upper whisker stops at 4080
+    assert (distribution.lower_whisker, distribution.upper_whisker) == (3600, 4080)
+
+
+def test_empty_distribution():
+    distribution = Distribution(np.empty(0, dtype=np.int32))
+    assert distribution.count == 0
+    assert np.isnan(distribution.median)
+    start, counts = distribution.binned(distribution.bin_width)
+    assert len(counts) == 0
+
+
+def test_distribution_cache(race_store):
+    distributions = DistributionCache(RaceRegistry(race_store))
+    distribution = distributions.get('Test', '2018', 'finish', 'Division', 'F20-29')
+    # Values are matched case-insensitively, and 'All' ignores the value
+    assert distributions.get('Test', '2018', 'finish', 'Division', 'f20-29') is distribution
+    assert distributions.get('Test', '2018', 'finish', 'All', 'All') is \
+        distributions.get('Test', '2018', 'finish', 'All', 'f20-29')
+    assert len(distributions) == 2
+    distributions.clear()
+    assert len(distributions) == 0
+    assert distributions.get('Test', '2018', 'finish', 'Division', 'f20-29') is not distribution
+
+
+def test_distribution_cache_eviction(race_store):
+    distributions = DistributionCache(RaceRegistry(race_store), max_entries=2)
+    swim = distributions.get('Test', '2018', 'swim', 'All', 'All')
+    bike = distributions.get('Test', '2018', 'bike', 'All', 'All')
+    # Using swim again leaves bike as the least recently used
+    assert distributions.get('Test', '2018', 'swim', 'All', 'All') is swim
+    distributions.get('Test', '2018', 'run', 'All', 'All')
+    assert len(distributions) == 2
+    assert distributions.get('Test', '2018', 'swim', 'All', 'All') is swim
+    assert distributions.get('Test', '2018', 'bike', 'All', 'All') is not bike
+
+
+def test_distributions_dropped_with_race(race_store):
+    registry = RaceRegistry(race_store, max_bytes=0)
+    distributions = DistributionCache(registry)
+    distributions.get('Test', '2018', 'swim', 'All', 'All')
+    distributions.get('Test', '2018', 'bike', 'All', 'All')
+    # Loading another race evicts Test 2018 and its distributions with it
+    other = distributions.get('Other', '2018', 'swim', 'All', 'All')
+    assert ('Test', '2018') not in registry
+    assert len(distributions) == 1
+    assert distributions.get('Other', '2018', 'swim', 'All', 'All') is other
+
+
+def test_bin_width():
+    # Freedman-Diaconis gives 2*1200/1000**(1/3) = 240 s here, closest (by ratio) to 5 min
+    assert bin_width(np.linspace(3600, 6000, 1000).astype(np.int32)) == 300
+    # Too few times (or no spread at all) to say: the narrowest width
+    assert bin_width([4200]) == nice_bin_widths[0]
+    assert bin_width([4200, 4200, 4200]) == nice_bin_widths[0]
+
+
+def test_bin_counts():
+    edges = np.array([3600, 3900, 4200, 4500])
+    # Bins include their left edge
+    assert bin_counts(np.array([3600, 3720, 3900, 4440]), edges).tolist() == [2, 1, 1]
+
+
+def test_shared_bins(race_store):
+    distributions = DistributionCache(RaceRegistry(race_store))
+    pair = [distributions.get('Test', '2018', 'finish', 'All', 'All'),
+            distributions.get('Test', '2017', 'run', 'Division', 'f20-29')]
+    edges, counts = shared_bins(pair)
+    # The grid uses the coarser width, on multiples of it, and covers every time
+    width = max(distribution.bin_width for distribution in pair)
+    assert (np.diff(edges) == width).all()
+    assert (edges % width == 0).all()
+    assert edges[0] <= pair[1].min and edges[-1] > pair[0].max
+    for distribution, aligned in zip(pair, counts):
+        assert len(aligned) == len(edges) - 1
+        assert aligned.sum() == distribution.count
+        assert aligned.tolist() == bin_counts(distribution.times, edges).tolist()
+
+
+def test_shared_bins_with_empty(race_store):
+    distributions = DistributionCache(RaceRegistry(race_store))
+    finish = distributions.get('Test', '2018', 'finish', 'All', 'All')
+    # The made-up races don't time t1
+    t1 = distributions.get('Test', '2018', 't1', 'All', 'All')
+    edges, (counts_finish, counts_t1) = shared_bins([finish, t1])
+    # An empty distribution doesn't stretch the grid back to 0
+    assert edges[0] <= finish.min and edges[1] > finish.min
+    assert counts_finish.sum() == finish.count and counts_t1.sum() == 0
+    edges, counts = shared_bins([t1, t1])
+    assert len(edges) == 0
+    assert [len(aligned) for aligned in counts] == [0, 0]
+
+
+def test_precompute(race_store):
+    registry = RaceRegistry(race_store)
+    registry.get('Test', '2018')
+    distributions = DistributionCache(registry)
+    distributions.precompute(['finish', 'run'])
+    # Resident races only: the whole field, 2 genders, and 4 divisions, for each sport
+    assert len(distributions) == 2*(1 + 2 + 4)
+    distribution = distributions.get('Test', '2018', 'run', 'Gender', 'female')
+    assert distribution.bin_width in distribution._binned
+    assert len(distributions) == 14
@@ -0,0 +1,181 @@
+"""
+Tests of the columnar race store: normalizing scraped results onto the
+canonical layout, and building and reading a store.
+"""
+
+import json
+import os
+
+import numpy as np
+import pandas as pd
+import pytest
+
+from tristats import store
+from tristats.store import MISSING
+
+
+def scraped_results():
+    """
+    A small results table in the raceroster layout of the scraped csvs.
+    """
+    return pd.DataFrame({
+        'Place': [1, 2, 3, None],
+        'Bib': [212, None, 31, 40],
+        'Athlete': [' Jane Smith ', 'Ann Lee', 'Bob Ray', 'Sam Poe'],
+        'City': ['Moncton', None, 'Sussex', 'Hampton'],
+        'Div': ['F30-39', 'f20-29', 'M30-39', None],
+        'Gun Time': [65.85, 70.5, 75.25, None],
+        'swim': [12.05, 10.5, None, 11.0],
+    })
+
+
+def write_results_csv(csv_dir, dfname, df):
+    os.makedirs(csv_dir, exist_ok=True)
+    df.to_csv(os.path.join(csv_dir, 'results_{0}.csv'.format(dfname)), index=False)
+
+
+def load_results(tmp_path, df):
+    """
+    Build a store holding just the results in df, and load the race.
+    """
+    csv_dir, store_dir = str(tmp_path / 'csv'), str(tmp_path / 'store')
+    write_results_csv(csv_dir, 'test18', df)
+    store.build_store({'Test': {'2018': {'dfname': 'test18', 'url': None}}}, csv_dir, store_dir)
+    return store.RaceStore(store_dir).load('test18')
+
+
+def test_normalize_results():
+    columns = store.normalize_results(scraped_results())
+    assert set(columns) == {name for name, kind in store.canonical_columns}
+    assert columns['place'].tolist() == [1, 2, 3, MISSING]
+    assert columns['no.'].tolist() == [212, MISSING, 31, 40]
+    assert columns['name'].tolist() == ['Jane Smith', 'Ann Lee', 'Bob Ray', 'Sam Poe']
+    assert columns['city'].tolist() == ['Moncton', '', 'Sussex', 'Hampton']
+    # Categories are lowercased and sorted, with MISSING codes where absent
+    codes, labels = columns['division']
+    assert labels == ['f20-29', 'f30-39', 'm30-39']
+    assert codes.tolist() == [1, 0, 2, MISSING]
+    # Gender is derived from the division when the results don't list it,
+    # and missing where the division is
+    codes, labels = columns['gender']
+    assert labels == ['female', 'male']
+    assert codes.tolist() == [0, 0, 1, MISSING]
+    # Times are whole seconds, MISSING where absent
+    assert columns['finish'].dtype == np.int32
+    assert columns['finish'].tolist() == [3951, 4230, 4515, MISSING]
+    assert columns['swim'].tolist() == [723, 630, MISSING, 660]
+    # Sports the results don't have are all missing
+    assert (columns['t1'] == MISSING).all()
+
+
+def test_normalize_time_strings():
+    df = scraped_results()
+    df['Time_Total_hhmmss'] = ['1:05:51', '1:10:30', 'DNF', '']
+    df['swim_mmss'] = ['12:03', '10:30', '', '11:00']
+    columns = store.normalize_results(df)
+    # The scraped strings are used over the decimal minutes where the results kept them
+    assert columns['finish'].tolist() == [3951, 4230, MISSING, MISSING]
+    assert columns['swim'].tolist() == [723, 630, MISSING, 660]
+
+
+def test_build_and_load(tmp_path):
+    csv_dir, store_dir = str(tmp_path / 'csv'), str(tmp_path / 'store')
+    write_results_csv(csv_dir, 'test18', scraped_results())
+    race_info = {'Test': {'2018': {'dfname': 'test18', 'url': 'https://example.com/results'}}}
+    catalog = store.build_store(race_info, csv_dir, store_dir)
+    assert catalog['races'] == {'Test': {'2018': {'dfname': 'test18', 'rows': 4, 'url': 'https://example.com/results'}}}
+    assert not [name for name in os.listdir(str(tmp_path)) if '.tmp-' in name or '.old-' in name]
+
+    race_store = store.RaceStore(store_dir)
+    assert race_store.version == catalog['version']
+    race = race_store.load('test18')
+    assert len(race) == 4
+    # Columns are memory-mapped from the store
+    assert isinstance(race.columns['finish'], np.memmap)
+    assert race.categories('division') == ['f20-29', 'f30-39', 'm30-39']
+    assert race.columns['name'].tolist() == ['Jane Smith', 'Ann Lee', 'Bob Ray', 'Sam Poe']
+
+
+def test_rebuild_version(tmp_path):
+    csv_dir, store_dir = str(tmp_path / 'csv'), str(tmp_path / 'store')
+    race_info = {'Test': {'2018': {'dfname': 'test18', 'url': None}}}
+    write_results_csv(csv_dir, 'test18', scraped_results())
+    first = store.build_store(race_info, csv_dir, store_dir)
+    # Rebuilding the same results keeps the version; changed results change it
+    assert store.build_store(race_info, csv_dir, store_dir)['version'] == first['version']
+    df = scraped_results()
+    df.loc[0, 'Gun Time'] = 64.0
+    write_results_csv(csv_dir, 'test18', df)
+    assert store.build_store(race_info, csv_dir, store_dir)['version'] != first['version']
+    assert store.RaceStore(store_dir).version != first['version']
+
+
+def test_store_version_mismatch(tmp_path):
+    csv_dir, store_dir = str(tmp_path / 'csv'), str(tmp_path / 'store')
+    write_results_csv(csv_dir, 'test18', scraped_results())
+    store.build_store({'Test': {'2018': {'dfname': 'test18', 'url': None}}}, csv_dir, store_dir)
+    path = os.path.join(store_dir, 'catalog.json')
+    with open(path) as f:
+        catalog = json.load(f)
+    catalog['store_version'] = 0
+    with open(path, 'w') as f:
+        json.dump(catalog, f)
+    with pytest.raises(ValueError):
+        store.RaceStore(store_dir)
+
+
+def test_open_store_builds_missing(tmp_path):
+    csv_dir, store_dir = str(tmp_path / 'csv'), str(tmp_path / 'store')
+    write_results_csv(csv_dir, 'test18', scraped_results())
+    race_info_path = str(tmp_path / 'races.json')
+    with open(race_info_path, 'w') as f:
+        json.dump({'Test': {'2018': {'dfname': 'test18', 'url': None}}}, f)
+    race_store = store.open_store(store_dir, race_info_path, csv_dir)
+    assert race_store.races['Test']['2018']['rows'] == 4
+
+
+def test_sorted_times(race_store):
+    race = race_store.load('test18')
+    assert race.sorted_times('finish').tolist() == [3600, 3750, 3900, 4200, 4290, 4500, 4800]
+    assert race.sorted_times('finish', 'Division', 'F30-39').tolist() == [3600, 3750, 4800]
+    assert race.sorted_times('finish', 'Division', 'm30-39').tolist() == [3900]
+    assert race.sorted_times('run', 'Gender', 'female').tolist() == [1200, 1230, 1380, 1410, 1500]
+    # Sports the race didn't time, and subsets it doesn't have, are empty
+    assert len(race.sorted_times('t1')) == 0
+    assert len(race.sorted_times('finish', 'Division', 'M70-79')) == 0
+
+
+def test_resident_bytes(race_store):
+    race = race_store.load('test18')
+    # The mapped columns aren't counted, only what's built from them
+    assert race.resident_bytes == 0
+    race.sorted_times('finish')
+    assert race.resident_bytes == sum(values.nbytes for values in race.time_index.values())
+    assert race.nbytes == sum(values.nbytes for values in race.columns.values())
+
+
+def test_athlete_index(race_store):
+    race = race_store.load('test18')
+    # Names in the results more than once are told apart by bib number
+    assert race.athlete_keys == ['Ann Lee (#101)', 'Ann Lee (#105)', 'Bea Cole', 'Cal Dunn', 'Dee Fox',
+                                 'Eve Gray', 'Fay Hill', 'Gus Ives']
+    assert race.athlete_index['Ann Lee (#105)'] == 4
+    assert race.athlete_value('Ann Lee (#105)', 'finish') == 4290
+    assert race.athlete_value('Gus Ives', 'finish') is None
+    assert race.athlete_value('Ann Lee (#105)', 'division') == 'f20-29'
+    assert race.athlete_value('Bea Cole', 'city') == 'Hampton'
+
+
+def test_athlete_index_duplicates(tmp_path):
+    df = pd.DataFrame({
+        'name': ['Ann Lee', 'Ann Lee', 'Bob Ray', 'Bob Ray', 'Cy Fox', 'Cy Fox'],
+        'no.': [1, None, 3, 3, 5, 6],
+        'city': ['Moncton', 'Sussex', 'Hampton', 'Hampton', None, 'Sussex'],
+        'finish': [60.0, 61.0, 62.0, 63.0, 64.0, 65.0],
+    })
+    race = load_results(tmp_path, df)
+    # Missing or repeated bibs fall back to the city, then to results order
+    assert race.athlete_keys == ['Ann Lee (Moncton)', 'Ann Lee (Sussex)', 'Bob Ray (1)', 'Bob Ray (2)',
+                                 'Cy Fox (#5)', 'Cy Fox (#6)']
+    assert race.athlete_value('Bob Ray (2)', 'finish') == 3780
+    assert race.athlete_value('Ann Lee (Moncton)', 'division') is None
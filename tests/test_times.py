@@ -0,0 +1,96 @@
+"""
+Tests of race times: parsing time strings, conversion to whole seconds,
+and h:mm:ss display.
+"""
+
+import numpy as np
+
+from tristats.times import (BLANK, DNF, DNS, DQ, INVALID, MISSING, OK, format_seconds, minutes_to_seconds,
+                            parse_times, round_half_up, time_ticks)
+
+
+def test_formats():
+    times, status = parse_times(['1:05:51', '01:05:51', '05:51', '5:51', '12:34:56'])
+    assert times.dtype == np.int32
+    assert times.tolist() == [3951, 3951, 351, 351, 45296]
+    assert status.tolist() == [OK]*5
+
+
+def test_fractional_seconds():
+    times, status = parse_times(['05:51.3', '05:51.6', '1:00:00.5'])
+    assert times.tolist() == [351, 352, 3600]
+    assert status.tolist() == [OK]*3
+    times, status = parse_times(['05:51.3'], scale=10)
+    assert times.tolist() == [3513]
+
+
+def test_blanks():
+    times, status = parse_times(['', '  ', '-', '--', None, float('nan'), '\xa0'])
+    assert times.tolist() == [MISSING]*7
+    assert status.tolist() == [BLANK]*7
+
+
+def test_status_markers():
+    times, status = parse_times(['DNF', ' dns ', 'DQ', 'DSQ', 'dnf'])
+    assert times.tolist() == [MISSING]*5
+    assert status.tolist() == [DNF, DNS, DQ, DQ, DNF]
+
+
+def test_invalid():
+    times, status = parse_times(['1:75:00', 'abc', '1::00', ':30', '5:51:', '1 2:00', '05:51.3.1'])
+    assert times.tolist() == [MISSING]*7
+    assert status.tolist() == [INVALID]*7
+
+
+def test_long_cells():
+    # Long text is invalid, without widening the scan; padded times and markers still parse
+    note = 'finished after the cutoff, time not official ' * 20
+    times, status = parse_times(['25:11', note, '      1:02:03          ', '    DNF             ', '1:02:03.456789012345'])
+    assert times.tolist() == [1511, MISSING, 3723, MISSING, MISSING]
+    assert status.tolist() == [OK, INVALID, OK, DNF, INVALID]
+
+
+def test_surrounding_whitespace():
+    times, status = parse_times([' 25:11 ', '\t1:02:03\n'])
+    assert times.tolist() == [1511, 3723]
+    assert status.tolist() == [OK, OK]
+
+
+def test_empty_column():
+    times, status = parse_times([])
+    assert len(times) == 0
+    assert len(status) == 0
+
+
+def test_minutes_to_seconds():
+    seconds = minutes_to_seconds([25.183333333333334, 65.85, np.nan, 0.0])
+    assert seconds.dtype == np.int32
+    assert seconds.tolist() == [1511, 3951, MISSING, 0]
+
+
+def test_format_seconds():
+    assert format_seconds(0) == '00:00'
+    assert format_seconds(204) == '03:24'
+    assert format_seconds(3599) == '59:59'
+    assert format_seconds(3600) == '1:00:00'
+    assert format_seconds(45296) == '12:34:56'
+    # Whole seconds never come out as ':60'
+    assert format_seconds(59.6) == '01:00'
+    # Half seconds round up, as in the browser
+    assert format_seconds(202.5) == '03:23'
+
+
+def test_round_half_up():
+    # As JavaScript's Math.round, not Python's round (halves to even)
+    assert [round_half_up(value) for value in [0.5, 1.5, 2.5, 2.4999, -0.5, -2.5, -2.7]] == [1, 2, 3, 2, 0, -2, -3]
+
+
+def test_time_ticks():
+    tickvals, ticktext = time_ticks(3600, 5400)
+    # 30 minutes in at most 8 ticks: 5 minute steps
+    assert tickvals == [3600, 3900, 4200, 4500, 4800, 5100, 5400]
+    assert ticktext == ['1:00:00', '1:05:00', '1:10:00', '1:15:00', '1:20:00', '1:25:00', '1:30:00']
+    # Ticks cover the whole range
+    tickvals, ticktext = time_ticks(1210, 1290)
+    assert tickvals[0] <= 1210 and tickvals[-1] >= 1290
+    assert len(tickvals) <= 9
@@ -0,0 +1,4 @@
+"""
+Data layer for the tristats app: race storage and lookups shared by the
+Dash app and the ingest scripts.
+"""
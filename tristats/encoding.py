@@ -0,0 +1,84 @@
+"""
+Compact encodings of race data for the browser.
+"""
+
+import base64
+
+import numpy as np
+
+from tristats.store import available_sports
+
+
+BUNDLE_FORMAT = 2
+
+
+def b64_array(values, dtype):
+    """
+    Base64 of a numpy array's little-endian bytes as the given dtype
+    (decoded in the browser with the matching typed array).
+    """
+    return base64.b64encode(np.ascontiguousarray(values, dtype=np.dtype(dtype).newbyteorder('<')).tobytes()).decode('ascii')
+
+
+def typed_array(values):
+    """
+    A numeric array in plotly.js's typed-array form, {'dtype', 'bdata'}, at
+    reduced precision: floats as float32, integers in the narrowest
+    unsigned (or signed) type that holds them.
+    """
+    values = np.asarray(values)
+    if values.dtype.kind == 'f':
+        dtype = 'f4'
+    elif values.size == 0 or values.min() >= 0:
+        dtype = next(t for t in ['u1', 'u2', 'u4'] if values.size == 0 or values.max() <= np.iinfo(t).max)
+    else:
+        dtype = next(t for t in ['i1', 'i2', 'i4']
+                     if np.iinfo(t).min <= values.min() and values.max() <= np.iinfo(t).max)
+    return {'dtype': dtype, 'bdata': b64_array(values, dtype)}
+
+
+def binary_figure(figure):
+    """
+    A figure with every numpy array property of its traces sent as a typed
+    array, rather than as a list of full-precision JSON numbers.  Short lists
+    (e.g. the athlete markers, which are patched in place) are left as is.
+    """
+    data = []
+    for trace in figure['data']:
+        trace = trace.to_plotly_json() if hasattr(trace, 'to_plotly_json') else dict(trace)
+        for prop, value in trace.items():
+            if isinstance(value, np.ndarray) and value.dtype.kind in 'fiu':
+                trace[prop] = typed_array(value)
+        data.append(trace)
+    return dict(figure, data=data)
+
+
+def bundle_version(store_version, race, year):
+    """
+    Identifies a race bundle, so browsers that already hold it aren't sent
+    it again.
+    """
+    return '{0}/{1}/{2}/{3}'.format(BUNDLE_FORMAT, store_version, race, year)
+
+
+def race_bundle(loaded, race, year, store_version):
+    """
+    Everything the clientside comparison needs for one race year: each
+    sport's times by row (int32 seconds, -1 where missing) and the
+    gender/division code of each row (int16, -1 where missing), all as
+    base64 typed arrays.
+    """
+    return {
+        'version': bundle_version(store_version, race, year),
+        'race': race,
+        'year': year,
+        'rows': len(loaded),
+        'times': {sport: b64_array(loaded.columns[sport], 'i4') for sport in available_sports},
+        'subsets': {
+            dist_type: {
+                'labels': loaded.categories(dist_type),
+                'codes': b64_array(loaded.columns[dist_type], 'i2')
+            }
+            for dist_type in ['gender', 'division']
+        }
+    }
@@ -0,0 +1,5 @@
+"""
+Scraping race results: fetching results pages and turning them into the
+csvs in Data_output/ that the store is built from.  Run the whole pipeline
+with `python -m tristats.ingest` (see pipeline.py).
+"""
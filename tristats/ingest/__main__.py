@@ -0,0 +1,87 @@
+"""
+Command line entry point: scrape the races in races.json into Data_output/.
+
+    python -m tristats.ingest [--only Rockwood/2018] [--parse-workers 8] [--build-store [--no-csv]]
+
+See `python -m tristats.ingest --help` for all options.
+"""
+
+import argparse
+import os
+import sys
+import time
+
+from tristats import store
+from tristats.ingest import pipeline
+from tristats.ingest.cache import ResponseCache
+from tristats.ingest.fetch import Fetcher
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(prog='python -m tristats.ingest',
+                                     description='Scrape race results into csvs (and optionally rebuild the store).')
+    parser.add_argument('--races', default='races.json', help='race catalog (default: races.json)')
+    parser.add_argument('--only', action='append', metavar='RACE[/YEAR]',
+                        help='only ingest this race or race year (repeatable)')
+    parser.add_argument('--csv-dir', default='Data_output', help='directory to write results_*.csv to')
+    parser.add_argument('--no-csv', action='store_true', help="don't write the csvs (with --build-store)")
+    parser.add_argument('--cache-dir', default='Data_cache', help='http cache directory (default: Data_cache)')
+    parser.add_argument('--no-cache', action='store_true', help="don't cache or revalidate pages")
+    parser.add_argument('--offline', action='store_true', help='replay pages from the cache without any network access')
+    parser.add_argument('--fetch-workers', type=int, default=4, help='events fetched at once (default: 4)')
+    parser.add_argument('--parse-workers', type=int, default=os.cpu_count() or 1,
+                        help='parser processes (default: one per core)')
+    parser.add_argument('--connections', type=int, default=16, help='http requests in flight in total (default: 16)')
+    parser.add_argument('--per-host', type=int, default=4, help='http requests in flight per host (default: 4)')
+    parser.add_argument('--min-interval', type=float, default=0.25,
+                        help='seconds between requests to the same host (default: 0.25)')
+    parser.add_argument('--retries', type=int, default=3, help='retries per request (default: 3)')
+    parser.add_argument('--queue-size', type=int, default=4, help='events waiting between stages (default: 4)')
+    parser.add_argument('--build-store', action='store_true',
+                        help='rebuild the race store afterwards, from the decoded results (and the csvs of '
+                             'races not ingested this run)')
+    parser.add_argument('--store-dir', default='Data_store', help='store directory for --build-store')
+    args = parser.parse_args(argv)
+    if args.offline and args.no_cache:
+        parser.error('--offline replays from the cache, so it needs the cache')
+    if args.no_csv and not args.build_store:
+        parser.error('--no-csv writes nothing without --build-store')
+
+    race_info = store.load_race_info(args.races)
+    events = pipeline.catalog_events(race_info, args.only)
+    if not events:
+        parser.error('no races match --only')
+    cache = None if args.no_cache else ResponseCache(args.cache_dir)
+    fetcher = Fetcher(max_workers=args.connections, per_host=args.per_host, min_interval=args.min_interval,
+                      retries=args.retries, cache=cache, offline=args.offline)
+
+    def report(result):
+        event = result.event
+        if result.error is None:
+            print('{0} {1}: {2} rows from {3} page(s)'.format(event.race, event.year, result.rows, result.pages))
+        else:
+            print('{0} {1}: FAILED: {2}'.format(event.race, event.year, result.error), file=sys.stderr)
+        sys.stdout.flush()
+
+    start = time.monotonic()
+    with fetcher:
+        results = pipeline.run(events, fetcher, None if args.no_csv else args.csv_dir, fetch_workers=args.fetch_workers,
+                               parse_workers=args.parse_workers, queue_size=args.queue_size, on_result=report)
+    failed = [result for result in results if result.error is not None]
+    print('{0} of {1} events ingested in {2:.1f}s'.format(len(results) - len(failed), len(results),
+                                                         time.monotonic() - start))
+    if args.build_store:
+        # Races ingested this run are written from their decoded columns, without reading
+        # their csvs back; the rest come from the csvs of earlier runs, where there are any
+        race_columns = {result.event.dfname: result.columns for result in results if result.error is None}
+        build_race_info = {race: {year: info for year, info in years.items()
+                                  if info['dfname'] in race_columns or
+                                  os.path.exists(os.path.join(args.csv_dir, 'results_{0}.csv'.format(info['dfname'])))}
+                           for race, years in race_info.items()}
+        catalog = store.build_store(build_race_info, args.csv_dir, args.store_dir, race_columns)
+        print('store {0} built in {1}'.format(catalog['version'][:12], args.store_dir))
+    return 1 if failed else 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
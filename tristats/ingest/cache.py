@@ -0,0 +1,120 @@
+"""
+On-disk cache of fetched results pages.
+
+Bodies are stored content-addressed (by sha256, so a page that hasn't
+changed, or the same page under two urls, is stored once), and each url
+has a small json entry pointing at its body along with the status,
+headers, ETag, and Last-Modified of the response.
+
+Layout:
+
+    cache_dir/
+        bodies/ab/ab12...      raw response bodies, named by sha256
+        urls/cd34....json      url -> status, headers, body hash
+
+A Fetcher with a cache revalidates cached pages with conditional requests
+(If-None-Match / If-Modified-Since), so refetching an unchanged page costs
+a 304, and in offline mode it replays pages from the cache without any
+network access.
+"""
+
+import hashlib
+import json
+import os
+import tempfile
+import time
+
+from tristats.ingest.fetch import Page
+
+
+def _write_atomic(path, data):
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    fd, tmp_path = tempfile.mkstemp(dir=os.path.dirname(path), prefix='.tmp-')
+    with os.fdopen(fd, 'wb') as f:
+        f.write(data)
+    os.replace(tmp_path, path)
+
+
+class ResponseCache:
+    """
+    Cached responses by url, with bodies stored by content hash.  Safe to
+    share between threads and processes (every file is written to a
+    temporary name and renamed into place).
+    """
+
+    def __init__(self, cache_dir='Data_cache'):
+        self.cache_dir = cache_dir
+
+    def _entry_path(self, url):
+        name = hashlib.sha1(url.encode('utf-8')).hexdigest()
+        return os.path.join(self.cache_dir, 'urls', name + '.json')
+
+    def _body_path(self, digest):
+        return os.path.join(self.cache_dir, 'bodies', digest[:2], digest)
+
+    def entry(self, url):
+        """
+        The cache entry for url (a dict), or None.
+        """
+        try:
+            with open(self._entry_path(url)) as f:
+                return json.load(f)
+        except (OSError, ValueError):
+            return None
+
+    def get(self, url):
+        """
+        The cached Page for url, or None.
+        """
+        entry = self.entry(url)
+        if entry is None:
+            return None
+        try:
+            with open(self._body_path(entry['body']), 'rb') as f:
+                content = f.read()
+        except OSError:
+            return None
+        return Page(entry['final_url'], entry['status'], entry['headers'], content)
+
+    def put(self, url, page):
+        """
+        Store a fetched Page under url.
+        """
+        digest = hashlib.sha256(page.content).hexdigest()
+        if not os.path.exists(self._body_path(digest)):
+            _write_atomic(self._body_path(digest), page.content)
+        headers = {key.lower(): value for key, value in page.headers.items()}
+        entry = {
+            'url': url,
+            'final_url': page.url,
+            'status': page.status,
+            'headers': dict(page.headers),
+            'etag': headers.get('etag'),
+            'last_modified': headers.get('last-modified'),
+            'body': digest,
+            'fetched_at': time.time()
+        }
+        _write_atomic(self._entry_path(url), json.dumps(entry).encode('utf-8'))
+
+    def touch(self, url):
+        """
+        Record that url was revalidated (the server answered 304).
+        """
+        entry = self.entry(url)
+        if entry is not None:
+            entry['fetched_at'] = time.time()
+            _write_atomic(self._entry_path(url), json.dumps(entry).encode('utf-8'))
+
+    def conditional_headers(self, url):
+        """
+        Request headers that ask the server to answer 304 if url's cached
+        response is still current.
+        """
+        entry = self.entry(url)
+        headers = {}
+        if entry is not None:
+            if entry.get('etag'):
+                headers['If-None-Match'] = entry['etag']
+            if entry.get('last_modified'):
+                headers['If-Modified-Since'] = entry['last_modified']
+        return headers
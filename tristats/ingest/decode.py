@@ -0,0 +1,133 @@
+"""
+Decoding results rows straight into the store's typed columns.
+
+The header is mapped to canonical columns once (store.header_replacement),
+then each row's cells are appended to a builder per column: ints for
+places and bibs, category codes for divisions and genders, text for names
+and cities, and times parsed in batches into int32 seconds.  There is no
+intermediate dataframe of strings, and the result is in the form
+store.write_race takes.
+"""
+
+import array
+
+import numpy as np
+
+from tristats import store
+from tristats.times import MISSING, parse_times
+
+
+def column_sources(header):
+    """
+    Map canonical column name -> position in a results header.  Times are
+    taken from their time-string columns (e.g. 'swim', 'swim-swim', or
+    'swim_hhmmss' in the csvs), never from derived decimal-minute columns.
+    """
+    canonical = [store.header_replacement.get(name.strip().lower(), name.strip().lower()) for name in header]
+    sources = {}
+    for name, kind in store.canonical_columns:
+        candidates = [name + '_hhmmss', name + '_mmss', name] if kind == 'time' else [name]
+        for candidate in candidates:
+            if candidate in canonical:
+                sources[name] = canonical.index(candidate)
+                break
+    return sources
+
+
+class ColumnDecoder:
+    """
+    Builds the canonical columns of one race from rows of cell strings.
+    """
+
+    def __init__(self, header, batch_size=4096):
+        self.sources = column_sources(header)
+        self.batch_size = batch_size
+        self.rows = 0
+        self._ints = {}
+        self._texts = {}
+        self._codes = {}
+        self._labels = {}
+        self._times = {}
+        self._pending_times = {}
+        for name, kind in store.canonical_columns:
+            if kind == 'int':
+                self._ints[name] = array.array('i')
+            elif kind == 'text':
+                self._texts[name] = []
+            elif kind == 'category':
+                self._codes[name] = array.array('h')
+                self._labels[name] = {}
+            elif kind == 'time':
+                self._times[name] = array.array('i')
+                self._pending_times[name] = []
+        # Gender is derived from division when the results don't list it
+        self._derive_gender = 'gender' not in self.sources and 'division' in self.sources
+        # (builder, position in the row) pairs, so each row is one pass over the builders
+        position = self.sources.get
+        self._int_builders = [(values, position(name)) for name, values in self._ints.items()]
+        self._text_builders = [(values, position(name)) for name, values in self._texts.items()]
+        self._category_builders = [(name, codes, position(name)) for name, codes in self._codes.items()]
+        self._time_builders = [(pending, position(name)) for name, pending in self._pending_times.items()]
+
+    def _category_code(self, name, value):
+        if not value:
+            return MISSING
+        labels = self._labels[name]
+        if value not in labels:
+            labels[value] = len(labels)
+        return labels[value]
+
+    def append(self, cells):
+        """
+        Add one row (cell strings in header order).
+        """
+        for values, position in self._int_builders:
+            cell = cells[position].strip() if position is not None else ''
+            values.append(int(cell) if cell.isdigit() else MISSING)
+        for values, position in self._text_builders:
+            values.append(cells[position].strip() if position is not None else '')
+        for name, codes, position in self._category_builders:
+            if name == 'gender' and self._derive_gender:
+                division = cells[self.sources['division']].strip()
+                value = ('female' if division[:1].lower() == 'f' else 'male') if division else ''
+            else:
+                value = cells[position].strip().lower() if position is not None else ''
+            codes.append(self._category_code(name, value))
+        for pending, position in self._time_builders:
+            pending.append(cells[position] if position is not None else '')
+        self.rows += 1
+        if self.rows % self.batch_size == 0:
+            self._flush_times()
+
+    def extend(self, rows):
+        for cells in rows:
+            self.append(cells)
+
+    def _flush_times(self):
+        for name, pending in self._pending_times.items():
+            if pending:
+                self._times[name].frombytes(parse_times(pending)[0].tobytes())
+                pending.clear()
+
+    def finish(self):
+        """
+        The decoded columns, as store.write_race takes them (category labels
+        sorted, like store.normalize_results).
+        """
+        self._flush_times()
+        columns = {}
+        for name, values in self._ints.items():
+            columns[name] = np.frombuffer(values, dtype=np.int32).copy() if self.rows else np.array([], dtype=np.int32)
+        for name, values in self._texts.items():
+            columns[name] = np.array(values, dtype=str) if values else np.array([], dtype='U1')
+        for name, codes in self._codes.items():
+            labels = sorted(self._labels[name], key=self._labels[name].get)
+            order = sorted(range(len(labels)), key=labels.__getitem__)
+            # Old code -> code in sorted label order (MISSING stays MISSING)
+            remap = np.full(len(labels) + 1, MISSING, dtype=np.int16)
+            remap[order] = np.arange(len(labels), dtype=np.int16)
+            codes = np.frombuffer(codes, dtype=np.int16) if self.rows else np.array([], dtype=np.int16)
+            columns[name] = (remap[codes], [labels[i] for i in order])
+        for name, values in self._times.items():
+            columns[name] = np.frombuffer(values, dtype=np.int32).copy() if self.rows else np.array([], dtype=np.int32)
+        return columns
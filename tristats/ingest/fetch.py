@@ -0,0 +1,185 @@
+"""
+Concurrent fetching of results pages.
+
+All requests go through one pooled requests.Session, so connections to a
+results site are kept alive and reused.  Requests run on a thread pool,
+with a cap on concurrent requests and a minimum interval between requests
+per host (to stay polite to the results sites), and transient failures
+(connection errors, 429s, and 5xx responses) are retried with exponential
+backoff.  With a ResponseCache (tristats.ingest.cache), cached pages are
+revalidated with conditional requests, or replayed without the network
+in offline mode.
+"""
+
+import collections
+import concurrent.futures
+import threading
+import time
+import urllib.parse
+
+import requests
+import requests.adapters
+
+
+# A fetched page
+Page = collections.namedtuple('Page', ['url', 'status', 'headers', 'content'])
+
+# Responses worth retrying
+retry_statuses = {429, 500, 502, 503, 504}
+
+
+class FetchError(Exception):
+    """
+    A page that couldn't be fetched, even after retries.
+    """
+
+    def __init__(self, url, reason):
+        super().__init__('{0}: {1}'.format(url, reason))
+        self.url = url
+        self.reason = reason
+
+
+class HostLimiter:
+    """
+    Concurrency cap and minimum interval between request starts for one host.
+    """
+
+    def __init__(self, max_concurrent, min_interval):
+        self.min_interval = min_interval
+        self._slots = threading.BoundedSemaphore(max_concurrent)
+        self._lock = threading.Lock()
+        self._next_start = 0.0
+
+    def __enter__(self):
+        self._slots.acquire()
+        with self._lock:
+            now = time.monotonic()
+            start = max(now, self._next_start)
+            self._next_start = start + self.min_interval
+        if start > now:
+            time.sleep(start - now)
+        return self
+
+    def __exit__(self, *exc_info):
+        self._slots.release()
+
+
+class Fetcher:
+    """
+    Fetch pages concurrently through a pooled session.
+
+    max_workers is the total number of requests in flight; per_host caps
+    the requests in flight to any one host, and min_interval (seconds) is
+    the least time between the starts of two requests to the same host.
+    A failed request is retried up to retries times, waiting backoff,
+    2*backoff, 4*backoff, ... seconds in between (or the server's
+    Retry-After, when it sends one).
+
+    With a cache, successful responses are stored and cached urls are
+    fetched conditionally (a 304 returns the cached page); with offline
+    also set, pages come only from the cache.
+    """
+
+    def __init__(self, max_workers=16, per_host=4, min_interval=0.25, retries=3, backoff=1.0,
+                 timeout=30, session=None, user_agent='tristats-ingest', cache=None, offline=False):
+        self.max_workers = max_workers
+        self.per_host = per_host
+        self.min_interval = min_interval
+        self.retries = retries
+        self.backoff = backoff
+        self.timeout = timeout
+        self.cache = cache
+        self.offline = offline
+        if offline and cache is None:
+            raise ValueError('offline fetching needs a cache')
+        if session is None:
+            session = requests.Session()
+            adapter = requests.adapters.HTTPAdapter(pool_connections=max_workers, pool_maxsize=max_workers)
+            session.mount('http://', adapter)
+            session.mount('https://', adapter)
+            session.headers['User-Agent'] = user_agent
+        self.session = session
+        self._limiters = {}
+        self._limiters_lock = threading.Lock()
+
+    def _limiter(self, url):
+        host = urllib.parse.urlsplit(url).netloc
+        with self._limiters_lock:
+            if host not in self._limiters:
+                self._limiters[host] = HostLimiter(self.per_host, self.min_interval)
+            return self._limiters[host]
+
+    def _retry_delay(self, attempt, response=None):
+        if response is not None and response.headers.get('Retry-After', '').isdigit():
+            return float(response.headers['Retry-After'])
+        return self.backoff * 2**attempt
+
+    def fetch(self, url, headers=None):
+        """
+        Fetch one page.  Returns a Page for any final response (including
+        4xx other than 429, so callers can decide what a 404 means), and
+        raises FetchError when retries run out (or, offline, when the page
+        isn't cached).
+        """
+        if self.cache is None:
+            return self._get(url, headers)
+        cached = self.cache.get(url)
+        if self.offline:
+            if cached is None:
+                raise FetchError(url, 'not in the cache (offline)')
+            return cached
+        if cached is not None:
+            headers = dict(headers or {}, **self.cache.conditional_headers(url))
+        page = self._get(url, headers)
+        if page.status == 304 and cached is not None:
+            self.cache.touch(url)
+            return cached
+        if page.status == 200:
+            self.cache.put(url, page)
+        return page
+
+    def _get(self, url, headers):
+        limiter = self._limiter(url)
+        for attempt in range(self.retries + 1):
+            response = None
+            try:
+                with limiter:
+                    response = self.session.get(url, headers=headers, timeout=self.timeout)
+                if response.status_code not in retry_statuses:
+                    return Page(response.url, response.status_code, dict(response.headers), response.content)
+                reason = 'HTTP {0}'.format(response.status_code)
+            except requests.RequestException as e:
+                reason = repr(e)
+            if attempt < self.retries:
+                time.sleep(self._retry_delay(attempt, response))
+        raise FetchError(url, reason)
+
+    def fetch_all(self, urls, return_exceptions=False):
+        """
+        Fetch many pages concurrently.  Returns the pages in the order of
+        urls.  With return_exceptions, a page that fails is returned as its
+        FetchError instead of raising, so one bad url doesn't sink a backfill.
+        """
+        urls = list(urls)
+        with concurrent.futures.ThreadPoolExecutor(max_workers=self.max_workers) as pool:
+            futures = [pool.submit(self.fetch, url) for url in urls]
+            results = []
+            for future in futures:
+                try:
+                    results.append(future.result())
+                except FetchError as e:
+                    if not return_exceptions:
+                        for pending in futures:
+                            pending.cancel()
+                        raise
+                    results.append(e)
+        return results
+
+    def close(self):
+        self.session.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
@@ -0,0 +1,66 @@
+"""
+Paginated results listings.
+
+Results sites split large events over pages (e.g. raceroster's
+`per_page=...&page=N`).  The page count is read from the pagination list
+on the first page, then every remaining page is fetched at once and the
+pages are put back in page order, so large events are neither truncated
+to their first page nor crawled one page at a time.
+"""
+
+import urllib.parse
+
+from lxml import etree
+from lxml import html
+
+from tristats.ingest.fetch import FetchError
+
+
+# Pagination lists: <ul class="pagination ..."> on raceroster and sportstats
+_pagination_items = etree.XPath(
+    '//ul[contains(concat(" ", normalize-space(@class), " "), " pagination ")]/li')
+
+
+def page_count(content, param='page'):
+    """
+    Number of pages in a listing, from the pagination list of one of its
+    pages: the highest page number among the list's labels and the page
+    parameters of its links (1 when there's no pagination).
+    """
+    tree = html.fromstring(content)
+    pages = [1]
+    for item in _pagination_items(tree):
+        label = item.text_content().strip()
+        if label.isdigit():
+            pages.append(int(label))
+        for href in item.xpath('.//a/@href'):
+            values = urllib.parse.parse_qs(urllib.parse.urlsplit(href).query).get(param, [])
+            pages.extend(int(value) for value in values if value.isdigit())
+    return max(pages)
+
+
+def page_url(url, page, param='page'):
+    """
+    url with its page parameter set to page (other parameters kept in order).
+    """
+    parts = urllib.parse.urlsplit(url)
+    query = [(key, value) for key, value in urllib.parse.parse_qsl(parts.query, keep_blank_values=True)
+             if key != param]
+    query.append((param, str(page)))
+    return urllib.parse.urlunsplit(parts._replace(query=urllib.parse.urlencode(query)))
+
+
+def fetch_pages(url, fetcher, param='page'):
+    """
+    Fetch every page of a listing through a Fetcher: the first page (url as
+    given), then all the pages its pagination list points to, concurrently.
+    Returns the Pages in page order, and raises FetchError if the first
+    page can't be fetched.
+    """
+    first = fetcher.fetch(url)
+    if first.status != 200:
+        raise FetchError(url, 'HTTP {0}'.format(first.status))
+    count = page_count(first.content, param)
+    start = int(urllib.parse.parse_qs(urllib.parse.urlsplit(url).query).get(param, ['1'])[0])
+    rest = fetcher.fetch_all(page_url(url, page, param) for page in range(start + 1, count + 1))
+    return [first] + rest
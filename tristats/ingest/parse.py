@@ -0,0 +1,163 @@
+"""
+Parsing results tables out of results pages.
+
+Each results site lays its table out a little differently (a TableLayout).
+All lookups are scoped to the results table itself, so rows from other
+tables on the page never leak in, and there are two ways to read a page:
+
+- streaming (the default): the page is fed through lxml's iterparse and
+  each row is handed on as soon as it has been read, then freed, so memory
+  stays flat however many rows the page has;
+- tree: the page is parsed whole and walked with compiled, table-relative
+  XPaths (handy for pages already in memory).
+
+Both yield the combined header first, then each body row, as lists of
+stripped cell strings.
+"""
+
+import collections
+import io
+
+from lxml import etree
+from lxml import html
+
+
+# How a site lays out its results table: the table's class attribute, how
+# many header rows it has, and (if the header has other cells too) the role
+# of the header cells that name columns
+TableLayout = collections.namedtuple('TableLayout', ['table_class', 'header_rows', 'header_role'])
+
+raceroster = TableLayout('results-listing__table table table-hover table-striped', 2, None)
+sportstats = TableLayout('results overview-result', 1, 'columnheader')
+
+
+def combine_headers(header_rows, colspans):
+    """
+    One column name per column from a table's header rows (lowercased).
+    A first-row heading spanning several columns (colspan > 1) is combined
+    with the second-row headings under it, e.g. 'swim' + '-rank'; headings
+    spanning one column are used as is.
+    """
+    first = [text.strip().lower() for text in header_rows[0]]
+    if len(header_rows) < 2:
+        return first
+    second = [text.strip().lower() for text in header_rows[1]]
+    header = []
+    position = 0
+    for text, span in zip(first, colspans):
+        if span == 1:
+            header.append(text)
+        else:
+            header.extend(text + '-' + sub for sub in second[position:position + span])
+            position += span
+    return header
+
+
+def _colspan(cell):
+    value = cell.get('colspan')
+    return int(value) if value and value.isdigit() else 1
+
+
+def _cell_text(cell):
+    return ''.join(cell.itertext()).strip()
+
+
+def _header_cells(row, layout):
+    return [cell for cell in row if cell.tag == 'th'
+            and (layout.header_role is None or cell.get('role') == layout.header_role)]
+
+
+#--------------#
+# Tree parsing
+#--------------#
+
+_results_tables = etree.XPath('//table[@class = $table_class]')
+_header_rows = etree.XPath('./thead/tr')
+_body_rows = etree.XPath('./tbody/tr | ./tr')
+_body_cells = etree.XPath('./td')
+
+
+def _tree_rows(content, layout):
+    tree = html.fromstring(content)
+    for table in _results_tables(tree, table_class=layout.table_class):
+        header_rows = _header_rows(table)[:layout.header_rows]
+        if not header_rows:
+            continue
+        first_cells = _header_cells(header_rows[0], layout)
+        header = combine_headers([[_cell_text(cell) for cell in _header_cells(row, layout)] for row in header_rows],
+                                 [_colspan(cell) for cell in first_cells])
+        yield header
+        for row in _body_rows(table):
+            cells = [_cell_text(cell) for cell in _body_cells(row)]
+            if len(cells) == len(header):
+                yield cells
+        return
+
+
+#-------------------#
+# Streaming parsing
+#-------------------#
+
+def _streamed_rows(source, layout):
+    table = None
+    in_header = False
+    header_rows, colspans = [], None
+    header = None
+    for event, element in etree.iterparse(source, events=('start', 'end'), tag=('table', 'thead', 'tr'),
+                                          html=True, recover=True):
+        if table is None:
+            if event == 'start' and element.tag == 'table' and element.get('class') == layout.table_class:
+                table = element
+            continue
+        if element.tag == 'thead':
+            in_header = event == 'start'
+            continue
+        if element.tag == 'table':
+            if event == 'end' and element is table:
+                return
+            continue
+        if event != 'end':
+            continue
+        # A finished row
+        if in_header:
+            if len(header_rows) < layout.header_rows:
+                cells = _header_cells(element, layout)
+                if colspans is None:
+                    colspans = [_colspan(cell) for cell in cells]
+                header_rows.append([_cell_text(cell) for cell in cells])
+        else:
+            if header is None:
+                if not header_rows:
+                    return
+                header = combine_headers(header_rows, colspans)
+                yield header
+            cells = [_cell_text(cell) for cell in element if cell.tag == 'td']
+            if len(cells) == len(header):
+                yield cells
+        # Free the row and any rows before it
+        element.clear()
+        parent = element.getparent()
+        while element.getprevious() is not None:
+            del parent[0]
+    if table is not None and header is None and header_rows:
+        yield combine_headers(header_rows, colspans)
+
+
+def table_rows(source, layout=raceroster, stream=True):
+    """
+    Rows of the results table in a page: first the combined header, then
+    each body row with as many cells as the header (other rows, e.g. ad
+    or divider rows, are skipped).  source is the page's bytes, or a file
+    object or path to stream it from.  Yields nothing when the page has
+    no results table.
+    """
+    if isinstance(source, bytes):
+        if not stream:
+            return _tree_rows(source, layout)
+        source = io.BytesIO(source)
+    elif not stream:
+        if isinstance(source, str):
+            with open(source, 'rb') as f:
+                return _tree_rows(f.read(), layout)
+        return _tree_rows(source.read(), layout)
+    return _streamed_rows(source, layout)
@@ -0,0 +1,268 @@
+"""
+The ingest pipeline: fetch -> parse -> normalize -> write.
+
+Each event (one race year from races.json) flows through four stages:
+
+- fetch: every page of the event's results listing, on a pool of fetch
+  threads sharing one Fetcher (pooled connections, per-host limits, cache);
+- parse and normalize: the results table is streamed out of each page and
+  decoded straight into canonical typed columns, on a pool of processes
+  (this is the CPU-bound part, so it uses every core);
+- write: optionally, the event's csv in Data_output/ (the input of
+  `python -m tristats.store`); the decoded columns are also returned, so
+  the store can be built from them directly (store.build_store's
+  race_columns) without reading the csvs back.
+
+Stages are connected by bounded queues, so a fast stage waits for a slow
+one instead of piling up pages in memory, and different events are in
+different stages at the same time.  Run it with `python -m tristats.ingest`.
+"""
+
+import collections
+import concurrent.futures
+import multiprocessing
+import os
+import queue
+import tempfile
+import threading
+import urllib.parse
+
+import numpy as np
+import pandas as pd
+
+from tristats import store
+from tristats.ingest import decode
+from tristats.ingest import pages
+from tristats.ingest import parse
+from tristats.ingest.fetch import FetchError
+from tristats.times import MISSING, format_seconds
+
+
+# One race year to ingest
+Event = collections.namedtuple('Event', ['race', 'year', 'dfname', 'url', 'layout'])
+
+# What happened to an event: its decoded columns and rows, or the error that stopped it
+EventResult = collections.namedtuple('EventResult', ['event', 'rows', 'pages', 'error', 'columns'])
+
+# Results table layouts by results site
+site_layouts = {
+    'raceroster.com': parse.raceroster,
+    'sportstats.ca': parse.sportstats,
+}
+
+
+def layout_for(url):
+    """
+    Table layout for a results url, from its site (raceroster by default).
+    """
+    host = urllib.parse.urlsplit(url).netloc.lower()
+    for site, layout in site_layouts.items():
+        if host == site or host.endswith('.' + site):
+            return layout
+    return parse.raceroster
+
+
+def catalog_events(race_info, only=None):
+    """
+    Events for the race years in a race catalog (races.json), optionally
+    limited to the given 'Race' or 'Race/Year' names.
+    """
+    events = []
+    for race, years in race_info.items():
+        for year, info in years.items():
+            if only and race not in only and '{0}/{1}'.format(race, year) not in only:
+                continue
+            events.append(Event(race, year, info['dfname'], info['url'], layout_for(info['url'])))
+    return events
+
+
+#-----------------------------#
+# Parse and normalize (worker)
+#-----------------------------#
+
+def decode_pages(contents, layout):
+    """
+    Decode the results tables of an event's pages (bytes, in page order)
+    into canonical columns, as one table.  Runs in a worker process.
+    """
+    decoder = first_header = None
+    for content in contents:
+        rows = parse.table_rows(content, layout)
+        header = next(rows, None)
+        if header is None:
+            continue
+        if decoder is None:
+            decoder = decode.ColumnDecoder(header)
+            first_header = header
+        elif header != first_header:
+            raise ValueError('pages have different columns: {0} vs {1}'.format(first_header, header))
+        decoder.extend(rows)
+    if decoder is None:
+        raise ValueError('no results table found')
+    return decoder.finish()
+
+
+#---------#
+# Write
+#---------#
+
+def results_frame(columns):
+    """
+    Canonical columns as a results csv table: categories as labels, missing
+    numbers blank, and each time both as h:mm:ss text (e.g. 'swim_hhmmss')
+    and as decimal minutes (e.g. 'swim'), like the scraped csvs.
+    """
+    data = {}
+    for name, kind in store.canonical_columns:
+        values = columns[name]
+        if kind == 'int':
+            data[name] = pd.Series(values, dtype='Int64').mask(values == MISSING)
+        elif kind == 'text':
+            data[name] = values
+        elif kind == 'category':
+            codes, labels = values
+            data[name] = np.array(labels + [''], dtype=object)[codes]
+    for name, kind in store.canonical_columns:
+        if kind == 'time':
+            values = columns[name]
+            timed = values != MISSING
+            data[name + '_hhmmss'] = [format_seconds(value) if ok else '' for value, ok in zip(values.tolist(), timed)]
+    for name, kind in store.canonical_columns:
+        if kind == 'time':
+            values = columns[name]
+            data[name] = np.where(values == MISSING, np.nan, values/60)
+    return pd.DataFrame(data)
+
+
+def write_results_csv(csv_dir, dfname, columns):
+    """
+    Write an event's columns to csv_dir/results_<dfname>.csv (written to a
+    temporary file and renamed, so readers never see half a file).
+    """
+    os.makedirs(csv_dir, exist_ok=True)
+    path = os.path.join(csv_dir, 'results_{0}.csv'.format(dfname))
+    fd, tmp_path = tempfile.mkstemp(dir=csv_dir, prefix='.results-', suffix='.csv')
+    with os.fdopen(fd, 'w', newline='') as f:
+        results_frame(columns).to_csv(f, index=False)
+    os.replace(tmp_path, path)
+    return path
+
+
+#-------------#
+# Pipeline
+#-------------#
+
+_done = object()
+
+
+def run(events, fetcher, csv_dir='Data_output', fetch_workers=4, parse_workers=None, queue_size=4,
+        on_result=None):
+    """
+    Ingest events through the fetch -> parse/normalize -> write stages and
+    return an EventResult per event (in the order they finished), with its
+    decoded columns.  Each event's csv is written to csv_dir, unless it's
+    None.  parse_workers defaults to one process per core; queue_size
+    bounds how many events wait between stages.  on_result, if given, is
+    called with each EventResult as it's written.
+    """
+    parse_workers = parse_workers or os.cpu_count() or 1
+    todo = queue.Queue()
+    fetched = queue.Queue(maxsize=queue_size)
+    decoded = queue.Queue(maxsize=queue_size)
+    for event in events:
+        todo.put(event)
+
+    def fetch_stage():
+        while True:
+            try:
+                event = todo.get_nowait()
+            except queue.Empty:
+                return
+            try:
+                event_pages = pages.fetch_pages(event.url, fetcher)
+                failed = [page for page in event_pages if page.status != 200]
+                if failed:
+                    raise FetchError(failed[0].url, 'HTTP {0}'.format(failed[0].status))
+                fetched.put((event, [page.content for page in event_pages], None))
+            except Exception as e:
+                # One bad event (unreachable, or not a results page) mustn't stop the others
+                fetched.put((event, None, e))
+
+    def fetch_stages():
+        threads = [threading.Thread(target=fetch_stage, daemon=True) for i in range(fetch_workers)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        fetched.put(_done)
+
+    def parse_stage():
+        slots = threading.BoundedSemaphore(parse_workers)
+        waiting = True
+        item = None
+        try:
+            try:
+                # Workers come from a forkserver, not forked from this process while its fetch
+                # threads are running (forking a multi-threaded process can deadlock)
+                context = multiprocessing.get_context('forkserver')
+                with concurrent.futures.ProcessPoolExecutor(max_workers=parse_workers, mp_context=context) as pool:
+                    while True:
+                        item = fetched.get()
+                        if item is _done:
+                            waiting = False
+                            break
+                        event, contents, error = item
+                        if error is not None:
+                            decoded.put((event, 0, None, error))
+                            continue
+                        slots.acquire()
+                        future = pool.submit(decode_pages, contents, event.layout)
+                        item = None
+
+                        def finished(future, event=event, page_count=len(contents)):
+                            slots.release()
+                            try:
+                                decoded.put((event, page_count, future.result(), None))
+                            except Exception as e:
+                                decoded.put((event, page_count, None, e))
+                        future.add_done_callback(finished)
+            except Exception as e:
+                # The pool couldn't start or broke (e.g. a worker process was killed):
+                # fail the event being submitted and every event still waiting to be parsed
+                while waiting:
+                    if item is None:
+                        item = fetched.get()
+                    if item is _done:
+                        break
+                    event, contents, error = item
+                    decoded.put((event, 0 if contents is None else len(contents), None, error or e))
+                    item = None
+        finally:
+            # Always let the write stage finish, whatever happened here
+            decoded.put(_done)
+
+    stages = [threading.Thread(target=fetch_stages, daemon=True), threading.Thread(target=parse_stage, daemon=True)]
+    for stage in stages:
+        stage.start()
+    # Write stage
+    results = []
+    while True:
+        item = decoded.get()
+        if item is _done:
+            break
+        event, page_count, columns, error = item
+        rows = 0
+        if error is None:
+            try:
+                if csv_dir is not None:
+                    write_results_csv(csv_dir, event.dfname, columns)
+                rows = len(columns['name'])
+            except OSError as e:
+                error = e
+        result = EventResult(event, rows, page_count, error, columns if error is None else None)
+        results.append(result)
+        if on_result is not None:
+            on_result(result)
+    for stage in stages:
+        stage.join()
+    return results
@@ -0,0 +1,379 @@
+"""
+Memoized callback outputs.
+
+Many visitors ask for the same comparisons (every page load starts from the
+default athlete pair), so callback outputs are kept in memory, keyed on the
+callback's normalized inputs, the store version, and the code version (so
+neither a rebuilt store nor a new deploy is served stale figures).  Entries
+expire after a TTL, and the least recently used are evicted once the cached
+outputs exceed a byte budget.
+
+An in-process cache only helps the worker that computed an output, so the
+cache can be backed by a shared store that every worker (and, for a
+networked store, every node) reads and writes: outputs are stored as
+compressed JSON (never pickles, so whoever can write to the store can't
+run code in the workers), and looked up there on a local miss before being
+computed.
+
+SqliteCache is a shared store on local disk; anything with the same get,
+set, lease, leased, release, and clear methods (e.g. a wrapper around a
+key-value server, with lease as an atomic set-if-absent with expiry and
+leased as a read of the lease) can be used instead.
+"""
+
+import collections
+import hashlib
+import json
+import os
+import sqlite3
+import threading
+import time
+import zlib
+
+import plotly.utils
+
+
+def to_json(value):
+    """
+    A callback output as the UTF-8 JSON sent to the browser (and kept,
+    compressed, in a shared store).  Components, patches, and no_update
+    are serialized in the form Dash sends them in, which Dash accepts back
+    as callback outputs.
+    """
+    return json.dumps(value, cls=plotly.utils.PlotlyJSONEncoder).encode('utf-8')
+
+
+def payload_size(value):
+    """
+    Size in bytes of a callback output as serialized for the browser.
+    """
+    return len(to_json(value))
+
+
+def code_version(paths):
+    """
+    Hash of the source files that produce the cached outputs, for cache
+    keys, so a deploy that changes how outputs are built never reads
+    outputs a previous version left in a shared store.
+    """
+    digest = hashlib.sha1()
+    for path in sorted(paths):
+        with open(path, 'rb') as f:
+            digest.update(f.read())
+    return digest.hexdigest()[:12]
+
+
+class _Flight:
+    """
+    An output being computed, for the requests waiting on it.
+    """
+
+    def __init__(self):
+        self.done = threading.Event()
+        self.value = None
+        self.error = None
+
+
+class OutputCache:
+    """
+    Callback outputs by key, expiring ttl seconds after they're computed
+    and evicting the least recently used past max_bytes, with hit and miss
+    counts.  Outputs are shared between requests, so they must not be
+    modified once cached.  With a shared store (see SqliteCache), local
+    misses are looked up there, and computed outputs are written there too;
+    a worker takes a lease on an output before computing it, so workers
+    missing at the same moment wait for one of them (up to lease_time
+    seconds) instead of all computing it.
+    """
+
+    def __init__(self, max_bytes=64 * 2**20, ttl=3600, clock=time.monotonic, shared=None,
+                 lease_time=10, poll_interval=0.02):
+        self.max_bytes = max_bytes
+        self.ttl = ttl
+        self.clock = clock
+        self.shared = shared
+        self.lease_time = lease_time
+        self.poll_interval = poll_interval
+        self._entries = collections.OrderedDict()  # key -> (value, size, expires)
+        self._flights = {}  # key -> _Flight, for outputs being computed
+        self._bytes = 0
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.shared_hits = 0
+        self.coalesced = 0
+
+    def get(self, key):
+        """
+        The cached output for key, or None.
+        """
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None and entry[2] <= self.clock():
+                self._remove(key)
+                entry = None
+            if entry is None:
+                self.misses += 1
+                return None
+            self._entries.move_to_end(key)
+            self.hits += 1
+            return entry[0]
+
+    def put(self, key, value, size=None):
+        """
+        Cache an output (outputs bigger than the whole budget aren't kept).
+        size is its payload_size, if the caller has already serialized it.
+        """
+        if size is None:
+            size = payload_size(value)
+        if size > self.max_bytes:
+            return
+        with self._lock:
+            if key in self._entries:
+                self._remove(key)
+            self._entries[key] = (value, size, self.clock() + self.ttl)
+            self._bytes += size
+            while self._bytes > self.max_bytes:
+                self._remove(next(iter(self._entries)))
+                self.evictions += 1
+
+    def get_or_compute(self, key, compute):
+        """
+        The cached output for key, from memory or the shared store,
+        computing (and caching) it on a miss.  Concurrent misses for the
+        same key are coalesced: one request computes the output and the
+        others wait for it, rather than all computing it at once.
+        """
+        value = self.get(key)
+        if value is not None:
+            return value
+        with self._lock:
+            flight = self._flights.get(key)
+            leader = flight is None
+            if leader:
+                flight = self._flights[key] = _Flight()
+        if not leader:
+            flight.done.wait()
+            with self._lock:
+                self.coalesced += 1
+            if flight.error is not None:
+                raise flight.error
+            return flight.value
+        try:
+            flight.value = self._load_or_compute(key, compute)
+            return flight.value
+        except Exception as e:
+            flight.error = e
+            raise
+        finally:
+            with self._lock:
+                del self._flights[key]
+            flight.done.set()
+
+    def _load_or_compute(self, key, compute):
+        if self.shared is None:
+            value = compute()
+            self.put(key, value)
+            return value
+        shared_key = self.shared_key(key)
+        value, size = self._load_shared(shared_key)
+        waited = False
+        if value is None and not self.shared.lease(shared_key, self.lease_time):
+            # Another worker is computing it: wait for its result with reads only, and
+            # only try for the lease again once it's been released or has lapsed
+            waited = True
+            while True:
+                time.sleep(self.poll_interval)
+                value, size = self._load_shared(shared_key)
+                if value is not None:
+                    break
+                if not self.shared.leased(shared_key) and self.shared.lease(shared_key, self.lease_time):
+                    break
+        if value is None:
+            try:
+                if waited:
+                    # The other worker may have finished just before its lease was released
+                    value, size = self._load_shared(shared_key)
+                if value is None:
+                    value = compute()
+                    # Serialized once, both for the shared store and to size the entry
+                    data = to_json(value)
+                    size = len(data)
+                    self.shared.set(shared_key, zlib.compress(data), self.ttl)
+            finally:
+                self.shared.release(shared_key)
+        elif waited:
+            with self._lock:
+                self.coalesced += 1
+        self.put(key, value, size)
+        return value
+
+    def _load_shared(self, shared_key):
+        """
+        An output from the shared store and its payload size, or (None, None).
+        """
+        payload = self.shared.get(shared_key)
+        if payload is None:
+            return None, None
+        with self._lock:
+            self.shared_hits += 1
+        data = zlib.decompress(payload)
+        return json.loads(data.decode('utf-8')), len(data)
+
+    @staticmethod
+    def shared_key(key):
+        """
+        Shared store key for a cache key (a tuple of strings, numbers, and
+        booleans, starting with what the output is and the store version).
+        """
+        return hashlib.sha256(repr(key).encode('utf-8')).hexdigest()
+
+    def _remove(self, key):
+        value, size, expires = self._entries.pop(key)
+        self._bytes -= size
+
+    def stats(self):
+        """
+        Entry count, bytes held, and hit/miss/eviction counts.
+        """
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {
+                'entries': len(self._entries),
+                'bytes': self._bytes,
+                'max_bytes': self.max_bytes,
+                'ttl': self.ttl,
+                'hits': self.hits,
+                'misses': self.misses,
+                'evictions': self.evictions,
+                'shared_hits': self.shared_hits,
+                'coalesced': self.coalesced,
+                'hit_rate': self.hits/lookups if lookups else None
+            }
+
+    def __len__(self):
+        return len(self._entries)
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+            self._bytes = 0
+
+
+#-----------------#
+# Shared backends
+#-----------------#
+
+class SqliteCache:
+    """
+    Shared store of compressed outputs in a SQLite file, for the workers on
+    one machine.  Safe to use from several threads and processes (each
+    thread of each process opens its own connection, and the database is
+    in WAL mode so readers don't wait for writers).  Expired entries are
+    pruned as new ones are written, and the oldest past max_bytes.
+
+    A shared store never fails a request: if the database is locked or
+    unavailable, get returns None and set does nothing.
+    """
+
+    def __init__(self, path, max_bytes=512 * 2**20, timeout=1.0):
+        self.path = path
+        self.max_bytes = max_bytes
+        self.timeout = timeout
+        self._local = threading.local()
+        self._writes = 0
+
+    def _connection(self):
+        # Connections aren't shared across a fork, so they're opened per process (and per thread)
+        if getattr(self._local, 'pid', None) != os.getpid():
+            directory = os.path.dirname(self.path)
+            if directory:
+                os.makedirs(directory, mode=0o700, exist_ok=True)
+            connection = sqlite3.connect(self.path, timeout=self.timeout, isolation_level=None)
+            connection.execute('PRAGMA journal_mode=WAL')
+            connection.execute('PRAGMA synchronous=NORMAL')
+            connection.execute('CREATE TABLE IF NOT EXISTS outputs ('
+                               'key TEXT PRIMARY KEY, value BLOB NOT NULL, size INTEGER NOT NULL, '
+                               'expires REAL NOT NULL, created REAL NOT NULL)')
+            connection.execute('CREATE INDEX IF NOT EXISTS outputs_created ON outputs (created)')
+            connection.execute('CREATE TABLE IF NOT EXISTS leases (key TEXT PRIMARY KEY, expires REAL NOT NULL)')
+            self._local.connection = connection
+            self._local.pid = os.getpid()
+        return self._local.connection
+
+    def get(self, key):
+        """
+        The payload stored under key, or None.
+        """
+        try:
+            row = self._connection().execute('SELECT value FROM outputs WHERE key = ? AND expires > ?',
+                                             (key, time.time())).fetchone()
+        except (sqlite3.Error, OSError):
+            return None
+        return row[0] if row is not None else None
+
+    def set(self, key, value, ttl):
+        """
+        Store a payload under key for ttl seconds.
+        """
+        now = time.time()
+        try:
+            connection = self._connection()
+            connection.execute('INSERT OR REPLACE INTO outputs VALUES (?, ?, ?, ?, ?)',
+                               (key, value, len(value), now + ttl, now))
+            self._writes += 1
+            if self._writes % 100 == 1:
+                self._prune(connection, now)
+        except (sqlite3.Error, OSError):
+            pass
+
+    def _prune(self, connection, now):
+        connection.execute('DELETE FROM outputs WHERE expires <= ?', (now,))
+        total = connection.execute('SELECT COALESCE(SUM(size), 0) FROM outputs').fetchone()[0]
+        if total > self.max_bytes:
+            # Drop the oldest entries, down to three quarters of the budget
+            excess = total - self.max_bytes*3//4
+            connection.execute('DELETE FROM outputs WHERE key IN (SELECT key FROM (SELECT key, size, '
+                               'SUM(size) OVER (ORDER BY created, key) AS running FROM outputs) '
+                               'WHERE running - size < ?)', (excess,))
+
+    def lease(self, key, seconds):
+        """
+        Claim the right to compute key's output for the next few seconds.
+        Returns False if another worker holds an unexpired lease on it
+        (True if the database is unavailable, so the caller just computes).
+        """
+        now = time.time()
+        try:
+            connection = self._connection()
+            connection.execute('DELETE FROM leases WHERE key = ? AND expires <= ?', (key, now))
+            return connection.execute('INSERT OR IGNORE INTO leases VALUES (?, ?)',
+                                      (key, now + seconds)).rowcount == 1
+        except (sqlite3.Error, OSError):
+            return True
+
+    def leased(self, key):
+        """
+        Whether another worker holds an unexpired lease on key (a read, so
+        waiting workers don't contend with the one computing).
+        """
+        try:
+            row = self._connection().execute('SELECT 1 FROM leases WHERE key = ? AND expires > ?',
+                                             (key, time.time())).fetchone()
+        except (sqlite3.Error, OSError):
+            return False
+        return row is not None
+
+    def release(self, key):
+        try:
+            self._connection().execute('DELETE FROM leases WHERE key = ?', (key,))
+        except (sqlite3.Error, OSError):
+            pass
+
+    def clear(self):
+        try:
+            self._connection().execute('DELETE FROM leases')
+            self._connection().execute('DELETE FROM outputs')
+        except (sqlite3.Error, OSError):
+            pass
@@ -0,0 +1,156 @@
+"""
+Lazy, bounded registry of the races the app serves.
+
+Race and year metadata comes from the store catalog, so listing races never
+touches any rows.  A race is loaded the first time a callback asks for it,
+and the least recently used races are evicted once the resident ones
+exceed the memory budget.
+"""
+
+import collections
+import functools
+import threading
+
+from tristats.search import SearchIndex
+
+
+class RaceRegistry:
+    """
+    Look up races by (race, year), loading them on first access and keeping
+    a size-bounded LRU of the resident ones.  Caches holding data derived
+    from a race (e.g. DistributionCache) register with on_evict to drop it
+    when the race is evicted, so the budget covers them too.
+    """
+
+    def __init__(self, race_store, max_bytes=256 * 2**20):
+        self.race_store = race_store
+        self.max_bytes = max_bytes
+        self._resident = collections.OrderedDict()  # (race, year) -> (Race, size)
+        self._resident_bytes = 0
+        self._lock = threading.Lock()
+        self._eviction_listeners = []
+
+    def on_evict(self, callback):
+        """
+        Call callback(race, year) whenever a race is evicted (or cleared).
+        """
+        self._eviction_listeners.append(callback)
+
+    def _notify_evicted(self, keys):
+        for race, year in keys:
+            for callback in self._eviction_listeners:
+                callback(race, year)
+
+    #-----------#
+    # Metadata
+    #-----------#
+
+    def races(self):
+        """
+        Race names, in catalog order.
+        """
+        return list(self.race_store.races.keys())
+
+    def years(self, race):
+        """
+        Years available for a race, most recent first.
+        """
+        return sorted(self.race_store.races[race].keys(), reverse=True)
+
+    def info(self, race, year):
+        """
+        Catalog entry (dfname, rows, url) for a race year.
+        """
+        return self.race_store.races[race][year]
+
+    @functools.cached_property
+    def athlete_search(self):
+        """
+        Prefix search over the athletes of every race, with (race, year)
+        payloads.  Built on first use from the memory-mapped name columns,
+        without making any race resident.
+        """
+        entries = []
+        for race, years in self.race_store.races.items():
+            for year, info in years.items():
+                for key in self.race_store.load(info['dfname']).athlete_keys:
+                    entries.append((key, (race, year)))
+        return SearchIndex(entries)
+
+    #---------#
+    # Access
+    #---------#
+
+    def get(self, race, year):
+        """
+        Return the loaded Race for (race, year).
+        """
+        key = (race, year)
+        with self._lock:
+            if key in self._resident:
+                self._resident.move_to_end(key)
+                return self._resident[key][0]
+        loaded = self.load(race, year)
+        size = loaded.nbytes + loaded.resident_bytes
+        with self._lock:
+            if key in self._resident:
+                # Another thread loaded it meanwhile; keep theirs
+                self._resident.move_to_end(key)
+                return self._resident[key][0]
+            self._resident[key] = (loaded, size)
+            self._resident_bytes += size
+            evicted = self._evict()
+        self._notify_evicted(evicted)
+        return loaded
+
+    def load(self, race, year):
+        """
+        Load a race from the store and build what the callbacks use.
+        """
+        loaded = self.race_store.load(self.info(race, year)['dfname'])
+        loaded.time_index
+        loaded.athlete_index
+        return loaded
+
+    def load_all(self):
+        """
+        Load every race (as far as the memory budget allows) and build all
+        the athlete searches, e.g. in a server's master process before it
+        forks workers, so the workers share them.  Returns the number of
+        races resident.
+        """
+        for race in self.races():
+            for year in self.years(race):
+                self.get(race, year).athlete_search
+        self.athlete_search
+        return len(self._resident)
+
+    def resident(self):
+        """
+        (race, year) of the resident races, least recently used first.
+        """
+        with self._lock:
+            return list(self._resident)
+
+    def _evict(self):
+        # Drop least recently used races, always keeping the newest one
+        evicted = []
+        while self._resident_bytes > self.max_bytes and len(self._resident) > 1:
+            key, (loaded, size) = self._resident.popitem(last=False)
+            self._resident_bytes -= size
+            evicted.append(key)
+        return evicted
+
+    def __contains__(self, key):
+        return key in self._resident
+
+    @property
+    def resident_bytes(self):
+        return self._resident_bytes
+
+    def clear(self):
+        with self._lock:
+            evicted = list(self._resident)
+            self._resident.clear()
+            self._resident_bytes = 0
+        self._notify_evicted(evicted)
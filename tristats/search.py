@@ -0,0 +1,83 @@
+"""
+Prefix search over athlete names, for search-as-you-type dropdowns.
+
+Every word of every name is kept in one sorted token list, so the names
+matching a typed prefix are a binary search away (the sorted list plays
+the role of a prefix trie).  A query matches a name when each of its words
+is a prefix of some word in the name, e.g. 'li br' matches 'Lindsay Brin'.
+"""
+
+import bisect
+import heapq
+import unicodedata
+
+
+def normalize(text):
+    """
+    Lowercase text and strip accents, so 'Josée' matches 'josee'.
+    """
+    decomposed = unicodedata.normalize('NFKD', text.lower())
+    return ''.join(char for char in decomposed if not unicodedata.combining(char))
+
+
+def tokenize(text):
+    """
+    Searchable words of a name (brackets and punctuation split words).
+    """
+    for char in '()#,.-\'"':
+        text = text.replace(char, ' ')
+    return normalize(text).split()
+
+
+class SearchIndex:
+    """
+    Prefix index over a list of (label, payload) entries.  Results come back
+    with labels that start with the whole query first, then alphabetically.
+    """
+
+    def __init__(self, entries):
+        self.entries = list(entries)
+        self._sort_keys = [normalize(label) for label, payload in self.entries]
+        # Alphabetical order, computed once: entry ids in order, and each entry's position
+        self._alphabetical = sorted(range(len(self.entries)), key=lambda i: (self._sort_keys[i], i))
+        self._rank = [0]*len(self.entries)
+        for position, i in enumerate(self._alphabetical):
+            self._rank[i] = position
+        tokens = sorted((token, i)
+                        for i, (label, payload) in enumerate(self.entries)
+                        for token in set(tokenize(label)))
+        self._tokens = [token for token, i in tokens]
+        self._ids = [i for token, i in tokens]
+
+    def __len__(self):
+        return len(self.entries)
+
+    @property
+    def nbytes(self):
+        # Rough size of the token lists, for memory budgets
+        return sum(len(token) + 80 for token in self._tokens)
+
+    def _prefix_ids(self, prefix):
+        lo = bisect.bisect_left(self._tokens, prefix)
+        hi = bisect.bisect_left(self._tokens, prefix + '\uffff')
+        return set(self._ids[lo:hi])
+
+    def search(self, query, offset=0, limit=20):
+        """
+        Entries matching query, as (total number of matches, the page of
+        (label, payload) entries starting at offset).
+        """
+        words = tokenize(query or '')
+        if not words:
+            # Everything matches: the page is a slice of the alphabetical order
+            return len(self.entries), [self.entries[i] for i in self._alphabetical[offset:offset + limit]]
+        ids = self._prefix_ids(words[0])
+        for word in words[1:]:
+            if not ids:
+                break
+            ids &= self._prefix_ids(word)
+        # Only the entries up to the end of the page need ordering
+        whole = normalize(query).strip()
+        first = heapq.nsmallest(offset + limit, ids,
+                                key=lambda i: (not self._sort_keys[i].startswith(whole), self._rank[i]))
+        return len(ids), [self.entries[i] for i in first[offset:]]
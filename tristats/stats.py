@@ -0,0 +1,218 @@
+"""
+Statistics used to compare an athlete against a distribution of times.
+"""
+
+import collections
+import threading
+
+import numpy as np
+
+from tristats.times import nice_steps, round_half_up
+
+
+def rank_and_percentile(sorted_times, athlete_time):
+    """
+    Rank (1 = fastest) and rounded percentile of an athlete's time within a
+    sorted array of times, found by binary search.  Both are None when the
+    athlete has no time (e.g. didn't finish) or there are no times (e.g. a
+    sport the race didn't time).
+    """
+    if athlete_time is None or len(sorted_times) == 0:
+        return None, None
+    rank = int(np.searchsorted(sorted_times, athlete_time, side='left')) + 1
+    percentile = round_half_up((rank/len(sorted_times))*100)
+    return rank, percentile
+
+
+#-----------#
+# Binning
+#-----------#
+
+# Bin widths (in seconds) that histograms snap to, the same steps as time axis ticks
+nice_bin_widths = nice_steps
+
+
+def bin_width(times):
+    """
+    Histogram bin width for a set of times, by the Freedman-Diaconis rule
+    (Sturges' rule when the interquartile range is 0), snapped to the
+    closest width in nice_bin_widths.
+    """
+    times = np.asarray(times)
+    if len(times) < 2:
+        return int(nice_bin_widths[0])
+    q1, q3 = np.percentile(times, [25, 75])
+    width = 2*(q3 - q1)/len(times)**(1/3)
+    if width <= 0:
+        width = (times.max() - times.min())/(np.log2(len(times)) + 1)
+    if width <= 0:
+        return int(nice_bin_widths[0])
+    return int(nice_bin_widths[np.argmin(np.abs(np.log(nice_bin_widths/width)))])
+
+
+def bin_counts(sorted_times, edges):
+    """
+    Number of times in each [edge, next edge) bin, found by binary search
+    over the sorted times.
+    """
+    return np.diff(np.searchsorted(sorted_times, edges, side='left'))
+
+
+def shared_bins(distributions):
+    """
+    One grid of bin edges covering every distribution, so the histograms
+    line up when overlaid, and each distribution's counts on that grid.
+    The grid uses the coarsest of the distributions' own bin widths, and
+    its edges fall on multiples of the width.  Empty distributions don't
+    widen the grid, and when every distribution is empty there are no
+    bins (no edges, and empty counts).
+    """
+    width = max(distribution.bin_width for distribution in distributions)
+    binned = [distribution.binned(width) for distribution in distributions]
+    spans = [(start, start + len(counts)) for start, counts in binned if len(counts)]
+    if not spans:
+        return np.zeros(0, dtype=int), [np.zeros(0, dtype=counts.dtype) for start, counts in binned]
+    first = min(start for start, end in spans)
+    last = max(end for start, end in spans)
+    edges = np.arange(first, last + 1)*width
+    all_counts = []
+    for start, counts in binned:
+        aligned = np.zeros(last - first, dtype=counts.dtype)
+        if len(counts):
+            aligned[start - first:start - first + len(counts)] = counts
+        all_counts.append(aligned)
+    return edges, all_counts
+
+
+#-----------------#
+# Distributions
+#-----------------#
+
+class Distribution:
+    """
+    Summary of one distribution of times: the sorted times plus their count,
+    quartiles, whiskers, and binned counts.  None of it depends on which
+    athlete is selected, so it's computed once per distribution.
+    """
+
+    def __init__(self, times):
+        self.times = times
+        self.count = len(times)
+        if self.count:
+            self.min = int(times[0])
+            self.max = int(times[-1])
+            self.q1, self.median, self.q3 = (float(q) for q in np.percentile(times, [25, 50, 75]))
+            # Whiskers end at the furthest times within 1.5 IQR of the box
+            iqr = self.q3 - self.q1
+            self.lower_whisker = int(times[np.searchsorted(times, self.q1 - 1.5*iqr, side='left')])
+            self.upper_whisker = int(times[np.searchsorted(times, self.q3 + 1.5*iqr, side='right') - 1])
+        else:
+            self.min = self.max = self.q1 = self.median = self.q3 = np.nan
+            self.lower_whisker = self.upper_whisker = np.nan
+        self.bin_width = bin_width(times)
+        self._binned = {}
+
+    def binned(self, width):
+        """
+        Counts in bins of the given width, aligned to multiples of the width.
+        Returns (index of the first bin, counts).
+        """
+        if width not in self._binned:
+            if self.count:
+                first = self.min//width
+                last = self.max//width + 1
+            else:
+                first = last = 0
+            edges = np.arange(first, last + 1)*width
+            self._binned[width] = (first, bin_counts(self.times, edges))
+        return self._binned[width]
+
+
+class DistributionCache:
+    """
+    Distributions keyed by (race, year, sport, dist type, dist value), filled
+    on first use and evicting the least recently used past max_entries.
+    A distribution's times are a view of its race's arrays, so a race's
+    distributions are dropped when the registry evicts the race (otherwise
+    they'd keep it in memory past the registry's budget).
+    """
+
+    def __init__(self, race_registry, max_entries=4096):
+        self.race_registry = race_registry
+        self.max_entries = max_entries
+        self._distributions = collections.OrderedDict()
+        self._lock = threading.Lock()
+        race_registry.on_evict(self.drop_race)
+
+    def get(self, race, year, sport, dist_type, dist_value):
+        if dist_type == 'All':
+            dist_value = 'All'
+        key = (race, year, sport, dist_type, str(dist_value).lower())
+        with self._lock:
+            if key in self._distributions:
+                self._distributions.move_to_end(key)
+                return self._distributions[key]
+        times = self.race_registry.get(race, year).sorted_times(sport, dist_type, dist_value)
+        distribution = Distribution(times)
+        with self._lock:
+            self._distributions[key] = distribution
+            while len(self._distributions) > self.max_entries:
+                self._distributions.popitem(last=False)
+        if (race, year) not in self.race_registry:
+            # The race was evicted while this was being computed
+            self.drop_race(race, year)
+        return distribution
+
+    def drop_race(self, race, year):
+        """
+        Forget every distribution of a race year.
+        """
+        with self._lock:
+            for key in [key for key in self._distributions if key[:2] == (race, year)]:
+                del self._distributions[key]
+
+    def precompute(self, sports):
+        """
+        Fill the cache with every distribution (whole field, each gender,
+        and each division) of the resident races for the given sports,
+        binned at their own widths.
+        """
+        for race, year in self.race_registry.resident():
+            loaded = self.race_registry.get(race, year)
+            for sport in sports:
+                subsets = [('All', 'All')]
+                subsets += [(dist_type, label) for dist_type in ['Gender', 'Division']
+                            for label in loaded.categories(dist_type.lower())]
+                for dist_type, dist_value in subsets:
+                    distribution = self.get(race, year, sport, dist_type, dist_value)
+                    distribution.binned(distribution.bin_width)
+
+    def __len__(self):
+        return len(self._distributions)
+
+    def clear(self):
+        with self._lock:
+            self._distributions.clear()
+
+
+#--------------#
+# Comparisons
+#--------------#
+
+# Everything the comparison text and plots need for one side of the comparison
+SideStats = collections.namedtuple('SideStats', [
+    'race', 'year', 'athlete', 'dist_type', 'dist_value',
+    'athlete_time', 'distribution', 'rank', 'percentile'
+])
+
+
+def compare_side(distributions, race, year, athlete, dist_type, dist_value, sport):
+    """
+    Look up an athlete's time for a sport and place it within the selected
+    distribution of times (taken from a DistributionCache).
+    """
+    athlete_time = distributions.race_registry.get(race, year).athlete_value(athlete, sport)
+    distribution = distributions.get(race, year, sport, dist_type, dist_value)
+    rank, percentile = rank_and_percentile(distribution.times, athlete_time)
+    return SideStats(race, year, athlete, dist_type, dist_value,
+                     athlete_time, distribution, rank, percentile)
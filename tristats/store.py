@@ -0,0 +1,402 @@
+"""
+Columnar on-disk race store.
+
+Every race is normalized into one canonical column layout at ingest and
+written as one .npy file per column, plus a small meta.json.  Readers
+memory-map the column files, so gunicorn workers share the same pages and
+opening the store does not depend on how many races it holds.
+
+Layout:
+
+    Data_store/
+        catalog.json              race -> year -> dfname, rows, url
+        rockwood18sprint/
+            meta.json             column kinds and category labels
+            name.npy
+            finish.npy
+            ...
+
+Build it with `python -m tristats.store` (see bin/post_compile).
+"""
+
+import argparse
+import collections
+import functools
+import hashlib
+import json
+import os
+import shutil
+
+import numpy as np
+import pandas as pd
+
+from tristats.search import SearchIndex
+from tristats.times import MISSING, minutes_to_seconds, parse_times
+
+
+STORE_VERSION = 2
+
+# MISSING (-1) marks missing entries in integer, category, and time columns
+
+available_sports = ['finish', 'swim', 'bike', 'run', 't1', 't2']
+
+# Canonical layout of a race.  Kinds:
+#   text     - fixed-width unicode
+#   int      - int32, MISSING where absent
+#   category - int16 codes into the labels kept in meta.json
+#   time     - int32 seconds, MISSING where absent
+canonical_columns = [
+    ('place', 'int'),
+    ('no.', 'int'),
+    ('name', 'text'),
+    ('city', 'text'),
+    ('division', 'category'),
+    ('gender', 'category'),
+] + [(sport, 'time') for sport in available_sports]
+
+# Header names used by the different results layouts, mapped to canonical names
+header_replacement = {
+    'div place': 'division place',
+    'div_place': 'division place',
+    'div': 'division',
+    'bib': 'no.',
+    'number': 'no.',
+    'athlete': 'name',
+    'age place': 'division place',
+    'age group': 'division',
+    'gun time': 'finish',
+    'time_total': 'finish',
+    'time_total_hhmmss': 'finish_hhmmss',
+    'swim-swim': 'swim',
+    'bike-bike': 'bike',
+    'bike-enter2': 'bike',
+    'run-run': 'run',
+    'run-finish': 'run',
+    't1-exit1': 't1',
+    't2-exit2': 't2'
+}
+
+
+def load_race_info(path='races.json'):
+    """
+    Read the race catalog (race -> year -> dfname and results url).
+    """
+    with open(path) as f:
+        return json.load(f)
+
+
+#---------#
+# Ingest
+#---------#
+
+def normalize_results(df):
+    """
+    Map a results dataframe (in any of the scraped layouts) onto the
+    canonical column layout.  Returns a dict of column name -> numpy array.
+    """
+    df = df.rename(columns=lambda element: header_replacement.get(element.strip().lower(), element.strip().lower()))
+    # Gender is derived from division when the results don't list it
+    # (left missing where the division is)
+    if 'gender' not in df.columns and 'division' in df.columns:
+        divisions = df['division'].fillna('').astype(str).str.strip()
+        df['gender'] = [('female' if element[:1].lower() == 'f' else 'male') if element else None
+                        for element in divisions]
+    nrows = len(df)
+    columns = {}
+    for name, kind in canonical_columns:
+        present = name in df.columns
+        if kind == 'text':
+            values = df[name].fillna('').astype(str).str.strip() if present else pd.Series([''] * nrows)
+            columns[name] = np.array(list(values), dtype=str) if nrows else np.array([], dtype='U1')
+        elif kind == 'int':
+            values = pd.to_numeric(df[name], errors='coerce') if present else pd.Series([np.nan] * nrows)
+            columns[name] = values.fillna(MISSING).to_numpy().astype(np.int32)
+        elif kind == 'category':
+            if present:
+                values = df[name].astype(str).str.strip().str.lower()
+                values = values.where(df[name].notna() & (values != ''))
+            else:
+                values = pd.Series([np.nan] * nrows)
+            codes, labels = pd.factorize(values, sort=True)
+            columns[name] = (codes.astype(np.int16), [str(label) for label in labels])
+        elif kind == 'time':
+            # Parse the scraped time strings (e.g. 'swim_hhmmss') where the
+            # results kept them, otherwise convert the decimal minutes
+            raw = next((column for column in [name + '_hhmmss', name + '_mmss'] if column in df.columns), None)
+            if raw is not None:
+                columns[name] = parse_times(df[raw].to_numpy(dtype=object))[0]
+            else:
+                values = pd.to_numeric(df[name], errors='coerce') if present else pd.Series([np.nan] * nrows)
+                columns[name] = minutes_to_seconds(values.to_numpy(dtype=np.float64, na_value=np.nan))
+    return columns
+
+
+def write_race(store_dir, dfname, columns):
+    """
+    Write one race's canonical columns (as returned by normalize_results)
+    to store_dir/dfname.  Returns the race's meta dict.
+    """
+    race_dir = os.path.join(store_dir, dfname)
+    os.makedirs(race_dir, exist_ok=True)
+    meta = {'rows': None, 'columns': {}}
+    for name, kind in canonical_columns:
+        values = columns[name]
+        column_meta = {'kind': kind, 'file': name.rstrip('.') + '.npy'}
+        if kind == 'category':
+            values, labels = values
+            column_meta['categories'] = labels
+        np.save(os.path.join(race_dir, column_meta['file']), np.ascontiguousarray(values))
+        meta['columns'][name] = column_meta
+        meta['rows'] = len(values)
+    with open(os.path.join(race_dir, 'meta.json'), 'w') as f:
+        json.dump(meta, f, indent=1)
+    return meta
+
+
+def _hash_race_dir(race_dir, digest):
+    for filename in sorted(os.listdir(race_dir)):
+        with open(os.path.join(race_dir, filename), 'rb') as f:
+            digest.update(filename.encode())
+            digest.update(f.read())
+
+
+def build_store(race_info, csv_dir='Data_output', store_dir='Data_store', race_columns=None):
+    """
+    Normalize every race in race_info from its results csv and write the
+    store.  race_columns, if given, maps dfname -> canonical columns already
+    decoded (e.g. by the ingest pipeline), which are written as they are
+    instead of reading those races' csvs.  The store is built next to
+    store_dir and renamed into place, so concurrent builders never expose a
+    half-written store.
+    """
+    race_columns = race_columns or {}
+    tmp_dir = '{0}.tmp-{1}'.format(store_dir.rstrip(os.sep), os.getpid())
+    shutil.rmtree(tmp_dir, ignore_errors=True)
+    os.makedirs(tmp_dir)
+    digest = hashlib.sha1()
+    catalog = {'store_version': STORE_VERSION, 'races': {}}
+    for race, years in race_info.items():
+        catalog['races'][race] = {}
+        for year, info in years.items():
+            columns = race_columns.get(info['dfname'])
+            if columns is None:
+                path = os.path.join(csv_dir, 'results_{0}.csv'.format(info['dfname']))
+                columns = normalize_results(pd.read_csv(path))
+            meta = write_race(tmp_dir, info['dfname'], columns)
+            _hash_race_dir(os.path.join(tmp_dir, info['dfname']), digest)
+            catalog['races'][race][year] = {
+                'dfname': info['dfname'],
+                'rows': meta['rows'],
+                'url': info.get('url')
+            }
+    catalog['version'] = digest.hexdigest()
+    with open(os.path.join(tmp_dir, 'catalog.json'), 'w') as f:
+        json.dump(catalog, f, indent=1)
+    # Swap the new store into place
+    if os.path.isdir(store_dir):
+        old_dir = '{0}.old-{1}'.format(store_dir.rstrip(os.sep), os.getpid())
+        os.rename(store_dir, old_dir)
+        os.rename(tmp_dir, store_dir)
+        shutil.rmtree(old_dir, ignore_errors=True)
+    else:
+        try:
+            os.rename(tmp_dir, store_dir)
+        except OSError:
+            # Another process finished building first; use theirs
+            shutil.rmtree(tmp_dir, ignore_errors=True)
+    return catalog
+
+
+#----------#
+# Reading
+#----------#
+
+
+class Race:
+    """
+    One race's canonical columns, memory-mapped from the store.
+    """
+
+    def __init__(self, dfname, meta, columns):
+        self.dfname = dfname
+        self.meta = meta
+        self.columns = columns
+
+    def __len__(self):
+        return self.meta['rows']
+
+    @property
+    def nbytes(self):
+        return sum(values.nbytes for values in self.columns.values())
+
+    @property
+    def resident_bytes(self):
+        """
+        Approximate memory held by this race outside the shared mmap pages:
+        the arrays derived from the mapped columns, and the athlete lookups.
+        """
+        size = 0
+        if 'time_index' in self.__dict__:
+            size += sum(values.nbytes for values in self.time_index.values())
+        if 'athlete_index' in self.__dict__:
+            size += sum(len(key) + 64 for key in self.athlete_index) * 2
+        if 'athlete_search' in self.__dict__:
+            size += self.athlete_search.nbytes
+        return size
+
+    def categories(self, name):
+        return self.meta['columns'][name]['categories']
+
+    @functools.cached_property
+    def time_index(self):
+        """
+        Sorted times in seconds (missing times left out) for every sport,
+        for the whole field and for each gender and division, keyed by
+        (sport, dist type, dist value) with lowercase dist type/value
+        (e.g. ('swim', 'gender', 'female')).
+        """
+        time_index = {}
+        for sport in available_sports:
+            times = np.asarray(self.columns[sport])
+            timed = times != MISSING
+            all_times = np.sort(times[timed])
+            all_times.flags.writeable = False
+            time_index[(sport, 'all', 'all')] = all_times
+            for dist_type in ['gender', 'division']:
+                codes = np.asarray(self.columns[dist_type])
+                keep = timed & (codes != MISSING)
+                subset_times, subset_codes = times[keep], codes[keep]
+                # Sort by subset code, then time, so each subset is one sorted run
+                order = np.lexsort((subset_times, subset_codes))
+                subset_times = subset_times[order]
+                subset_times.flags.writeable = False
+                labels = self.categories(dist_type)
+                bounds = np.searchsorted(subset_codes[order], np.arange(len(labels) + 1))
+                for code, label in enumerate(labels):
+                    time_index[(sport, dist_type, label)] = subset_times[bounds[code]:bounds[code + 1]]
+        return time_index
+
+    def sorted_times(self, sport, dist_type='All', dist_value='All'):
+        """
+        Sorted times in seconds (missing times left out) for a sport within
+        the selected distribution ('All', or a 'Gender'/'Division' value).
+        """
+        if dist_type == 'All':
+            key = (sport, 'all', 'all')
+        else:
+            key = (sport, dist_type.lower(), str(dist_value).lower())
+        return self.time_index.get(key, np.empty(0, dtype=np.int32))
+
+    @functools.cached_property
+    def athlete_index(self):
+        """
+        Athlete key -> row.  The key is the athlete's name, or for names that
+        appear more than once, the name plus bib number (or city when bibs
+        don't tell them apart), e.g. 'Jane Smith (#212)'.  If neither does,
+        duplicates are numbered in results order.
+        """
+        names = self.columns['name'].tolist()
+        bibs = self.columns['no.'].tolist()
+        cities = self.columns['city'].tolist()
+        rows_by_name = collections.defaultdict(list)
+        for row, name in enumerate(names):
+            rows_by_name[name].append(row)
+        athlete_index = {}
+        for name, rows in rows_by_name.items():
+            if len(rows) == 1:
+                athlete_index[name] = rows[0]
+                continue
+            dup_bibs = [bibs[row] for row in rows]
+            dup_cities = [cities[row] for row in rows]
+            for count, row in enumerate(rows, 1):
+                if MISSING not in dup_bibs and len(set(dup_bibs)) == len(rows):
+                    key = '{0} (#{1})'.format(name, bibs[row])
+                elif '' not in dup_cities and len(set(dup_cities)) == len(rows):
+                    key = '{0} ({1})'.format(name, cities[row])
+                else:
+                    key = '{0} ({1})'.format(name, count)
+                athlete_index[key] = row
+        return athlete_index
+
+    @functools.cached_property
+    def athlete_keys(self):
+        """
+        Athlete keys in alphabetical order (for the athlete dropdowns).
+        """
+        return sorted(self.athlete_index)
+
+    @functools.cached_property
+    def athlete_search(self):
+        """
+        Prefix search over the athlete keys.
+        """
+        return SearchIndex((key, key) for key in self.athlete_keys)
+
+    def athlete_value(self, athlete, name):
+        """
+        Value of one column for the athlete with the given key (None for a
+        missing category or time).
+        """
+        row = self.athlete_index[athlete]
+        value = self.columns[name][row]
+        kind = self.meta['columns'][name]['kind']
+        if kind == 'category':
+            return self.categories(name)[value] if value != MISSING else None
+        if kind == 'time':
+            return int(value) if value != MISSING else None
+        return value
+
+
+class RaceStore:
+    """
+    Read access to a store written by build_store.
+    """
+
+    def __init__(self, store_dir='Data_store'):
+        self.store_dir = store_dir
+        with open(os.path.join(store_dir, 'catalog.json')) as f:
+            self.catalog = json.load(f)
+        if self.catalog.get('store_version') != STORE_VERSION:
+            raise ValueError('{0} was built with store version {1}, expected {2}; rebuild it with '
+                             '`python -m tristats.store`'.format(store_dir, self.catalog.get('store_version'), STORE_VERSION))
+
+    @property
+    def version(self):
+        return self.catalog['version']
+
+    @property
+    def races(self):
+        return self.catalog['races']
+
+    def load(self, dfname):
+        """
+        Memory-map the columns of one race.
+        """
+        race_dir = os.path.join(self.store_dir, dfname)
+        with open(os.path.join(race_dir, 'meta.json')) as f:
+            meta = json.load(f)
+        columns = {name: np.load(os.path.join(race_dir, column_meta['file']), mmap_mode='r')
+                   for name, column_meta in meta['columns'].items()}
+        return Race(dfname, meta, columns)
+
+
+def open_store(store_dir='Data_store', race_info_path='races.json', csv_dir='Data_output'):
+    """
+    Open the race store, building it from the results csvs first if it
+    doesn't exist yet (e.g. in a fresh checkout).
+    """
+    if not os.path.exists(os.path.join(store_dir, 'catalog.json')):
+        build_store(load_race_info(race_info_path), csv_dir, store_dir)
+    return RaceStore(store_dir)
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Build the columnar race store from the results csvs.')
+    parser.add_argument('--races', default='races.json', help='race catalog (default: races.json)')
+    parser.add_argument('--csv-dir', default='Data_output', help='directory of results_*.csv files')
+    parser.add_argument('--store-dir', default='Data_store', help='store directory to write')
+    args = parser.parse_args()
+    catalog = build_store(load_race_info(args.races), args.csv_dir, args.store_dir)
+    for race, years in catalog['races'].items():
+        for year, info in years.items():
+            print('{0} {1}: {2} rows'.format(race, year, info['rows']))
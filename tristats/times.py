@@ -0,0 +1,186 @@
+"""
+Race times.
+
+Times are held as whole seconds (int32 arrays, MISSING where there's no
+time) from ingest through the store and the statistics, so comparisons and
+ranks are exact.  They're only turned into h:mm:ss text for display.
+"""
+
+import math
+
+import numpy as np
+
+
+# Value used for a missing time
+MISSING = -1
+
+# Steps (in seconds) for time axis ticks: 5, 10, 15, 20, and 30 s,
+# then 1, 2, 3, 5, 10, 15, 20, 30, and 60 min
+nice_steps = np.array([5, 10, 15, 20, 30, 60, 120, 180, 300, 600, 900, 1200, 1800, 3600])
+
+
+def minutes_to_seconds(minutes):
+    """
+    Convert decimal minutes (e.g. 25.183333333333334) to whole seconds,
+    MISSING where the minutes are NaN.
+    """
+    minutes = np.asarray(minutes, dtype=np.float64)
+    seconds = np.full(minutes.shape, MISSING, dtype=np.int32)
+    timed = ~np.isnan(minutes)
+    seconds[timed] = np.rint(minutes[timed]*60)
+    return seconds
+
+
+def round_half_up(value):
+    """
+    Round to the nearest integer, halves up, as JavaScript's Math.round
+    does (Python's round sends halves to the even integer), so the server
+    and the browser show the same numbers.
+    """
+    return int(math.floor(value + 0.5))
+
+
+def format_seconds(seconds):
+    """
+    Format a number of seconds as h:mm:ss, or mm:ss under an hour.
+    """
+    hours, rest = divmod(round_half_up(seconds), 3600)
+    minutes, seconds = divmod(rest, 60)
+    if hours > 0:
+        return '%d:%02d:%02d' % (hours, minutes, seconds)
+    return '%02d:%02d' % (minutes, seconds)
+
+
+def time_ticks(low, high, max_ticks=8):
+    """
+    Tick positions and h:mm:ss labels for a time axis covering low..high
+    seconds, at the smallest nice step giving at most max_ticks ticks.
+    """
+    span = max(high - low, 1)
+    step = int(nice_steps[-1])
+    for nice_step in nice_steps:
+        if span/nice_step <= max_ticks:
+            step = int(nice_step)
+            break
+    tickvals = list(range(int(low//step)*step, int(-(-high//step))*step + 1, step))
+    return tickvals, [format_seconds(tick) for tick in tickvals]
+
+
+#-----------#
+# Parsing
+#-----------#
+
+# Status of each parsed time
+OK = 0
+BLANK = 1
+DNF = 2
+DNS = 3
+DQ = 4
+INVALID = 5
+
+# Non-time entries found in results tables (compared after stripping and uppercasing)
+status_markers = {
+    '': BLANK,
+    '-': BLANK,
+    '--': BLANK,
+    'NAN': BLANK,
+    'NONE': BLANK,
+    'DNF': DNF,
+    'DNS': DNS,
+    'DQ': DQ,
+    'DSQ': DQ,
+    'DISQ': DQ,
+}
+
+# Longest cell (once stripped) that parse_times scans as a time, with room
+# to spare over e.g. '12:34:56.789'
+max_time_length = 16
+
+_DIGIT_0, _COLON, _DOT = ord('0'), ord(':'), ord('.')
+_SPACE, _NBSP = ord(' '), 0xa0
+
+
+def parse_times(values, scale=1):
+    """
+    Parse a column of time strings (hh:mm:ss, h:mm:ss, mm:ss, m:ss, with
+    optional fractional seconds, e.g. '1:05:51' or '05:51.3').  The strings
+    are viewed as a matrix of character codes and scanned one character
+    position at a time across all rows, so there's no Python-level work
+    per cell.  Cells longer than max_time_length once stripped can't be
+    times, and are left out of the matrix.
+
+    Returns (times, status): times as an int32 array in units of 1/scale
+    seconds (whole seconds by default, rounded), MISSING where there's no
+    time, and a uint8 array of OK, BLANK, DNF, DNS, DQ, or INVALID.
+    Empty cells, NaN, and None are BLANK.
+    """
+    strings = np.asarray(values, dtype=str).ravel()
+    rows = len(strings)
+    # Cells too long to be times (rare: notes, stray text) would widen the
+    # character matrix for every row, so they're stripped, and left blank
+    # in it if they're still too long
+    cells = strings
+    long = np.char.str_len(strings) > max_time_length
+    if long.any():
+        stripped = np.char.strip(strings[long])
+        stripped[np.char.str_len(stripped) > max_time_length] = ''
+        cells = np.zeros(rows, dtype='U{0}'.format(max_time_length))
+        cells[~long] = strings[~long]
+        cells[long] = stripped
+    width = max(cells.dtype.itemsize//4, 1)
+    chars = np.ascontiguousarray(cells, dtype='U{0}'.format(width)).view(np.uint32).reshape(rows, width)
+
+    ok = np.ones(rows, dtype=bool)
+    whole = np.zeros(rows, dtype=np.int64)       # complete fields so far, in seconds
+    field = np.zeros(rows, dtype=np.int64)       # value of the field being read
+    field_digits = np.zeros(rows, dtype=np.int64)
+    colons = np.zeros(rows, dtype=np.int64)
+    fraction = np.zeros(rows, dtype=np.float64)
+    place = np.ones(rows, dtype=np.float64)
+    in_fraction = np.zeros(rows, dtype=bool)
+    started = np.zeros(rows, dtype=bool)
+    ended = np.zeros(rows, dtype=bool)
+    last_digit = np.zeros(rows, dtype=bool)
+    for column in range(width):
+        char = chars[:, column]
+        # Padding (code 0), spaces, tabs, newlines, and non-breaking spaces
+        blank = (char == 0) | (char == _SPACE) | ((char >= 9) & (char <= 13)) | (char == _NBSP)
+        digit = (char >= _DIGIT_0) & (char <= _DIGIT_0 + 9)
+        colon = char == _COLON
+        dot = char == _DOT
+        value = char.astype(np.int64) - _DIGIT_0
+        # Only digits and separators, with no gaps, and separators between digits
+        ok &= digit | colon | dot | blank
+        ok &= ~(ended & ~blank)
+        ok &= ~((colon | dot) & ~last_digit)
+        ok &= ~((colon | dot) & in_fraction)
+        # A colon closes a field: minutes (closed by a second colon) must be
+        # under 60, and the first field can't be absurdly long
+        ok &= ~(colon & (colons == 1) & ((field >= 60) | (field_digits > 2)))
+        ok &= ~(colon & (field_digits > 4))
+        whole = np.where(colon, (whole + field)*60, whole)
+        field = np.where(colon, 0, field)
+        field_digits = np.where(colon, 0, field_digits)
+        colons += colon
+        # Digits extend the current field, or the fractional seconds
+        integer_digit = digit & ~in_fraction
+        field = np.where(integer_digit, field*10 + value, field)
+        field_digits += integer_digit
+        fraction_digit = digit & in_fraction
+        place = np.where(fraction_digit, place/10, place)
+        fraction = np.where(fraction_digit, fraction + value*place, fraction)
+        in_fraction |= dot
+        ended |= started & blank
+        started |= ~blank
+        last_digit = np.where(blank, last_digit, digit)
+    # Seconds are always two digits and under 60
+    ok &= last_digit & ((colons == 1) | (colons == 2)) & (field_digits == 2) & (field < 60)
+
+    times = np.full(rows, MISSING, dtype=np.int32)
+    times[ok] = np.rint((whole[ok] + field[ok] + fraction[ok])*scale)
+    status = np.full(rows, INVALID, dtype=np.uint8)
+    status[ok] = OK
+    # Non-times are rare, so their markers are looked up per cell
+    for row in np.flatnonzero(~ok):
+        status[row] = status_markers.get(strings[row].strip().upper(), INVALID)
+    return times, status